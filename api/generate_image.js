@@ -1,5 +1,6 @@
 // Same-origin image generation API for Vercel (@vercel/node)
 // Proxies a request to CLOUDSWAY chat completions endpoint and returns generated image.
+import { gunzipSync } from 'zlib';
 
 export default async function handler(req, res) {
   // Basic CORS
@@ -9,6 +10,7 @@ export default async function handler(req, res) {
     'Access-Control-Allow-Headers',
     [
       'Content-Type',
+      'Content-Encoding',
       'Accept',
       'Authorization',
       'X-API-KEY',
@@ -40,7 +42,10 @@ export default async function handler(req, res) {
   });
   let jsonBody = {};
   try {
-    const str = bodyBuf && bodyBuf.length ? bodyBuf.toString('utf8') : '{}';
+    // Batch clients gzip their request bodies (the reference image dominates the payload)
+    const gzipped = /^gzip$/i.test(String(req.headers['content-encoding'] || '').trim());
+    const raw = gzipped && bodyBuf && bodyBuf.length ? gunzipSync(bodyBuf) : bodyBuf;
+    const str = raw && raw.length ? raw.toString('utf8') : '{}';
     jsonBody = JSON.parse(str);
   } catch (e) {
     res.statusCode = 400;
@@ -92,6 +97,12 @@ export default async function handler(req, res) {
       imageSize
     }
   };
+  // Clients send a stable hash of their static prompt prefix; OpenAI-compatible upstreams
+  // can use it as a prompt cache key. Opt-in because not every upstream accepts the field.
+  const promptPrefixHash = String(jsonBody.prompt_prefix_hash || '').trim();
+  if (process.env.CLOUDSWAY_PROMPT_CACHE_KEY === '1' && /^[0-9a-f]{8,64}$/i.test(promptPrefixHash)) {
+    payload.prompt_cache_key = promptPrefixHash;
+  }
 
   // Timeout control
   const timeoutMs = (() => {
@@ -1,60 +1,924 @@
 import json
 import requests
+from requests.adapters import HTTPAdapter
 import base64
+import string
+import binascii
 import os
 import re
+import sys
+import math
 import time
+import random
+import zlib
+import uuid
+import queue
+import atexit
+import hashlib
+import argparse
+import functools
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    from PIL import Image, ImageOps  # 可选依赖：未安装时跳过参考图压缩
+except ImportError:
+    Image = ImageOps = None
 
 # ================= 配置区域 =================
 # 同源生图接口地址（优先使用 dev proxy / vercel 同源，避免跨域与密钥暴露）
 API_ENDPOINT = os.environ.get("SAME_IMAGE_ENDPOINT", "http://127.0.0.1:8788/generate_image").strip()
 OUTPUT_DIR = "generated_comics"
+# 批量模式：每个接口地址的请求速率上限（次/秒），以及 429/5xx 的重试次数与退避基数（秒）
+RATE_LIMIT_RPS = float(os.environ.get("COMIC_RATE_LIMIT_RPS", "1"))
+MAX_RETRIES = int(os.environ.get("COMIC_MAX_RETRIES", "4"))
+RETRY_BASE_DELAY = float(os.environ.get("COMIC_RETRY_BASE_DELAY", "2"))
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# HTTP 连接：共享 Session 的连接池大小、连接/读取超时（秒）、请求体 gzip 压缩
+HTTP_POOL_SIZE = int(os.environ.get("COMIC_HTTP_POOL_SIZE", "8"))
+CONNECT_TIMEOUT = float(os.environ.get("COMIC_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.environ.get("COMIC_READ_TIMEOUT", "120"))
+REQUEST_GZIP = os.environ.get("COMIC_REQUEST_GZIP", "1").lower() not in ("0", "false", "no", "off")
+REQUEST_GZIP_LEVEL = int(os.environ.get("COMIC_REQUEST_GZIP_LEVEL", "6"))
+# 压缩请求收到这些状态码（及 5xx）时改为原文重发一次；401/403/404 等与请求体无关，原样返回
+GZIP_FALLBACK_STATUS = {400, 411, 415}
+# 参考图 base64 缓存上限（字节），同一角色图在批量中只编码一次
+REF_CACHE_BYTES = int(os.environ.get("COMIC_REF_CACHE_BYTES", str(64 * 1024 * 1024)))
+BODY_CHUNK_SIZE = 64 * 1024
+# 参考图预处理：长边缩到 REF_MAX_EDGE 以内并重新编码（需要 Pillow），结果按内容哈希缓存到磁盘
+REF_PREPROCESS = os.environ.get("COMIC_REF_PREPROCESS", "1").lower() not in ("0", "false", "no", "off")
+REF_MAX_EDGE = int(os.environ.get("COMIC_REF_MAX_EDGE", "1536"))
+REF_FORMAT = os.environ.get("COMIC_REF_FORMAT", "webp").lower()
+REF_QUALITY = int(os.environ.get("COMIC_REF_QUALITY", "85"))
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "comic_prompts")
+SANITIZE_TERMS_FILE = os.environ.get("COMIC_SANITIZE_TERMS", os.path.join(PROMPTS_DIR, "sanitize_terms.txt"))
+PROMPT_TEMPLATE_FILE = os.environ.get("COMIC_PROMPT_TEMPLATE", os.path.join(PROMPTS_DIR, "comic_page.txt"))
+REF_CACHE_DIR = os.environ.get("COMIC_REF_CACHE_DIR", os.path.join(OUTPUT_DIR, ".ref_cache"))
+# 请求追踪：按 COMIC_TRACE_SAMPLE 比例（0~1）采样，把分段 span 异步写入 JSONL，可与 dev proxy 的日志合并查看
+TRACE_SAMPLE = float(os.environ.get("COMIC_TRACE_SAMPLE", "0"))
+TRACE_FILE = os.environ.get("COMIC_TRACE_FILE", os.path.join(OUTPUT_DIR, "trace_spans.jsonl"))
+_REF_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg"), "jpg": ("JPEG", "image/jpeg"), "png": ("PNG", "image/png")}
 
 # ================= 辅助函数 =================
 
-def encode_image_to_base64(image_path):
-    """读取图片并转换为Base64字符串"""
-    if not os.path.exists(image_path):
+class ReferenceImage:
+    """编码好的参考图：base64 只保存一份（ASCII 字节），发送时按块直接写入请求体"""
+    __slots__ = ("path", "mime", "b64", "original_bytes", "sent_bytes")
+
+    def __init__(self, path, mime, b64, original_bytes=0, sent_bytes=0):
+        self.path = path
+        self.mime = mime
+        self.b64 = b64
+        self.original_bytes = original_bytes
+        self.sent_bytes = sent_bytes
+
+    def data_url(self):
+        return f"data:{self.mime};base64,{self.b64.decode('ascii')}"
+
+
+_REF_CACHE = OrderedDict()
+_REF_CACHE_LOCK = threading.Lock()
+_ref_cache_used = 0
+
+
+def _b64_encode_file(image_path, size):
+    """分块读取文件并编码进预先分配好的缓冲区，避免整文件 bytes + str 的多份拷贝"""
+    out = bytearray(4 * ((size + 2) // 3))
+    pos = 0
+    with open(image_path, "rb") as image_file:
+        while True:
+            # 块大小是 3 的倍数，拼接后的结果与整体编码一致
+            chunk = image_file.read(3 * BODY_CHUNK_SIZE)
+            if not chunk:
+                break
+            encoded = base64.b64encode(chunk)
+            out[pos:pos + len(encoded)] = encoded
+            pos += len(encoded)
+    if pos != len(out):
+        # 读取过程中文件被改动
+        del out[pos:]
+    return out
+
+
+def sniff_image_mime(image_path):
+    """根据文件头判断图片类型，无法识别时按 PNG 处理"""
+    with open(image_path, "rb") as f:
+        head = f.read(12)
+    if head.startswith(b"\x89PNG"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "image/png"
+
+
+_pillow_warned = False
+
+
+def preprocess_reference_image(image_path):
+    """缩小并重新编码参考图，返回 (实际上传的文件路径, MIME)。
+
+    结果以 “内容哈希 + 参数” 命名缓存在 REF_CACHE_DIR，同一张图只处理一次；
+    关闭预处理、未安装 Pillow、处理失败或结果没有变小时都返回原图。
+    """
+    global _pillow_warned
+    original = (image_path, sniff_image_mime(image_path))
+    if not REF_PREPROCESS:
+        return original
+    if Image is None:
+        if not _pillow_warned:
+            _pillow_warned = True
+            print("   ⚠️ 未安装 Pillow，跳过参考图压缩（pip install Pillow）")
+        return original
+    pil_format, mime = _REF_FORMATS.get(REF_FORMAT, _REF_FORMATS["webp"])
+
+    digest = hashlib.sha256()
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    ext = "jpg" if pil_format == "JPEG" else pil_format.lower()
+    cache_path = os.path.join(REF_CACHE_DIR, f"{digest.hexdigest()[:32]}_{REF_MAX_EDGE}_{REF_QUALITY}.{ext}")
+
+    if not os.path.exists(cache_path):
+        tmp_path = None
+        try:
+            os.makedirs(REF_CACHE_DIR, exist_ok=True)
+            with Image.open(image_path) as img:
+                img = ImageOps.exif_transpose(img)
+                img.thumbnail((REF_MAX_EDGE, REF_MAX_EDGE), Image.LANCZOS)
+                if pil_format == "JPEG" and img.mode != "RGB":
+                    # JPEG 不支持透明通道，铺白底
+                    background = Image.new("RGB", img.size, (255, 255, 255))
+                    rgba = img.convert("RGBA")
+                    background.paste(rgba, mask=rgba.getchannel("A"))
+                    img = background
+                elif img.mode not in ("RGB", "RGBA"):
+                    img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+                fd, tmp_path = tempfile.mkstemp(dir=REF_CACHE_DIR, suffix=".part")
+                with os.fdopen(fd, "wb") as out:
+                    img.save(out, format=pil_format, quality=REF_QUALITY, optimize=True)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            print(f"   ⚠️ 参考图压缩失败，使用原图: {e}")
+            return original
+
+    if os.path.getsize(cache_path) >= os.path.getsize(image_path):
+        return original
+    return cache_path, mime
+
+
+def load_reference_image(image_path):
+    """读取参考图并编码为 base64，按 (路径, mtime, 大小) 做 LRU 缓存"""
+    global _ref_cache_used
+    try:
+        st = os.stat(image_path)
+    except OSError:
         print(f"⚠️ 警告: 参考图路径不存在 {image_path}")
         return None
-    with open(image_path, "rb") as image_file:
-        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-        return f"data:image/png;base64,{encoded_string}"
+    key = (os.path.abspath(image_path), st.st_mtime_ns, st.st_size)
+    with _REF_CACHE_LOCK:
+        ref = _REF_CACHE.get(key)
+        if ref is not None:
+            _REF_CACHE.move_to_end(key)
+            return ref
+    upload_path, mime = preprocess_reference_image(image_path)
+    upload_size = st.st_size if upload_path == image_path else os.path.getsize(upload_path)
+    ref = ReferenceImage(image_path, mime, _b64_encode_file(upload_path, upload_size), st.st_size, upload_size)
+    with _REF_CACHE_LOCK:
+        if key not in _REF_CACHE:
+            _REF_CACHE[key] = ref
+            _ref_cache_used += len(ref.b64)
+            while _ref_cache_used > REF_CACHE_BYTES and len(_REF_CACHE) > 1:
+                _, old = _REF_CACHE.popitem(last=False)
+                _ref_cache_used -= len(old.b64)
+    return ref
+
+
+def encode_image_to_base64(image_path):
+    """读取图片并转换为Base64字符串"""
+    ref = load_reference_image(image_path)
+    return ref.data_url() if ref else None
+
+class _Base64FileWriter:
+    """增量 base64 解码：按块写入同目录下的临时文件，commit 时原子重命名为目标文件"""
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        directory = os.path.dirname(output_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+        self._carry = b""
+        self.bytes_written = 0
+        # 追踪用：首次/末次解码的时刻、解码累计耗时、落盘（关闭+重命名）起止时刻
+        self.decode_started = None
+        self.decode_finished = None
+        self.decode_busy = 0.0
+        self.save_started = None
+        self.save_finished = None
+
+    def write(self, data):
+        started = time.perf_counter()
+        if self.decode_started is None:
+            self.decode_started = started
+        # 有的服务端按 76 列给 base64 折行：JSON 里的 \n 转义还原后，或 save_base64_image 传进来的字符串里，都会带换行
+        data = self._carry + data.translate(None, b" \t\r\n")
+        # 只解码 4 的整数倍，剩下的留到下一块
+        usable = len(data) - len(data) % 4
+        self._carry = data[usable:]
+        if usable:
+            decoded = binascii.a2b_base64(data[:usable])
+            self._file.write(decoded)
+            self.bytes_written += len(decoded)
+        self.decode_finished = time.perf_counter()
+        self.decode_busy += self.decode_finished - started
+
+    def flush(self):
+        """解码剩下不足 4 字符的尾巴（补齐 =），之后 bytes_written 即为整张图的大小"""
+        if self._carry:
+            decoded = binascii.a2b_base64(self._carry + b"=" * (-len(self._carry) % 4))
+            self._carry = b""
+            self._file.write(decoded)
+            self.bytes_written += len(decoded)
+
+    def commit(self):
+        self.flush()
+        self.save_started = time.perf_counter()
+        self._file.close()
+        os.replace(self.tmp_path, self.output_path)
+        self.save_finished = time.perf_counter()
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
 
 def save_base64_image(base64_str, output_path):
-    """保存Base64图片到本地"""
+    """保存Base64图片到本地（分块解码，写完后原子替换，不会留下半张图）"""
+    writer = None
     try:
-        if "," in base64_str:
-            base64_str = base64_str.split(",", 1)[1]
-        img_data = base64.b64decode(base64_str)
-        with open(output_path, "wb") as f:
-            f.write(img_data)
+        start = base64_str.find(",") + 1
+        writer = _Base64FileWriter(output_path)
+        for offset in range(start, len(base64_str), BODY_CHUNK_SIZE):
+            writer.write(base64_str[offset:offset + BODY_CHUNK_SIZE].encode("ascii"))
+        writer.commit()
         return True
     except Exception as e:
+        if writer:
+            writer.abort()
         print(f"❌ 保存图片失败 {output_path}: {e}")
         return False
 
-def call_image_api(prompt_text, base64_ref_img, aspect_ratio="2:3", image_size="2k"):
-    """调用同源生图接口 /generate_image，返回包含 image_data_url 的 JSON。"""
+
+_IMAGE_KEY_RE = re.compile(rb'"image_data_url"\s*:\s*"')
+_JSON_ESCAPE_RE = re.compile(rb'\\(?:u([0-9a-fA-F]{4})|([^u]))')
+# 块尾没写完的转义（"\" 或 "\u12"），前面的反斜杠须是偶数个才不是被转义的
+_JSON_PARTIAL_ESCAPE_RE = re.compile(rb'(?<!\\)(?:\\\\)*(\\(?:u[0-9a-fA-F]{0,3})?)$')
+_JSON_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f", b"/": b"/", b"\\": b"\\", b'"': b'"'}
+
+
+def _json_unescape(match):
+    if match.group(1) is not None:
+        return chr(int(match.group(1), 16)).encode("utf-8", "replace")
+    return _JSON_ESCAPES.get(match.group(2), match.group(2))
+
+
+def _json_string_end(buf):
+    """JSON 字符串片段里第一个没被转义的引号位置，没有则返回 -1"""
+    end = buf.find(b'"')
+    while end > 0:
+        start = end
+        while start > 0 and buf[start - 1] == 0x5C:  # 0x5C 即反斜杠
+            start -= 1
+        if (end - start) % 2 == 0:
+            break
+        end = buf.find(b'"', end + 1)
+    return end
+
+
+def _stream_image_response(response, output_path, trace=None):
+    """边读响应边从 JSON 里找出 image_data_url 并解码写盘，整张图不会完整进入内存。
+
+    成功返回 {"image_path", "bytes"}；响应里没有图片字段时返回空 dict。
+    传入 trace（RequestTrace）时记录 decode / save 两个 span。
+    """
+    writer = None
+    state = "key"  # key → prefix → data → done
+    buf = b""
+    head = b""
+    chunks = response.iter_content(BODY_CHUNK_SIZE)
+    try:
+        for chunk in chunks:
+            if len(head) < 300:
+                head += chunk[:300 - len(head)]
+            buf += chunk
+            if state == "key":
+                match = _IMAGE_KEY_RE.search(buf)
+                if not match:
+                    # 键名可能跨块，保留一小段尾巴
+                    buf = buf[-64:]
+                    continue
+                buf = buf[match.end():]
+                state = "prefix"
+            if state == "prefix":
+                if buf.startswith(b"data:"):
+                    comma = buf.find(b",")
+                    if comma < 0:
+                        if len(buf) < 256 and b'"' not in buf:
+                            continue
+                        break
+                    buf = buf[comma + 1:]
+                elif b"data:".startswith(buf):
+                    continue
+                writer = _Base64FileWriter(output_path)
+                state = "data"
+            end = _json_string_end(buf)
+            data = buf if end < 0 else buf[:end]
+            keep = b""
+            if b"\\" in data:
+                # 按 JSON 转义还原（\/、折行的 \n、\uXXXX 等）；被块边界截断的转义留到下一块
+                if end < 0:
+                    partial = _JSON_PARTIAL_ESCAPE_RE.search(data)
+                    if partial:
+                        data, keep = data[:partial.start(1)], data[partial.start(1):]
+                data = _JSON_ESCAPE_RE.sub(_json_unescape, data)
+            writer.write(data)
+            buf = keep
+            if end >= 0:
+                state = "done"
+                break
+        if state != "done":
+            if writer:
+                writer.abort()
+            print(f"   ⚠️ 响应中没有完整的 image_data_url: {head[:200].decode('utf-8', 'replace')}")
+            return {}
+        writer.flush()
+        if writer.bytes_written == 0:
+            # 空的 image_data_url 等同于没返回图片，不能留下 0 字节的文件让续跑误以为已完成
+            writer.abort()
+            print(f"   ⚠️ 响应中的 image_data_url 为空: {head[:200].decode('utf-8', 'replace')}")
+            return {}
+        writer.commit()
+        if trace is not None:
+            trace.span("decode", writer.decode_started, writer.decode_finished,
+                       busy_ms=round(writer.decode_busy * 1000, 3), bytes=writer.bytes_written)
+            trace.span("save", writer.save_started, writer.save_finished, path=output_path)
+        # 读完 JSON 剩余的部分，连接才能回到连接池复用
+        for _ in chunks:
+            pass
+        return {"image_path": output_path, "bytes": writer.bytes_written}
+    except BaseException:
+        if writer:
+            writer.abort()
+        raise
+    finally:
+        response.close()
+
+
+def self_test_stream_decode():
+    """回归检查：各种块大小下，带 JSON 转义（折行 \\n、\\/、\\uXXXX）的 image_data_url 都能还原成原图"""
+    class FakeResponse:
+        def __init__(self, body, size):
+            self.body = body
+            self.size = size
+
+        def iter_content(self, chunk_size):
+            for offset in range(0, len(self.body), self.size):
+                yield self.body[offset:offset + self.size]
+
+        def close(self):
+            pass
+
+    raw = bytes(range(256)) * 40 + b"\xfb\xff\xfe"
+    b64 = base64.b64encode(raw).decode("ascii")
+    wrapped = "\r\n".join(b64[i:i + 76] for i in range(0, len(b64), 76))
+    variants = {
+        "折行 \\r\\n": json.dumps({"image_data_url": "data:image/png;base64," + wrapped}),
+        "转义 \\/": json.dumps({"image_data_url": "data:image/png;base64," + b64}).replace("/", "\\/"),
+        "\\uXXXX": json.dumps({"image_data_url": "data:image/png;base64," + b64}).replace("+", "\\u002B"),
+    }
+    output_path = os.path.join(tempfile.gettempdir(), "banana_stream_decode_test.bin")
+    failures = 0
+    try:
+        for label, body in variants.items():
+            body = body.encode("ascii")
+            for size in (1, 2, 3, 5, 7, 64, len(body)):
+                result = _stream_image_response(FakeResponse(body, size), output_path)
+                with open(output_path, "rb") as f:
+                    ok = result.get("bytes") == len(raw) and f.read() == raw
+                if not ok:
+                    failures += 1
+                    print(f"❌ {label} 块大小 {size}: 解码结果与原图不一致")
+    finally:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+    for body in (b'{"image_data_url": ""}', b'{"image_data_url": "data:image/png;base64,"}'):
+        if _stream_image_response(FakeResponse(body, 7), output_path) != {} or os.path.exists(output_path):
+            failures += 1
+            print(f"❌ 空图片应视为未返回: {body.decode('ascii')}")
+    print("✅ 流式解码自检通过" if not failures else f"❌ 流式解码自检失败 {failures} 项")
+    return failures == 0
+
+
+class RateLimiter:
+    """令牌桶限速（线程安全）：平均 rate 次/秒，最多积攒 burst 个令牌"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_RATE_LIMITERS = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+def get_rate_limiter(endpoint):
+    """每个接口地址共用一个限速器"""
+    with _RATE_LIMITERS_LOCK:
+        limiter = _RATE_LIMITERS.get(endpoint)
+        if limiter is None:
+            limiter = _RATE_LIMITERS[endpoint] = RateLimiter(RATE_LIMIT_RPS)
+        return limiter
+
+
+def _backoff_delay(attempt, retry_after=None):
+    """指数退避 + 抖动；服务端给了 Retry-After（秒）时以它为下限"""
+    delay = RETRY_BASE_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5)
+    try:
+        if retry_after:
+            delay = max(delay, float(retry_after))
+    except ValueError:
+        pass
+    return delay
+
+
+def trace_sampled(request_id, rate=TRACE_SAMPLE):
+    """按请求 ID 的哈希决定是否采样；dev proxy 用同样的算法，同一比例下两边采到的是同一批请求"""
+    if rate <= 0:
+        return False
+    return rate >= 1 or int(hashlib.sha1(request_id.encode("utf-8")).hexdigest()[:8], 16) / 0x100000000 < rate
+
+
+class SpanLog:
+    """异步 span 日志：请求线程只把记录放进有界队列，后台线程负责序列化和写盘；队列满时丢弃并计数"""
+
+    def __init__(self, path, side="client", max_queue=10000):
+        self.path = path
+        self.side = side
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def emit(self, trace_id, span, start, end, **attrs):
+        """start/end 为 time.time() 时间戳（秒）"""
+        record = {"trace_id": trace_id, "side": self.side, "span": span, "start": round(start, 6),
+                  "end": round(end, 6), "ms": round((end - start) * 1000, 3)}
+        record.update(attrs)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-log", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                record = self._queue.get()
+                lines = []
+                while record is not None:
+                    lines.append(json.dumps(record, ensure_ascii=False))
+                    try:
+                        record = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                if lines:
+                    f.write("\n".join(lines) + "\n")
+                    f.flush()
+                if record is None:
+                    return
+
+    def close(self, timeout=2.0):
+        """程序退出前把队列里剩下的记录写完"""
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                return
+            self._thread.join(timeout)
+
+
+SPAN_LOG = SpanLog(TRACE_FILE)
+
+
+class RequestTrace:
+    """一次 call_image_api 的追踪上下文：span 用 perf_counter 计时，写出时换算成墙钟时间；未采样时为空操作"""
+
+    def __init__(self, request_id=None, sampled=None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.sampled = trace_sampled(self.request_id) if sampled is None else sampled
+        self._anchor = time.time() - time.perf_counter()
+
+    def headers(self):
+        headers = {"X-Request-ID": self.request_id}
+        if self.sampled:
+            headers["X-Trace-Sampled"] = "1"
+        return headers
+
+    def span(self, name, start, end, **attrs):
+        if self.sampled and start is not None and end is not None:
+            SPAN_LOG.emit(self.request_id, name, self._anchor + start, self._anchor + end, **attrs)
+
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+# 不接受 gzip 请求体的接口地址：gzip 请求出错、随后原文重发成功才记入
+_GZIP_REJECTED = set()
+
+
+def get_session():
+    """进程内共享的 requests.Session：keep-alive 复用连接，连接数不超过 HTTP_POOL_SIZE"""
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            session = requests.Session()
+            # 重试由 call_image_api 自己处理；池满时等待空闲连接，而不是临时新建再丢弃
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, pool_block=True)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _SESSION = session
+        return _SESSION
+
+
+def _request_body_chunks(head, b64, tail):
+    """JSON 头尾 + base64 缓冲区的 memoryview 分片（不拷贝图片数据）"""
+    view = memoryview(b64)
+    return [head] + [view[offset:offset + BODY_CHUNK_SIZE] for offset in range(0, len(view), BODY_CHUNK_SIZE)] + [tail]
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(REQUEST_GZIP_LEVEL, zlib.DEFLATED, 31)
+    out = [compressor.compress(chunk) for chunk in chunks]
+    out.append(compressor.flush())
+    return [chunk for chunk in out if chunk]
+
+
+class _ImageRequestBody:
+    """可迭代的请求体：提供 __len__ 让 requests 带上 Content-Length，按块发送并记录上传起止时间"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.length = sum(len(chunk) for chunk in chunks)
+        self.upload_started = None
+        self.upload_finished = None
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        self.upload_started = time.perf_counter()
+        for chunk in self.chunks:
+            yield chunk
+        self.upload_finished = time.perf_counter()
+
+
+def _drain(response):
+    """读完（很小的）错误响应体再关闭，连接可以回到连接池；读取失败就直接丢弃连接"""
+    try:
+        response.content
+    except requests.RequestException:
+        pass
+    response.close()
+
+
+def format_timing(timing):
+    """把 call_image_api 记录的分段耗时格式化成一行"""
+    if not timing:
+        return ""
+    text = (f"连接 {timing['connect']:.2f} / 上传 {timing['upload']:.2f} / "
+            f"等待 {timing['wait']:.2f} / 下载 {timing['download']:.2f} 秒")
+    text += f"，请求体 {timing['sent_bytes'] / 1024:.0f} KB"
+    if timing["gzip"]:
+        text += f"（gzip，压缩 {timing['compress']:.2f} 秒）"
+    if timing["attempts"] > 1:
+        text += f"，第 {timing['attempts']} 次尝试"
+    if timing.get("traced"):
+        text += f"，trace {timing['request_id']}"
+    return f"（{text}）"
+
+
+def call_image_api(prompt_text, base64_ref_img, aspect_ratio="2:3", image_size="2k", max_retries=MAX_RETRIES,
+                   output_path=None, prompt_prefix_hash=None, timing=None):
+    """调用同源生图接口 /generate_image，返回包含 image_data_url 的 JSON。
+
+    传入 output_path 时以流式读取响应，把图片边解码边写到该路径，
+    返回 {"image_path", "bytes"}（响应里没有图片时为空 dict）。
+    prompt_prefix_hash 是提示词静态前缀的哈希，接口可据此复用上游的前缀缓存。
+    遇到 429/5xx 或连接错误时按抖动退避重试，最多 max_retries 次。
+    传入 timing（dict）时写入最后一次请求的连接/上传/等待/下载分段耗时和 request_id。
+    每次调用带一个 X-Request-ID（重试沿用同一个），dev proxy 会用它关联两边的 span 日志。
+    """
+    call_started = time.perf_counter()
+    trace = RequestTrace()
     headers = {
         'Content-Type': 'application/json',
         'Accept': 'application/json'
     }
+    headers.update(trace.headers())
+
+    if isinstance(base64_ref_img, ReferenceImage):
+        # 带上 data: 前缀，接口据此识别真实的图片类型
+        image_prefix, image_b64 = f"data:{base64_ref_img.mime};base64,", base64_ref_img.b64
+    else:
+        image_prefix, image_b64 = "", (base64_ref_img or "").encode("ascii")
+    # base64 字符在 JSON 字符串里无需转义，可以原样拼进请求体
+    head = json.dumps({"prompt": prompt_text}, ensure_ascii=False)[:-1] + ', "image_base64": "' + image_prefix
+    extra = {"aspect_ratio": aspect_ratio, "image_size": image_size}
+    if prompt_prefix_hash:
+        extra["prompt_prefix_hash"] = prompt_prefix_hash
+    tail = '", ' + json.dumps(extra, ensure_ascii=False)[1:]
+    head, tail = head.encode("utf-8"), tail.encode("utf-8")
+
+    plain_chunks = _request_body_chunks(head, image_b64, tail)
+    use_gzip = REQUEST_GZIP and API_ENDPOINT not in _GZIP_REJECTED
+    compress_time = 0.0
+    chunks = plain_chunks
+    if use_gzip:
+        compress_start = time.perf_counter()
+        chunks = _gzip_chunks(plain_chunks)
+        compress_time = time.perf_counter() - compress_start
+        trace.span("compress", compress_start, compress_start + compress_time)
+
+    session = get_session()
+    limiter = get_rate_limiter(API_ENDPOINT)
+    error = None
+    attempt = 0
+    gzip_failed_status = None
+    while True:
+        queued = time.perf_counter()
+        limiter.acquire()
+        trace.span("rate_limit", queued, time.perf_counter(), attempt=attempt + 1)
+        retry_after = None
+        body = _ImageRequestBody(chunks)
+        send_headers = dict(headers, **{"Content-Encoding": "gzip"}) if use_gzip else headers
+        started = time.perf_counter()
+        try:
+            response = session.post(API_ENDPOINT, headers=send_headers, data=body,
+                                    timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), stream=output_path is not None)
+        except requests.RequestException as e:
+            error = e
+            trace.span("attempt", started, time.perf_counter(), attempt=attempt + 1, error=str(e))
+        else:
+            responded = time.perf_counter()
+            upload_started = body.upload_started or responded
+            upload_finished = body.upload_finished or upload_started
+            trace.span("connect", started, upload_started, attempt=attempt + 1)
+            trace.span("upload", upload_started, upload_finished, attempt=attempt + 1, bytes=body.length, gzip=use_gzip)
+            trace.span("first_byte", upload_finished, responded, attempt=attempt + 1, status=response.status_code)
+            if use_gzip and (response.status_code in GZIP_FALLBACK_STATUS or response.status_code >= 500):
+                # 不认 gzip 的服务端可能回 400/411/415，也可能回 500/502：先立即原文重发一次，
+                # 原文成功了才说明是压缩的问题，那时再记住该地址（见下方）；
+                # 429 与其余 4xx（鉴权、路径错误等）与压缩无关，不重传整个请求体，照常退避或直接返回
+                _drain(response)
+                gzip_failed_status = response.status_code
+                use_gzip = False
+                chunks = plain_chunks
+                continue
+            if response.status_code in RETRYABLE_STATUS:
+                error = f"HTTP {response.status_code}"
+                retry_after = response.headers.get("Retry-After")
+                _drain(response)
+            else:
+                try:
+                    response.raise_for_status()
+                    if gzip_failed_status is not None and API_ENDPOINT not in _GZIP_REJECTED:
+                        _GZIP_REJECTED.add(API_ENDPOINT)
+                        print(f"   ℹ️ 接口不接受 gzip 请求体（HTTP {gzip_failed_status}），之后改为不压缩发送")
+                    if output_path is not None:
+                        result = _stream_image_response(response, output_path, trace)
+                    else:
+                        result = response.json()
+                    finished = time.perf_counter()
+                    trace.span("download", responded, finished, attempt=attempt + 1)
+                    trace.span("request", call_started, finished, attempts=attempt + 1, status=response.status_code,
+                               ok=bool(result))
+                    if timing is not None:
+                        timing.update(
+                            connect=upload_started - started,
+                            upload=upload_finished - upload_started,
+                            wait=responded - upload_finished,
+                            download=finished - responded,
+                            compress=compress_time,
+                            gzip=use_gzip,
+                            sent_bytes=body.length,
+                            attempts=attempt + 1,
+                            request_id=trace.request_id,
+                            traced=trace.sampled,
+                        )
+                    return result
+                except requests.RequestException as e:
+                    # 流式读取中途断开也按可重试处理
+                    if not isinstance(e, requests.HTTPError):
+                        error = e
+                    else:
+                        print(f"❌ 同源生图接口请求异常: {e}")
+                        trace.span("request", call_started, time.perf_counter(), attempts=attempt + 1,
+                                   status=response.status_code, ok=False)
+                        return None
+                except Exception as e:
+                    print(f"❌ 同源生图接口请求异常: {e}")
+                    trace.span("request", call_started, time.perf_counter(), attempts=attempt + 1, ok=False, error=str(e))
+                    return None
+        if attempt >= max_retries:
+            break
+        delay = _backoff_delay(attempt, retry_after)
+        print(f"   🔁 同源生图接口暂不可用（{error}），{delay:.1f} 秒后重试 ({attempt + 1}/{max_retries})")
+        time.sleep(delay)
+        attempt += 1
+    print(f"❌ 同源生图接口请求异常: {error}")
+    trace.span("request", call_started, time.perf_counter(), attempts=attempt + 1, ok=False, error=str(error))
+    return None
+
+
+# ================= 敏感词清洗 =================
+
+# 词表文件缺失时使用的默认替换
+DEFAULT_REPLACEMENTS = {
+    "sex": "intimacy",
+    "fuck": "damn",
+    "kill": "end",
+    "naked": "exposed",
+    "nude": "bare",
+}
 
-    payload = json.dumps({
-        "prompt": prompt_text,
-        "image_base64": base64_ref_img.split(",", 1)[1] if (base64_ref_img and "," in base64_ref_img) else (base64_ref_img or ""),
-        "aspect_ratio": aspect_ratio,
-        "image_size": image_size
-    }, ensure_ascii=False)
 
+def _trie_pattern(terms):
+    """把词表构造成前缀树形式的正则（如 k(?:ill|iss)），几千个词也只需一次扫描、很少回溯"""
+    trie = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def emit(node):
+        branches = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # 当前位置已是完整词时后续部分可选；贪婪匹配 + 词边界保证优先命中最长的词
+        return "(?:" + body + ")?" if "" in node else body
+
+    return emit(trie)
+
+
+class TermSanitizer:
+    """编译一次、单遍扫描的敏感词替换（不区分大小写，整词匹配）"""
+
+    def __init__(self, replacements):
+        self.replacements = {bad.lower(): good for bad, good in replacements.items() if bad}
+        self.pattern = None
+        if self.replacements:
+            self.pattern = re.compile(r"\b(?:" + _trie_pattern(self.replacements) + r")\b", re.IGNORECASE)
+
+    @classmethod
+    def from_file(cls, path):
+        replacements = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#") or "=" not in line:
+                    continue
+                bad, good = line.split("=", 1)
+                replacements[bad.strip()] = good.strip()
+        return cls(replacements)
+
+    def _replace(self, match):
+        word = match.group(0)
+        return self.replacements.get(word.lower(), word)
+
+    def __call__(self, text):
+        if not text:
+            return ""
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(self._replace, text)
+
+
+@functools.lru_cache(maxsize=None)
+def load_sanitizer(path=SANITIZE_TERMS_FILE):
+    """读取词表并编译（每个文件只编译一次）"""
     try:
-        response = requests.post(API_ENDPOINT, headers=headers, data=payload, timeout=120)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
-        print(f"❌ 同源生图接口请求异常: {e}")
-        return None
+        return TermSanitizer.from_file(path)
+    except OSError as e:
+        print(f"⚠️ 无法读取敏感词表 {path}，使用内置词表: {e}")
+        return TermSanitizer(DEFAULT_REPLACEMENTS)
+
+
+def benchmark_sanitizer(term_count=2000, text_kb=64, rounds=3):
+    """对比旧的逐词 re.sub 循环与编译后的单遍替换"""
+    def legacy(text, replacements):
+        for bad, good in replacements.items():
+            text = re.sub(r'\b' + bad + r'\b', good, text, flags=re.IGNORECASE)
+        return text
+
+    rng = random.Random(42)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    replacements = dict(load_sanitizer().replacements)
+    while len(replacements) < term_count:
+        word = "".join(rng.choice(letters) for _ in range(rng.randint(4, 10)))
+        replacements.setdefault(word, word.upper())
+    terms = list(replacements)
+    words = []
+    size = 0
+    while size < text_kb * 1024:
+        word = rng.choice(terms) if rng.random() < 0.05 else "".join(rng.choice(letters) for _ in range(rng.randint(2, 9)))
+        words.append(word.capitalize() if rng.random() < 0.3 else word)
+        size += len(word) + 1
+    text = " ".join(words)
+
+    for label, table in (("默认词表", load_sanitizer().replacements), (f"{len(replacements)} 词", replacements)):
+        start = time.perf_counter()
+        sanitizer = TermSanitizer(table)
+        compile_time = time.perf_counter() - start
+        timings = {}
+        for name, fn in (("逐词循环", lambda t: legacy(t, table)), ("单遍替换", sanitizer)):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                result = fn(text)
+            timings[name] = (time.perf_counter() - start) / rounds
+            timings[name + "结果"] = result
+        same = "一致" if timings["逐词循环结果"] == timings["单遍替换结果"] else "不一致"
+        print(f"⏱️ [{label}] {text_kb} KB 文本: 逐词循环 {timings['逐词循环'] * 1000:.1f} ms, "
+              f"单遍替换 {timings['单遍替换'] * 1000:.1f} ms（编译 {compile_time * 1000:.1f} ms），"
+              f"加速 {timings['逐词循环'] / timings['单遍替换']:.1f}x，结果{same}")
+
+
+# ================= 提示词模板 =================
+
+class PromptTemplate:
+    """提示词模板：加载时切分成静态片段和 {slot} 槽位，每页只需按槽位拼接。
+
+    模板开头到第一个槽位之前的文本是所有页面共享的静态前缀，
+    prefix_hash 是它的稳定哈希，随请求发送，便于上游复用前缀缓存。
+    """
+
+    def __init__(self, text):
+        parsed = list(string.Formatter().parse(text))
+        self.literals = [literal for literal, _, _, _ in parsed]
+        self.fields = [field for _, field, _, _ in parsed]
+        self.slots = {field for field in self.fields if field is not None}
+        self.static_prefix = self.literals[0] if self.slots else text
+        self.prefix_hash = hashlib.sha256(self.static_prefix.encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(f.read())
+
+    def render(self, **values):
+        parts = []
+        for literal, field in zip(self.literals, self.fields):
+            parts.append(literal)
+            if field is not None:
+                parts.append(str(values[field]))
+        return "".join(parts)
+
+
+@functools.lru_cache(maxsize=None)
+def load_prompt_template(path=PROMPT_TEMPLATE_FILE):
+    """读取并预处理模板（每个文件只处理一次）"""
+    return PromptTemplate.from_file(path)
 
 
 # ================= 核心逻辑类 =================
@@ -63,118 +927,182 @@ class ComicGenerator:
     def __init__(self):
         if not os.path.exists(OUTPUT_DIR):
             os.makedirs(OUTPUT_DIR)
-            
+        self.sanitizer = load_sanitizer()
+        self.prompt_template = load_prompt_template()
+
     def sanitize_text(self, text):
         """
-        基础清洗：替换可能导致模型拒绝生成的极度敏感词汇。
+        基础清洗：替换可能导致模型拒绝生成的极度敏感词汇（词表见 comic_prompts/sanitize_terms.txt）。
         注意：即使是交给模型处理，如果Input Prompt包含违禁词，请求可能在到达绘图模型前就被拦截。
         """
-        if not text: return ""
-        replacements = {
-            "sex": "intimacy",
-            "fuck": "damn", # 或者其他语气词
-            "kill": "end",
-            "naked": "exposed",
-            "nude": "bare"
-        }
         # 简单替换，保留原意但降低敏感度
-        for bad, good in replacements.items():
-            text = re.sub(r'\b' + bad + r'\b', good, text, flags=re.IGNORECASE)
-        return text
+        return self.sanitizer(text)
 
-    def process_entry(self, data):
-        print(f"🎬 正在生成单页漫画...")
+    def process_entry(self, data, output_name="banana_comic_page.png"):
+        """生成单页漫画，成功时返回保存路径，否则返回 None"""
+        print(f"🎬 正在生成单页漫画... ({output_name})")
 
         # 1. 准备参考图
         img_path = data['image_path']
-        base64_ref_img = encode_image_to_base64(img_path)
-        
-        if not base64_ref_img:
+        ref_img = load_reference_image(img_path)
+
+        if not ref_img:
             print(f"   ⚠️ 跳过: 无法加载参考图")
-            return
+            return None
+        if ref_img.sent_bytes < ref_img.original_bytes:
+            saved = ref_img.original_bytes - ref_img.sent_bytes
+            print(f"   🗜️ 参考图 {ref_img.original_bytes / 1024:.0f} KB → {ref_img.sent_bytes / 1024:.0f} KB"
+                  f"（{ref_img.mime}，节省 {saved / 1024:.0f} KB / {saved * 100 / ref_img.original_bytes:.0f}%）")
 
         # 2. 获取并清洗原始文本 (不再截断，而是清洗敏感词后全部传入)
         raw_dialogue = self.sanitize_text(data.get('content', ''))
         event_info = json.dumps(data["event_info"], ensure_ascii=False)
         
-        # 3. 构建 Prompt
-        # 核心修改：移除硬编码的对话提取，增加指令让模型自己选择
-        prompt_text = f"""
-        **Role**: Master Webtoon Artist & Visual Director.
-        **Task**: Create a **HIGH-QUALITY FULL COLOR** composite comic page (Vertical Grid) based on the story.
-        
-        **Reference**: 
-        - The MAIN CHARACTER (MC) must strictly match the attached image.
-        - **SIDE CHARACTER (SC)**: Create a **FULLY RENDERED** fictional character. **CRITICAL**: Do NOT draw the Side Character as a shadow, silhouette, or faceless figure. They must have visible eyes, hair, and detailed clothing, just like the MC.
-        
-        **Source Material**:
-        - **Context**: {event_info}
-        - **Raw Input**: "{raw_dialogue}"
-        
-        **Visual Style: RICH & FULL COLOR (CRITICAL)**:
-        1. **Color Mode**: **FULL COLOR ONLY**. Use vibrant, cinematic lighting. **NO black & white**.
-        2. **Visual Richness**: **NO EMPTY BACKGROUNDS**. Fill voids with **Colored Speed Lines**, **Particles/Bokeh**, or **Detailed Scenery**.
-        3. **Dynamic Camera**: Use **Dutch Angles**, **Over-the-Shoulder**, or **Fisheye Lens**.
-        
-        **Text & Bubble Logic (SMART CLEANING)**:
-        1. **Language**: **SIMPLIFIED CHINESE (简体中文)**.
-        2. **TEXT CLEANING PROTOCOL (STRICT)**: 
-           - **Remove Names**: Do NOT put "CharacterName:" inside the bubble.
-           - **Remove Symbols**: Do NOT put `( )` or `* *` inside the bubble. 
-           - **Output**: Only display the **pure message**.
-             (e.g., Input: "Tom: *Sigh* (I love her)" -> Bubble Text: "I love her")
-        3. **Bubble Type Selection**: 
-           - Use the raw symbols (`()`/`**`) ONLY to decide the shape, then delete them.
-           - **Spoken** (Normal text) -> **Solid Oval Bubble**.
-           - **Thought** (Text in brackets) -> **Cloud/Square Bubble**.
-        4. **Magnetic Alignment**: 
-           - If Character is on the Right -> Bubble on the Right.
-           - If Character is on the Left -> Bubble on the Left.
-           - Tail points to the head.
-        
-        **Panel Layout Directives**:
-           - **Panel 1 (Top - Context)**: Wide Shot. Establish the scene with **Rich Environmental Details**.
-           - **Panel 2 (Middle - Interaction)**: **Dynamic Interaction**. **Over-the-Shoulder** shot. **Fully Visible SC and MC**. Focus on their relationship. **Priority: Dialogue (Oval Bubbles)**.
-           - **Panel 3 (Bottom - Emotion)**: **Extreme Close-up**. Focus on the MC's eyes/lips. **Priority: Inner Thought (Cloud/Square Bubbles)**. Use a **"Background Effect"** (Color Bloom/Flowers/Thunder) to visually represent the specific emotion.
-        
-        **Safety & Atmosphere**:
-        - Represent "intimacy" or "sexy" themes using **Sensual Atmosphere** (sweat, flushing, soft focus).
-        - NO explicit nudity. Keep it artistic.
-        
-        Generate ONE single FULL-COLOR composite image with rich visual details.
-        """
-
-        # 4. 组装消息
-        message_content = [
-            {"type": "text", "text": prompt_text},
-            {"type": "image_url", "image_url": {"url": base64_ref_img}}
-        ]
-        
-        messages = [{"role": "user", "content": message_content}]
+        # 3. 构建 Prompt：静态部分在模板加载时已切好，这里只填入本页的槽位
+        prompt_text = self.prompt_template.render(event_info=event_info, raw_dialogue=raw_dialogue)
 
-        # 5. 调用同源生图接口
+        # 4. 调用同源生图接口
         print("   ⏳ 调用同源生图接口生成漫画页...")
         start_time = time.time()
-        result = call_image_api(prompt_text, base64_ref_img)
-
-        # 6. 处理结果
-        if result and isinstance(result, dict):
-            img_data_url = result.get('image_data_url') or ''
-            if img_data_url:
-                file_name = f"banana_comic_page.png"
-                save_path = os.path.join(OUTPUT_DIR, file_name)
-                if save_base64_image(img_data_url, save_path):
-                    print(f"   ✅ 漫画页已保存: {save_path}")
+        timing = {}
+        result = call_image_api(prompt_text, ref_img, output_path=os.path.join(OUTPUT_DIR, output_name),
+                                prompt_prefix_hash=self.prompt_template.prefix_hash, timing=timing)
+
+        # 5. 处理结果（图片已在读取响应时流式写盘）
+        saved_path = None
+        if isinstance(result, dict):
+            if result.get('image_path'):
+                saved_path = result['image_path']
+                print(f"   ✅ 漫画页已保存: {saved_path} ({result['bytes'] / 1024:.0f} KB)")
             else:
                 print("   ⚠️ 同源接口未返回 image_data_url")
         else:
             print("   ❌ 同源接口调用失败，可能是输入被拦截或上游错误")
         end_time = time.time()
-        print(f"   ⏱️ 接口用时: {end_time - start_time:.2f} 秒")
+        print(f"   ⏱️ 接口用时: {end_time - start_time:.2f} 秒{format_timing(timing)}")
+        return saved_path
+
+
+# ================= 批量生成 =================
+
+def _entry_id(data):
+    """条目 ID：优先使用条目里的 id 字段，否则取内容哈希，保证重启后稳定"""
+    raw = data.get("id")
+    if raw is None:
+        raw = hashlib.sha1(json.dumps(data, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+    return re.sub(r"[^\w.-]", "_", str(raw))
+
+
+def load_entries(jsonl_path):
+    """读取 JSONL（每行一个条目）；相对的 image_path 在当前目录找不到时按 JSONL 所在目录解析"""
+    base_dir = os.path.dirname(os.path.abspath(jsonl_path))
+    entries = []
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                print(f"⚠️ 第 {line_no} 行不是合法 JSON，已跳过: {e}")
+                continue
+            img_path = data.get("image_path")
+            if img_path and not os.path.isabs(img_path) and not os.path.exists(img_path):
+                candidate = os.path.join(base_dir, img_path)
+                if os.path.exists(candidate):
+                    data["image_path"] = candidate
+            entries.append((_entry_id(data), data))
+    return entries
+
+
+def load_progress(progress_path):
+    """已完成的条目 ID（进度文件里有记录且图片仍在磁盘上）"""
+    done = set()
+    if not os.path.exists(progress_path):
+        return done
+    with open(progress_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("path") and os.path.exists(record["path"]):
+                done.add(record["id"])
+    return done
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # 最近秩法
+    index = max(0, min(len(sorted_values), math.ceil(pct / 100.0 * len(sorted_values))) - 1)
+    return sorted_values[index]
+
+
+def run_batch(jsonl_path, workers=4, progress_path=None):
+    """并发批量生成：有界线程池 + 按接口限速 + 断点续跑，结束时打印吞吐与 p50/p95 延迟"""
+    gen = ComicGenerator()
+    progress_path = progress_path or os.path.join(OUTPUT_DIR, "batch_progress.jsonl")
+    os.makedirs(os.path.dirname(progress_path) or ".", exist_ok=True)
+    entries = load_entries(jsonl_path)
+    done = load_progress(progress_path)
+    pending = [(entry_id, data) for entry_id, data in entries if entry_id not in done]
+    print(f"📚 共 {len(entries)} 条，已完成 {len(entries) - len(pending)} 条，待生成 {len(pending)} 条（并发 {workers}）")
+    if not pending:
+        return
+
+    def _timed(entry_id, data):
+        start = time.time()
+        path = gen.process_entry(data, f"{entry_id}.png")
+        return entry_id, path, time.time() - start
+
+    latencies = []
+    failed = []
+    batch_start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool, open(progress_path, "a", encoding="utf-8") as progress:
+        futures = [pool.submit(_timed, entry_id, data) for entry_id, data in pending]
+        for future in as_completed(futures):
+            try:
+                entry_id, path, elapsed = future.result()
+            except Exception as e:
+                print(f"❌ 条目处理异常: {e}")
+                continue
+            latencies.append(elapsed)
+            if path:
+                progress.write(json.dumps({"id": entry_id, "path": path, "seconds": round(elapsed, 3)}, ensure_ascii=False) + "\n")
+                progress.flush()
+            else:
+                failed.append(entry_id)
+    total = time.time() - batch_start
+    latencies.sort()
+    succeeded = len(pending) - len(failed)
+    print("=" * 40)
+    print(f"📊 完成 {succeeded}/{len(pending)} 页，失败 {len(failed)} 页，总用时 {total:.1f} 秒")
+    print(f"   吞吐: {succeeded / total * 60 if total > 0 else 0:.2f} 页/分钟")
+    print(f"   延迟: p50 {_percentile(latencies, 50):.2f} 秒, p95 {_percentile(latencies, 95):.2f} 秒")
+    if failed:
+        print(f"   失败条目（重新运行即可续跑）: {', '.join(failed)}")
 
 
 # ================= 主程序 =================
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Banana 漫画页生成")
+    parser.add_argument("--batch", help="JSONL 条目文件（每行一个条目），不传则运行下方的单条示例")
+    parser.add_argument("--workers", type=int, default=4, help="批量并发数")
+    parser.add_argument("--progress", help="进度文件路径，默认 generated_comics/batch_progress.jsonl")
+    parser.add_argument("--bench-sanitizer", action="store_true", help="对比敏感词清洗的新旧实现耗时")
+    parser.add_argument("--self-test", action="store_true", help="运行流式图片解码的回归自检")
+    args = parser.parse_args()
+    if args.bench_sanitizer:
+        benchmark_sanitizer()
+        sys.exit(0)
+    if args.self_test:
+        sys.exit(0 if self_test_stream_decode() else 1)
+    if args.batch:
+        run_batch(args.batch, workers=max(1, args.workers), progress_path=args.progress)
+        sys.exit(0)
+
     gen = ComicGenerator()
     
     data = {
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""Load-test dev_proxy.py against a local stand-in upstream.
+
+Starts a fake upstream (GLB-sized /api/generate, /api/generate_image JSON,
+small GET JSON) and dev_proxy.py as subprocesses, drives N concurrent
+clients first straight at the upstream and then through the proxy, and
+prints requests/s, latency percentiles, proxy-added overhead and the
+proxy's peak RSS as JSON.
+
+    python bench_dev_proxy.py --clients 16 --duration 10 --latency 0.05
+    python bench_dev_proxy.py --proxy-env DEV_PROXY_CACHE=1 --same-body
+    python bench_dev_proxy.py --proxy-env DEV_PROXY_COALESCE=1 --same-body
+"""
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import argparse
+import resource
+import threading
+import subprocess
+import http.client
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Client path -> (method, upstream path the proxy rewrites it to)
+ROUTES = {
+    'generate': ('POST', '/generate', '/api/generate'),
+    'generate_image': ('POST', '/generate_image', '/api/generate_image'),
+    'passthrough': ('GET', '/status-probe', '/api/status-probe'),
+}
+
+
+def serve_upstream(port, latency, glb_bytes, image_bytes):
+    """Fake upstream: fixed latency, then a GLB blob, an image data URL or a small JSON document."""
+    glb = b'glTF' + b'\0' * max(0, glb_bytes - 4)
+    image = json.dumps({'image_data_url': 'data:image/png;base64,' + base64.b64encode(b'\0' * image_bytes).decode()}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Like real app servers: otherwise the separate header/body writes stall on delayed ACKs over keep-alive
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, body, content_type):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self._reply(json.dumps({'ok': True, 'path': self.path}).encode(), 'application/json')
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            self.rfile.read(length)
+            if self.path.rstrip('/').endswith('generate_image'):
+                self._reply(image, 'application/json')
+            else:
+                self._reply(glb, 'model/gltf-binary')
+
+    ThreadingHTTPServer.request_queue_size = 128
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, proc, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f'process exited early with code {proc.returncode}')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'port {port} did not open within {timeout}s')
+
+
+def peak_rss_kb(pid):
+    """Peak resident set size of a live process (Linux /proc), or None when unavailable."""
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values), -(-len(sorted_values) * pct // 100)) - 1)
+    return sorted_values[int(index)]
+
+
+def summarize(samples, elapsed):
+    """samples: (route, seconds, status, bytes) tuples; status 0 means the request raised."""
+    latencies = sorted(s[1] for s in samples)
+    statuses = {}
+    for _, _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = sum(1 for s in samples if 200 <= s[2] < 300)
+    ms = lambda v: None if v is None else round(v * 1000, 2)
+    return {
+        'requests': len(samples),
+        'ok': ok,
+        'statuses': statuses,
+        'requests_per_second': round(len(samples) / elapsed, 2) if elapsed else None,
+        'bytes_per_second': round(sum(s[3] for s in samples) / elapsed) if elapsed else None,
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def run_load(port, routes, clients, duration, same_body, via_proxy):
+    """Drive `clients` threads round-robin over `routes` for `duration` seconds."""
+    samples = []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+    counter = [0]
+
+    def client(index):
+        local = []
+        i = index
+        while time.monotonic() < stop_at:
+            name = routes[i % len(routes)]
+            method, proxy_path, upstream_path = ROUTES[name]
+            path = proxy_path if via_proxy else upstream_path
+            body = None
+            headers = {}
+            if method == 'POST':
+                with lock:
+                    counter[0] += 1
+                    n = counter[0]
+                # Unique bodies defeat the proxy's cache/coalescing unless --same-body asks for them
+                body = json.dumps({'prompt': 'bench', 'seq': 0 if same_body else n}).encode()
+                headers = {'Content-Type': 'application/json', 'Content-Length': str(len(body))}
+            started = time.perf_counter()
+            status = 0
+            size = 0
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                while True:
+                    chunk = resp.read(65536)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                status = resp.status
+            except (OSError, http.client.HTTPException):
+                pass
+            finally:
+                conn.close()
+            local.append((name, time.perf_counter() - started, status, size))
+            i += 1
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+    result = summarize(samples, elapsed)
+    result['per_route'] = {name: summarize([s for s in samples if s[0] == name], elapsed) for name in routes}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dev_proxy.py against a local fake upstream.')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent client threads')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per phase (direct, then proxied)')
+    parser.add_argument('--routes', default='generate,generate_image,passthrough', help='comma-separated: ' + ', '.join(ROUTES))
+    parser.add_argument('--latency', type=float, default=0.05, help='fake upstream latency in seconds')
+    parser.add_argument('--glb-kb', type=int, default=1024, help='size of /generate GLB responses')
+    parser.add_argument('--image-kb', type=int, default=512, help='decoded size of /generate_image images')
+    parser.add_argument('--same-body', action='store_true', help='send identical POST bodies (exercises cache/coalescing)')
+    parser.add_argument('--skip-direct', action='store_true', help='skip the direct-to-upstream baseline')
+    parser.add_argument('--proxy-env', action='append', default=[], metavar='KEY=VALUE', help='extra env for dev_proxy.py')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    parser.add_argument('--serve-upstream', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_upstream:
+        serve_upstream(args.serve_upstream, args.latency, args.glb_kb * 1024, args.image_kb * 1024)
+        return
+
+    routes = [r.strip() for r in args.routes.split(',') if r.strip()]
+    unknown = [r for r in routes if r not in ROUTES]
+    if unknown:
+        parser.error(f'unknown route(s): {", ".join(unknown)}')
+
+    upstream_port = free_port()
+    proxy_port = free_port()
+    upstream = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve-upstream', str(upstream_port), '--latency', str(args.latency),
+         '--glb-kb', str(args.glb_kb), '--image-kb', str(args.image_kb)])
+    env = dict(os.environ, DEV_PROXY_TARGET_BASE=f'http://127.0.0.1:{upstream_port}/api/', DEV_PROXY_PORT=str(proxy_port))
+    env.pop('DEV_PROXY_TARGET_GENERATE_URL', None)
+    # All bench clients share one address; per-client limits would turn the run into a 429 benchmark
+    env['DEV_PROXY_RATE_LIMITS'] = ''
+    for item in args.proxy_env:
+        key, _, value = item.partition('=')
+        env[key] = value
+    proxy = subprocess.Popen([sys.executable, os.path.join(HERE, 'dev_proxy.py')], env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    report = {
+        'config': {
+            'clients': args.clients, 'duration': args.duration, 'routes': routes, 'upstream_latency': args.latency,
+            'glb_kb': args.glb_kb, 'image_kb': args.image_kb, 'same_body': args.same_body, 'proxy_env': args.proxy_env,
+        },
+    }
+    try:
+        wait_for_port(upstream_port, upstream)
+        wait_for_port(proxy_port, proxy)
+        rss_idle = peak_rss_kb(proxy.pid)
+        if not args.skip_direct:
+            print(f'[bench] direct: {args.clients} clients for {args.duration}s', file=sys.stderr)
+            report['direct'] = run_load(upstream_port, routes, args.clients, args.duration, args.same_body, via_proxy=False)
+        print(f'[bench] proxied: {args.clients} clients for {args.duration}s', file=sys.stderr)
+        report['proxy'] = run_load(proxy_port, routes, args.clients, args.duration, args.same_body, via_proxy=True)
+        report['proxy_rss_kb'] = {'idle': rss_idle, 'peak': peak_rss_kb(proxy.pid)}
+        if 'direct' in report:
+            report['overhead_ms'] = {
+                key: (None if report['proxy']['latency_ms'][key] is None or report['direct']['latency_ms'][key] is None
+                      else round(report['proxy']['latency_ms'][key] - report['direct']['latency_ms'][key], 2))
+                for key in ('p50', 'p95', 'p99')
+            }
+    finally:
+        proxy.terminate()
+        upstream.terminate()
+        proxy.wait()
+        upstream.wait()
+    if report.get('proxy_rss_kb', {}).get('peak') is None:
+        # No /proc: the largest reaped child is the closest stand-in (KB on Linux, bytes on macOS)
+        report['proxy_rss_kb'] = {'idle': None, 'peak_any_child': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
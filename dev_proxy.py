@@ -1,13 +1,37 @@
 #!/usr/bin/env python3
 import os
+import re
 import sys
 import json
 import ssl
+import math
+import time
+import select
+import socket
+import selectors
+import uuid
+import queue
+import hashlib
+import tempfile
+import threading
+import zlib
+import struct
+import io
+import http.client
+from array import array
+from bisect import bisect_left
+from email.utils import formatdate, parsedate_to_datetime
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urljoin, urlparse, urlunparse
-from urllib.request import Request, urlopen
+from urllib.parse import parse_qs, urlencode, urljoin, urlparse
 from urllib.error import HTTPError, URLError
 
+try:
+    import brotli  # optional: br is offered to clients only when installed
+except ImportError:
+    brotli = None
+
 
 TARGET_BASE = os.environ.get('DEV_PROXY_TARGET_BASE', 'https://polly-3d.vercel.app/api/')
 TARGET_GENERATE_URL = os.environ.get('DEV_PROXY_TARGET_GENERATE_URL', '').strip()
@@ -20,170 +44,3168 @@ X_AUTH_TOKEN = os.environ.get('DEV_PROXY_X_AUTH_TOKEN', '').strip()
 GOOGLE_CLIENT_ID = os.environ.get('DEV_PROXY_GOOGLE_CLIENT_ID', '').strip()
 GOOGLE_SCOPE = os.environ.get('DEV_PROXY_GOOGLE_SCOPE', 'openid email profile')
 GOOGLE_RESPONSE_TYPE = os.environ.get('DEV_PROXY_GOOGLE_RESPONSE_TYPE', 'token id_token')
+GOOGLE_AUTH_ENDPOINT = 'https://accounts.google.com/o/oauth2/v2/auth'
+# Route table overrides: JSON file and/or inline JSON (see dev_proxy_routes.sample.json)
+ROUTES_FILE = os.environ.get('DEV_PROXY_ROUTES_FILE', '').strip()
+ROUTES_JSON = os.environ.get('DEV_PROXY_ROUTES', '').strip()
+# Client headers passed through to upstream unless a route overrides the list
+DEFAULT_FORWARD_HEADERS = ('Authorization', 'x-api-key', 'x-auth-token', 'x-vercel-protection-bypass')
 PORT = int(os.environ.get('DEV_PROXY_PORT', '8787'))
 INSECURE = os.environ.get('DEV_PROXY_INSECURE', '0').strip() in ('1', 'true', 'yes')
+# Serving mode: 'threaded' (bounded worker pool, default) or 'single' (legacy one-at-a-time HTTPServer)
+SERVE_MODE = os.environ.get('DEV_PROXY_SERVE_MODE', 'threaded').strip().lower()
+WORKERS = max(1, int(os.environ.get('DEV_PROXY_WORKERS', '16') or '16'))
+# Cap on concurrent upstream calls; extra requests get 503 + Retry-After instead of queueing (0 = no cap)
+MAX_INFLIGHT = max(0, int(os.environ.get('DEV_PROXY_MAX_INFLIGHT', '8') or '0'))
+RETRY_AFTER = os.environ.get('DEV_PROXY_RETRY_AFTER', '5').strip() or '5'
+# Opt-in per-client limits on the expensive POST routes: 'route=rate:burst' token buckets (requests/second),
+# e.g. '/generate=0.5:5,/generate_image=1:10,/tasks=0.5:5', plus an optional cap on one client's concurrent
+# requests to those routes. Clients are told apart by their own forwarded credential, else by address, so
+# every local caller (browser, batch driver) shares one bucket; size the limits for a shared proxy.
+RATE_LIMITS_SPEC = os.environ.get('DEV_PROXY_RATE_LIMITS', '').strip()
+CLIENT_MAX_INFLIGHT = max(0, int(os.environ.get('DEV_PROXY_CLIENT_MAX_INFLIGHT', '0') or '0'))
+RATE_IDLE_TIMEOUT = float(os.environ.get('DEV_PROXY_RATE_IDLE_TIMEOUT', '600') or '600')
+RATE_MAX_CLIENTS = max(1, int(os.environ.get('DEV_PROXY_RATE_MAX_CLIENTS', '10000') or '10000'))
+
+_UPSTREAM_SLOTS = threading.BoundedSemaphore(MAX_INFLIGHT) if MAX_INFLIGHT > 0 else None
+try:
+    UPSTREAM_TIMEOUT = float(os.environ.get('DEV_PROXY_UPSTREAM_TIMEOUT', '60') or '60')
+except ValueError:
+    UPSTREAM_TIMEOUT = 60.0
+# Keep-alive upstream connections: max idle connections kept per host, and how long they may sit idle
+POOL_SIZE = max(0, int(os.environ.get('DEV_PROXY_POOL_SIZE', '8') or '0'))
+POOL_IDLE_TIMEOUT = float(os.environ.get('DEV_PROXY_POOL_IDLE_TIMEOUT', '30') or '30')
+# Failover: extra bases serving the same API as TARGET_BASE (comma-separated); routes may also list "targets"
+UPSTREAMS = [b.strip() for b in os.environ.get('DEV_PROXY_UPSTREAMS', '').split(',') if b.strip()]
+# Active health probes for upstreams that have a failover partner; any answer below 500 counts as up
+HEALTH_PATH = os.environ.get('DEV_PROXY_HEALTH_PATH', '/').strip() or '/'
+HEALTH_INTERVAL = float(os.environ.get('DEV_PROXY_HEALTH_INTERVAL', '10') or '10')
+HEALTH_TIMEOUT = float(os.environ.get('DEV_PROXY_HEALTH_TIMEOUT', '2') or '2')
+# Circuit breaker: this many consecutive 5xx/timeouts take an upstream out of rotation for the cooldown
+BREAKER_FAILURES = max(1, int(os.environ.get('DEV_PROXY_BREAKER_FAILURES', '5') or '5'))
+BREAKER_COOLDOWN = float(os.environ.get('DEV_PROXY_BREAKER_COOLDOWN', '30') or '30')
+# Hedged GETs: race a second upstream when the first hasn't answered within this many seconds (0 = off)
+HEDGE_DELAY = float(os.environ.get('DEV_PROXY_HEDGE_DELAY', '1') or '0')
+# Fixed read size when streaming request/response bodies through the proxy
+STREAM_CHUNK_SIZE = max(1024, int(os.environ.get('DEV_PROXY_STREAM_CHUNK_SIZE', '65536') or '65536'))
+# Opt-in response cache for expensive generation routes (memory LRU + on-disk tier for large blobs)
+CACHE_ENABLED = os.environ.get('DEV_PROXY_CACHE', '0').strip() in ('1', 'true', 'yes')
+CACHE_DIR = os.environ.get('DEV_PROXY_CACHE_DIR', '.dev_proxy_cache').strip() or '.dev_proxy_cache'
+CACHE_TTL = float(os.environ.get('DEV_PROXY_CACHE_TTL', '3600') or '3600')
+CACHE_MEM_BYTES = int(os.environ.get('DEV_PROXY_CACHE_MEM_BYTES', str(64 * 1024 * 1024)))
+CACHE_MEM_ITEM_BYTES = int(os.environ.get('DEV_PROXY_CACHE_MEM_ITEM_BYTES', str(1024 * 1024)))
+CACHE_DISK_BYTES = int(os.environ.get('DEV_PROXY_CACHE_DISK_BYTES', str(1024 * 1024 * 1024)))
+CACHE_ROUTES = {r.strip().rstrip('/') for r in os.environ.get('DEV_PROXY_CACHE_ROUTES', '/generate,/generate_image').split(',') if r.strip()}
+# Opt-in single-flight: identical concurrent POSTs to these routes share one upstream call. The key needs the
+# whole request body, so these routes buffer uploads in memory instead of streaming them upstream.
+COALESCE_ENABLED = os.environ.get('DEV_PROXY_COALESCE', '0').strip() in ('1', 'true', 'yes')
+COALESCE_ROUTES = {r.strip().rstrip('/') for r in os.environ.get('DEV_PROXY_COALESCE_ROUTES', '/generate,/generate_image').split(',') if r.strip()}
+# Followers hold a pool worker each for the whole upstream call, so at most this many wait across all flights
+# (0 = unlimited); later ones get 503. The default leaves room for MAX_INFLIGHT leaders plus two spare workers
+# so local endpoints like /health never queue behind coalesced requests.
+COALESCE_MAX_FOLLOWERS = max(0, int(os.environ.get('DEV_PROXY_COALESCE_MAX_FOLLOWERS', '') or
+                                    max(1, WORKERS - (MAX_INFLIGHT or WORKERS // 2) - 2)))
+# Bytes of a coalesced response kept in memory; chunks every follower has read are dropped past this
+COALESCE_WINDOW_BYTES = max(STREAM_CHUNK_SIZE, int(os.environ.get('DEV_PROXY_COALESCE_WINDOW_BYTES', str(4 * 1024 * 1024))))
+# Response compression for clients that send Accept-Encoding (skipped when the upstream already encoded the body)
+COMPRESS_ENABLED = os.environ.get('DEV_PROXY_COMPRESS', '1').strip() in ('1', 'true', 'yes')
+COMPRESS_LEVEL = min(9, max(1, int(os.environ.get('DEV_PROXY_COMPRESS_LEVEL', '6') or '6')))
+BROTLI_QUALITY = min(11, max(0, int(os.environ.get('DEV_PROXY_BROTLI_QUALITY', '4') or '4')))
+COMPRESS_MIN_BYTES = int(os.environ.get('DEV_PROXY_COMPRESS_MIN_BYTES', '1024') or '0')
+COMPRESS_TYPES = tuple(t.strip().lower() for t in os.environ.get(
+    'DEV_PROXY_COMPRESS_TYPES', 'text/,application/json,application/javascript,application/xml,image/svg+xml,model/gltf+json'
+).split(',') if t.strip())
+# Upstream headers relayed to the client alongside Content-Type/Content-Length/Location
+RELAY_HEADERS = ('Cache-Control', 'Content-Encoding', 'Content-Disposition', 'Content-Language', 'ETag', 'Expires', 'Last-Modified', 'Vary', 'Age')
+# Validator cache: conditional GETs are answered with 304 locally while the upstream's freshness lifetime lasts.
+# DEV_PROXY_VALIDATOR_TTL applies to responses that carry validators but no max-age/Expires.
+VALIDATORS_ENABLED = os.environ.get('DEV_PROXY_VALIDATORS', '1').strip() in ('1', 'true', 'yes')
+VALIDATOR_MAX = max(1, int(os.environ.get('DEV_PROXY_VALIDATOR_MAX', '4096') or '4096'))
+VALIDATOR_TTL = float(os.environ.get('DEV_PROXY_VALIDATOR_TTL', '0') or '0')
+# Opt-in GLB post-processing: model/gltf-binary responses are re-packed with quantized geometry
+# (KHR_mesh_quantization, which three.js GLTFLoader reads without extra decoders), cached by content hash
+GLB_OPTIMIZE = os.environ.get('DEV_PROXY_GLB_OPTIMIZE', '0').strip() in ('1', 'true', 'yes')
+GLB_MAX_BYTES = int(os.environ.get('DEV_PROXY_GLB_MAX_BYTES', str(256 * 1024 * 1024)))
+GLB_CACHE_BYTES = int(os.environ.get('DEV_PROXY_GLB_CACHE_BYTES', str(128 * 1024 * 1024)))
+# Async task mode: POST /tasks queues a /generate call; GET /tasks/<id> and /tasks/<id>/result poll and fetch it.
+# Set DEV_PROXY_TASKS=0 to forward /tasks to the upstream instead.
+TASKS_ENABLED = os.environ.get('DEV_PROXY_TASKS', '1').strip() in ('1', 'true', 'yes')
+TASK_WORKERS = max(1, int(os.environ.get('DEV_PROXY_TASK_WORKERS', '4') or '4'))
+TASK_TTL = float(os.environ.get('DEV_PROXY_TASK_TTL', '1800') or '1800')
+TASK_MAX = max(1, int(os.environ.get('DEV_PROXY_TASK_MAX', '1000') or '1000'))
+TASK_STORE_BYTES = int(os.environ.get('DEV_PROXY_TASK_STORE_BYTES', str(256 * 1024 * 1024)))
+TASK_ETA_DEFAULT = float(os.environ.get('DEV_PROXY_TASK_ETA_DEFAULT', '60') or '60')
+# Push channels for task status: SSE on /tasks/<id>/events and GET /tasks/<id>?wait=<seconds> long-poll
+TASK_LONGPOLL_MAX = float(os.environ.get('DEV_PROXY_TASK_LONGPOLL_MAX', '60') or '60')
+TASK_EVENTS_TICK = float(os.environ.get('DEV_PROXY_TASK_EVENTS_TICK', '5') or '5')
+# Request tracing: every request gets an X-Request-ID (propagated from the client when it sends one). With
+# DEV_PROXY_TRACE=1, sampled requests write timing spans to DEV_PROXY_TRACE_FILE as JSONL; a request is
+# sampled when the caller sends X-Trace-Sampled: 1 or its id hashes under DEV_PROXY_TRACE_SAMPLE.
+TRACE_ENABLED = os.environ.get('DEV_PROXY_TRACE', '0').strip() in ('1', 'true', 'yes')
+TRACE_SAMPLE = float(os.environ.get('DEV_PROXY_TRACE_SAMPLE', '0.01') or '0')
+TRACE_FILE = os.environ.get('DEV_PROXY_TRACE_FILE', 'dev_proxy_trace.jsonl').strip() or 'dev_proxy_trace.jsonl'
+
+# TLS context is built once and shared by every pooled HTTPS connection
+if INSECURE:
+    SSL_CONTEXT = ssl._create_unverified_context()
+else:
+    SSL_CONTEXT = ssl.create_default_context()
+
+
+class UpstreamPool:
+    """Per-host pool of idle HTTP/1.1 keep-alive connections to upstream servers."""
+
+    def __init__(self, size=POOL_SIZE, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, scheme, host, port, timeout):
+        """Return (connection, reused) for the given origin, reusing an idle connection when possible."""
+        key = (scheme, host, port)
+        now = time.monotonic()
+        stale = []
+        conn = None
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                candidate, last_used = idle.pop()
+                if now - last_used > self.idle_timeout:
+                    stale.append(candidate)
+                    continue
+                conn = candidate
+                break
+            # Anything left under the freshest entry is older still
+            while idle and now - idle[0][1] > self.idle_timeout:
+                stale.append(idle.popleft()[0])
+            if conn is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        for old in stale:
+            old.close()
+        if conn is not None and _peer_closed(conn):
+            conn.close()
+            conn = None
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=timeout, context=SSL_CONTEXT)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        return conn, False
+
+    def release(self, scheme, host, port, conn):
+        key = (scheme, host, port)
+        with self._lock:
+            idle = self._idle.setdefault(key, deque())
+            if len(idle) < self.size:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def stats(self):
+        with self._lock:
+            idle = sum(len(v) for v in self._idle.values())
+            return {'hits': self.hits, 'misses': self.misses, 'idle': idle, 'size': self.size}
+
+
+def _peer_closed(conn) -> bool:
+    # An idle keep-alive socket that turns readable has been closed (or poisoned) by the server
+    sock = conn.sock
+    if sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+UPSTREAM_POOL = UpstreamPool()
+
+
+class Metrics:
+    """Thread-safe counters, gauges and histograms rendered in the Prometheus text format."""
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+    SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._types = {}
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, labels, value=1):
+        key = self._key(name, labels)
+        with self._lock:
+            self._types.setdefault(name, 'counter')
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge_add(self, name, labels, delta):
+        key = self._key(name, labels)
+        with self._lock:
+            self._types.setdefault(name, 'gauge')
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        key = self._key(name, labels)
+        with self._lock:
+            self._types.setdefault(name, 'histogram')
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [buckets, [0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    hist[1][i] += 1
+            hist[2] += value
+            hist[3] += 1
+
+    @staticmethod
+    def _fmt_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        body = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+        return '{' + body + '}'
+
+    def render(self, sampled=()):
+        """Render all series plus (name, type, value) triples sampled at scrape time.
+
+        A sampled value may also be a list of (labels, value) pairs for a labelled series.
+        """
+        lines = []
+        with self._lock:
+            by_name = {}
+            for (name, labels), value in self._counters.items():
+                by_name.setdefault(name, []).append('%s%s %s' % (name, self._fmt_labels(labels), value))
+            for (name, labels), value in self._gauges.items():
+                by_name.setdefault(name, []).append('%s%s %s' % (name, self._fmt_labels(labels), value))
+            for (name, labels), (buckets, counts, total, count) in self._histograms.items():
+                series = by_name.setdefault(name, [])
+                for bound, bucket_count in zip(buckets, counts):
+                    series.append('%s_bucket%s %s' % (name, self._fmt_labels(labels, (('le', bound),)), bucket_count))
+                series.append('%s_bucket%s %s' % (name, self._fmt_labels(labels, (('le', '+Inf'),)), count))
+                series.append('%s_sum%s %s' % (name, self._fmt_labels(labels), total))
+                series.append('%s_count%s %s' % (name, self._fmt_labels(labels), count))
+            for name in sorted(by_name):
+                lines.append('# TYPE %s %s' % (name, self._types[name]))
+                lines.extend(sorted(by_name[name]))
+        for name, kind, value in sampled:
+            lines.append('# TYPE %s %s' % (name, kind))
+            if isinstance(value, list):
+                lines.extend('%s%s %s' % (name, self._fmt_labels(sorted(labels.items())), v) for labels, v in value)
+            else:
+                lines.append('%s %s' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+
+
+def trace_sampled(request_id, rate=TRACE_SAMPLE):
+    """Deterministic per-id sampling; the comic client hashes the same way, so equal rates pick the same requests."""
+    if rate <= 0:
+        return False
+    return rate >= 1 or int(hashlib.sha1(request_id.encode('utf-8')).hexdigest()[:8], 16) / 0x100000000 < rate
+
+
+class SpanLog:
+    """Asynchronous JSONL span writer.
+
+    Request threads only enqueue a dict; a background thread serializes and
+    appends in batches. When the bounded queue is full, spans are dropped
+    and counted rather than blocking a request.
+    """
+
+    def __init__(self, path, side='proxy', max_queue=10000):
+        self.path = path
+        self.side = side
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue)
+        self._thread = threading.Thread(target=self._run, name='dev-proxy-spans', daemon=True)
+        self._thread.start()
+
+    def emit(self, trace_id, span, start, end, **attrs):
+        """start/end are time.time() stamps so spans line up with other processes' logs."""
+        record = {'trace_id': trace_id, 'side': self.side, 'span': span, 'start': round(start, 6),
+                  'end': round(end, 6), 'ms': round((end - start) * 1000, 3)}
+        record.update(attrs)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            while True:
+                lines = [json.dumps(self._queue.get(), ensure_ascii=False)]
+                while True:
+                    try:
+                        lines.append(json.dumps(self._queue.get_nowait(), ensure_ascii=False))
+                    except queue.Empty:
+                        break
+                f.write('\n'.join(lines) + '\n')
+                f.flush()
+
+
+TRACER = SpanLog(TRACE_FILE) if TRACE_ENABLED else None
+
+
+def _acquire_upstream_slot(blocking=False) -> bool:
+    if _UPSTREAM_SLOTS is not None and not _UPSTREAM_SLOTS.acquire(blocking=blocking):
+        return False
+    METRICS.gauge_add('dev_proxy_upstream_inflight', {}, 1)
+    return True
+
+
+def _release_upstream_slot():
+    METRICS.gauge_add('dev_proxy_upstream_inflight', {}, -1)
+    if _UPSTREAM_SLOTS is not None:
+        _UPSTREAM_SLOTS.release()
+
+
+def _parse_rate_limits(spec):
+    """'/generate=0.5:5,/tasks=1' -> {'/generate': (0.5, 5.0), '/tasks': (1.0, 1.0)}; burst defaults to 1."""
+    limits = {}
+    for item in spec.split(','):
+        route, _, value = item.strip().partition('=')
+        if not route or not value:
+            continue
+        rate, _, burst = value.partition(':')
+        try:
+            rate = float(rate)
+            burst = max(1.0, float(burst or 1))
+        except ValueError:
+            print(f"[dev-proxy] Ignoring malformed DEV_PROXY_RATE_LIMITS entry: {item.strip()}")
+            continue
+        if rate > 0:
+            limits[route.rstrip('/')] = (rate, burst)
+    return limits
+
+
+class _ClientQuota:
+    """Token buckets (route -> [tokens, refilled_at]) and in-flight request count for one client."""
+
+    __slots__ = ('buckets', 'inflight', 'seen')
+
+    def __init__(self, now):
+        self.buckets = {}
+        self.inflight = 0
+        self.seen = now
+
+
+class ClientRateLimiter:
+    """Per-client token buckets per route plus a per-client concurrency quota.
+
+    State is one small object per active client in an LRU; clients idle for
+    RATE_IDLE_TIMEOUT (whose buckets have refilled by then) are swept on
+    access, and the oldest idle ones go first once RATE_MAX_CLIENTS is hit.
+    """
+
+    def __init__(self, limits, max_inflight=CLIENT_MAX_INFLIGHT, idle_timeout=RATE_IDLE_TIMEOUT, max_clients=RATE_MAX_CLIENTS):
+        self.limits = limits
+        self.max_inflight = max_inflight
+        self.idle_timeout = idle_timeout
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()  # identity -> _ClientQuota
+        self._next_sweep = 0.0
+        self.rejected = 0
+
+    def applies(self, route):
+        return route in self.limits
+
+    def acquire(self, identity, route):
+        """Admit one request: (admitted, seconds until a retry could succeed, 'rate' | 'concurrency' | None).
+
+        An admitted request holds a concurrency slot until release().
+        """
+        now = time.monotonic()
+        rate, burst = self.limits[route]
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            client = self._clients.get(identity)
+            if client is None:
+                client = self._clients[identity] = _ClientQuota(now)
+                if len(self._clients) > self.max_clients:
+                    self._evict_one()
+            else:
+                self._clients.move_to_end(identity)
+            client.seen = now
+            if self.max_inflight and client.inflight >= self.max_inflight:
+                self.rejected += 1
+                return False, 1.0, 'concurrency'
+            bucket = client.buckets.get(route)
+            if bucket is None:
+                bucket = client.buckets[route] = [burst, now]
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] < 1.0:
+                self.rejected += 1
+                return False, (1.0 - bucket[0]) / rate, 'rate'
+            bucket[0] -= 1.0
+            client.inflight += 1
+            return True, 0.0, None
+
+    def release(self, identity):
+        with self._lock:
+            client = self._clients.get(identity)
+            if client is not None and client.inflight > 0:
+                client.inflight -= 1
+                client.seen = time.monotonic()
+
+    def _sweep(self, now):
+        self._next_sweep = now + min(self.idle_timeout, 60.0)
+        idle = [identity for identity, client in self._clients.items()
+                if client.inflight == 0 and now - client.seen >= self.idle_timeout and self._refilled(client, now)]
+        for identity in idle:
+            del self._clients[identity]
+
+    def _refilled(self, client, now):
+        # Forgetting a client resets it to full buckets, so only forget it once that is where it would be anyway
+        return all(tokens + (now - stamp) * self.limits[route][0] >= self.limits[route][1]
+                   for route, (tokens, stamp) in client.buckets.items())
+
+    def _evict_one(self):
+        # Least recently seen client that has nothing in flight; busy clients are never dropped
+        for identity, client in self._clients.items():
+            if client.inflight == 0:
+                del self._clients[identity]
+                return
+
+    def stats(self):
+        with self._lock:
+            return {'clients': len(self._clients), 'rejected': self.rejected}
+
+
+_RATE_LIMITS = _parse_rate_limits(RATE_LIMITS_SPEC)
+RATE_LIMITER = ClientRateLimiter(_RATE_LIMITS) if _RATE_LIMITS else None
+
+_ROUTE_LABELS = set()
+_MAX_ROUTE_LABELS = 64
+
+# Gateway-type failures worth retrying on another upstream; a plain 500 is the app's answer
+FAILOVER_STATUS = (502, 503, 504)
+
+
+class Backend:
+    """Load, health and circuit-breaker state for one upstream origin."""
+
+    __slots__ = ('origin', 'name', 'outstanding', 'healthy', 'failures', 'opened_at', 'trial')
+
+    def __init__(self, origin):
+        self.origin = origin
+        self.name = '%s:%s' % (origin[1], origin[2])
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.opened_at = None  # set while the breaker is open
+        self.trial = False  # half-open: a single trial request is in flight
+
+
+class UpstreamGroup:
+    """Interchangeable base URLs for one route; the first is the primary."""
+
+    def __init__(self, bases, backends):
+        self.bases = bases
+        self.backends = backends
+
+    def url(self, backend, rest):
+        return self.bases[self.backends.index(backend)] + rest
+
+
+class Balancer:
+    """Least-outstanding-requests selection across failover groups.
+
+    Upstreams are tracked per origin, so routes that share a host share its
+    load count, health and breaker. An upstream leaves rotation when a probe
+    fails or after BREAKER_FAILURES consecutive 5xx/timeouts; once the
+    cooldown passes a single trial request decides whether it comes back.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._backends = {}
+        self._bases = []  # (base, group), longest base first
+        self._prober = None
+
+    def _backend(self, url):
+        parsed = urlparse(url)
+        scheme = parsed.scheme or 'http'
+        origin = (scheme, parsed.hostname or '', parsed.port or (443 if scheme == 'https' else 80))
+        backend = self._backends.get(origin)
+        if backend is None:
+            backend = self._backends[origin] = Backend(origin)
+        return backend
+
+    def add_group(self, bases):
+        bases = list(dict.fromkeys(bases))
+        if len(bases) < 2:
+            return
+        group = UpstreamGroup(bases, [self._backend(base) for base in bases])
+        self._bases.extend((base, group) for base in bases)
+        self._bases.sort(key=lambda item: len(item[0]), reverse=True)
+
+    def match(self, url):
+        """Return (group, rest) when url lives under a failover base, else (None, None)."""
+        for base, group in self._bases:
+            # Bases match on path boundaries so '/generate' doesn't claim '/generate_image'
+            if url.startswith(base) and (base.endswith('/') or url[len(base):len(base) + 1] in ('', '/', '?')):
+                return group, url[len(base):]
+        return None, None
+
+    def _usable(self, backend, now):
+        if not backend.healthy:
+            return False
+        if backend.opened_at is None:
+            return True
+        return not backend.trial and now - backend.opened_at >= BREAKER_COOLDOWN
+
+    def acquire(self, group, exclude=()):
+        """Pick the least-loaded usable upstream not in exclude (any of them if none is usable)."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in group.backends if b not in exclude]
+            if not candidates:
+                return None
+            usable = [b for b in candidates if self._usable(b, now)]
+            backend = min(usable or candidates, key=lambda b: b.outstanding)
+            if backend.opened_at is not None and now - backend.opened_at >= BREAKER_COOLDOWN:
+                backend.trial = True
+            backend.outstanding += 1
+        METRICS.gauge_add('dev_proxy_upstream_outstanding', {'upstream': backend.name}, 1)
+        return backend
+
+    def release(self, backend):
+        with self._lock:
+            backend.outstanding -= 1
+        METRICS.gauge_add('dev_proxy_upstream_outstanding', {'upstream': backend.name}, -1)
+
+    def record(self, backend, ok):
+        with self._lock:
+            was_open = backend.opened_at is not None
+            backend.trial = False
+            if ok:
+                backend.failures = 0
+                backend.opened_at = None
+            else:
+                backend.failures += 1
+                if was_open or backend.failures >= BREAKER_FAILURES:
+                    backend.opened_at = time.monotonic()
+            now_open = backend.opened_at is not None
+        if now_open != was_open:
+            if now_open:
+                METRICS.inc('dev_proxy_upstream_breaker_open_total', {'upstream': backend.name})
+            try:
+                print(f"[dev-proxy] Circuit {'open' if now_open else 'closed'} for upstream {backend.name}")
+            except Exception:
+                pass
+
+    def _probe(self, backend):
+        scheme, host, port = backend.origin
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=HEALTH_TIMEOUT, context=SSL_CONTEXT)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=HEALTH_TIMEOUT)
+        try:
+            conn.request('GET', HEALTH_PATH, headers={'User-Agent': 'polly-dev-proxy-probe'})
+            return conn.getresponse().status < 500
+        except (OSError, http.client.HTTPException):
+            return False
+        finally:
+            conn.close()
+
+    def _probe_loop(self):
+        while True:
+            for backend in list(self._backends.values()):
+                healthy = self._probe(backend)
+                if healthy == backend.healthy:
+                    continue
+                with self._lock:
+                    backend.healthy = healthy
+                try:
+                    print(f"[dev-proxy] Upstream {backend.name} is {'healthy' if healthy else 'failing health checks'}")
+                except Exception:
+                    pass
+            time.sleep(HEALTH_INTERVAL)
+
+    def start_probing(self):
+        if self._backends and self._prober is None and HEALTH_INTERVAL > 0:
+            self._prober = threading.Thread(target=self._probe_loop, name='dev-proxy-health', daemon=True)
+            self._prober.start()
+
+    def up_series(self):
+        """(labels, 0/1) per upstream for the dev_proxy_upstream_up gauge: healthy with a closed breaker."""
+        with self._lock:
+            return [({'upstream': b.name}, int(b.healthy and b.opened_at is None)) for b in self._backends.values()]
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                'upstream': b.name,
+                'outstanding': b.outstanding,
+                'healthy': b.healthy,
+                'breaker': 'closed' if b.opened_at is None else ('half-open' if now - b.opened_at >= BREAKER_COOLDOWN else 'open'),
+                'failures': b.failures,
+            } for b in self._backends.values()]
+
+
+BALANCER = Balancer()
+
+
+class PooledResponse:
+    """Upstream response that hands its connection back to the pool once the body is fully read."""
+
+    def __init__(self, pool, origin, conn, resp, on_close=None, url=None):
+        self.url = url
+        self._pool = pool
+        self._origin = origin
+        self._conn = conn
+        self._resp = resp
+        self._on_close = on_close
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = resp.headers
+
+    def getcode(self):
+        return self.status
+
+    def geturl(self):
+        # The upstream that actually answered, which after a failover isn't the route's primary
+        return self.url
+
+    def read(self, amt=None):
+        data = self._resp.read() if amt is None else self._resp.read(amt)
+        # A known-length body is closed by http.client with its last bytes, so the connection goes back now
+        if amt is None or not data or self._resp.isclosed():
+            self.close()
+        return data
+
+    @property
+    def complete(self):
+        """True once the upstream body has been read to the end (or the response was closed)."""
+        return self._conn is None
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if self._resp.isclosed() and not self._resp.will_close:
+            self._pool.release(*self._origin, conn)
+        else:
+            self._resp.close()
+            conn.close()
+        if self._on_close is not None:
+            self._on_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class UpstreamConnectError(URLError):
+    """The upstream could not be reached at all, so nothing of the request was sent."""
+
+
+def _send_upstream(method, url, body=None, headers=None, timeout=None, route='other', on_close=None):
+    """Send a request over a pooled connection.
+
+    Mirrors urlopen's error contract so callers keep their handlers: HTTP
+    status >= 400 raises HTTPError, connection failures raise URLError.
+    Redirects are relayed to the client rather than followed. Connect time
+    and time-to-first-byte are recorded per route and upstream host.
+    """
+    parsed = urlparse(url)
+    scheme = parsed.scheme or 'http'
+    host = parsed.hostname or ''
+    port = parsed.port or (443 if scheme == 'https' else 80)
+    target = parsed.path or '/'
+    if parsed.query:
+        target += '?' + parsed.query
+    send_headers = dict(headers or {})
+    send_headers.setdefault('User-Agent', 'polly-dev-proxy')
+    timeout = UPSTREAM_TIMEOUT if timeout is None else timeout
+    origin = (scheme, host, port)
+    labels = {'route': route, 'upstream': '%s:%s' % (host, port)}
+    # Streamed bodies can't be replayed, so only buffered requests get the stale-connection retry
+    replayable = body is None or isinstance(body, (bytes, bytearray))
+    trace_id = send_headers.get('X-Request-ID') if TRACER is not None and send_headers.get('X-Trace-Sampled') == '1' else None
+    for attempt in (0, 1):
+        conn, reused = UPSTREAM_POOL.acquire(scheme, host, port, timeout)
+        try:
+            started = time.monotonic()
+            wall_started = time.time()
+            if not reused:
+                try:
+                    conn.connect()
+                except OSError as e:
+                    conn.close()
+                    METRICS.inc('dev_proxy_upstream_responses_total', dict(labels, status='error'))
+                    raise UpstreamConnectError(e)
+                METRICS.observe('dev_proxy_upstream_connect_seconds', labels, time.monotonic() - started)
+            wall_connected = time.time()
+            conn.request(method, target, body=body, headers=send_headers)
+            wall_sent = time.time()
+            resp = conn.getresponse()
+            METRICS.observe('dev_proxy_upstream_ttfb_seconds', labels, time.monotonic() - started)
+            if trace_id is not None:
+                where = {'upstream': labels['upstream'], 'attempt': attempt + 1}
+                TRACER.emit(trace_id, 'upstream_connect', wall_started, wall_connected, reused=reused, **where)
+                TRACER.emit(trace_id, 'upstream_upload', wall_connected, wall_sent, **where)
+                TRACER.emit(trace_id, 'upstream_first_byte', wall_sent, time.time(), status=resp.status, **where)
+        except (ConnectionResetError, BrokenPipeError, http.client.BadStatusLine) as e:
+            conn.close()
+            # The server may have dropped an idle keep-alive connection; retry once on a fresh one
+            if reused and replayable and attempt == 0:
+                continue
+            METRICS.inc('dev_proxy_upstream_responses_total', dict(labels, status='error'))
+            raise URLError(e)
+        except (OSError, http.client.HTTPException) as e:
+            conn.close()
+            METRICS.inc('dev_proxy_upstream_responses_total', dict(labels, status='error'))
+            raise URLError(e)
+        except BaseException:
+            conn.close()
+            raise
+        METRICS.inc('dev_proxy_upstream_responses_total', dict(labels, status=str(resp.status)))
+        pooled = PooledResponse(UPSTREAM_POOL, origin, conn, resp, on_close, url)
+        if pooled.status >= 400:
+            raise HTTPError(url, pooled.status, pooled.reason, pooled.headers, pooled)
+        return pooled
+
+
+def _send_to_backend(group, backend, rest, method, body, headers, timeout, route):
+    """One attempt against an acquired backend; feeds the breaker and releases the backend when done."""
+    try:
+        resp = _send_upstream(method, group.url(backend, rest), body, headers, timeout, route,
+                              on_close=lambda: BALANCER.release(backend))
+    except HTTPError as e:
+        BALANCER.record(backend, e.code < 500)
+        raise
+    except BaseException as e:
+        BALANCER.release(backend)
+        if isinstance(e, URLError):
+            BALANCER.record(backend, False)
+        raise
+    BALANCER.record(backend, True)
+    return resp
+
+
+def _discard_attempt(future):
+    # A hedged attempt that lost the race: free its connection (and backend slot)
+    try:
+        future.result().close()
+    except HTTPError as e:
+        e.close()
+    except Exception:
+        pass
+
+
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=WORKERS * 2, thread_name_prefix='dev-proxy-hedge')
+
+
+def _hedged_request(group, rest, method, headers, timeout, route):
+    """Race idempotent requests: start a second upstream if the first is slow, keep whichever answers first."""
+    tried = []
+    futures = {}
+
+    def launch():
+        backend = BALANCER.acquire(group, tried)
+        if backend is None:
+            return False
+        tried.append(backend)
+        futures[_HEDGE_POOL.submit(_send_to_backend, group, backend, rest, method, None, headers, timeout, route)] = backend
+        return True
+
+    launch()
+    hedged = False
+    error = None
+    while futures:
+        done, _ = wait(futures, timeout=None if hedged else HEDGE_DELAY, return_when=FIRST_COMPLETED)
+        if not done:
+            hedged = True
+            if launch():
+                METRICS.inc('dev_proxy_upstream_hedges_total', {'route': route})
+            continue
+        for future in done:
+            futures.pop(future)
+            try:
+                winner = future.result()
+            except HTTPError as e:
+                if e.code not in FAILOVER_STATUS:
+                    winner = e
+                else:
+                    if error is not None and isinstance(error, HTTPError):
+                        error.close()
+                    error = e
+                    continue
+            except URLError as e:
+                if not isinstance(error, HTTPError):
+                    error = e
+                continue
+            for other in futures:
+                other.add_done_callback(_discard_attempt)
+            if isinstance(winner, HTTPError):
+                if error is not None and isinstance(error, HTTPError):
+                    error.close()
+                raise winner
+            if isinstance(error, HTTPError):
+                error.close()
+            return winner
+        # Everything launched so far failed: fail over to an upstream we haven't tried yet
+        if not futures and launch():
+            METRICS.inc('dev_proxy_upstream_failovers_total', {'route': route})
+    raise error
+
+
+def _upstream_request(method, url, body=None, headers=None, timeout=None, route='other'):
+    """Send a request upstream, spreading it across the url's failover group if it has one.
+
+    Group members are picked by fewest outstanding requests among healthy,
+    closed-breaker upstreams. Connection failures and 502/503/504 move on to
+    the next upstream when the body can be replayed (or was never sent),
+    and GETs are hedged after HEDGE_DELAY. Errors surface exactly as from
+    _send_upstream.
+    """
+    group, rest = BALANCER.match(url)
+    if group is None:
+        return _send_upstream(method, url, body, headers, timeout, route)
+    if method in ('GET', 'HEAD') and HEDGE_DELAY > 0:
+        return _hedged_request(group, rest, method, headers, timeout, route)
+    replayable = body is None or isinstance(body, (bytes, bytearray))
+    tried = []
+    while True:
+        backend = BALANCER.acquire(group, tried)
+        tried.append(backend)
+        more = len(tried) < len(group.backends)
+        try:
+            return _send_to_backend(group, backend, rest, method, body, headers, timeout, route)
+        except HTTPError as e:
+            if not (more and replayable and e.code in FAILOVER_STATUS):
+                raise
+            e.close()
+        except UpstreamConnectError:
+            if not more:
+                raise
+        except URLError:
+            if not (more and replayable):
+                raise
+        METRICS.inc('dev_proxy_upstream_failovers_total', {'route': route})
+        try:
+            print(f"[dev-proxy] {method} {url}: upstream {backend.name} failed, trying another")
+        except Exception:
+            pass
+
+
+def request_key(target_url: str, body: bytes, accept: str = '', auth: str = '') -> str:
+    """Hash the target URL, Accept header, upstream credentials and body; JSON bodies are normalized first.
+
+    auth is the credential material sent upstream (see ProxyHandler._auth_scope),
+    so one caller's cached or in-flight response is never served to another.
+    """
+    try:
+        normalized = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    except (ValueError, UnicodeDecodeError):
+        normalized = body
+    h = hashlib.sha256()
+    h.update(target_url.encode('utf-8'))
+    h.update(b'\n')
+    h.update(accept.encode('utf-8'))
+    h.update(b'\n')
+    h.update(auth.encode('utf-8', 'surrogateescape'))
+    h.update(b'\n')
+    h.update(normalized)
+    return h.hexdigest()
+
+
+class ResponseCache:
+    """Content-addressed cache of successful upstream responses.
+
+    Small bodies live in an in-memory LRU; bodies above the per-item limit
+    are written to CACHE_DIR. Both tiers evict least-recently-used entries
+    once over their byte budget, and entries expire after the TTL.
+    """
+
+    def __init__(self, directory=CACHE_DIR, ttl=CACHE_TTL, mem_bytes=CACHE_MEM_BYTES,
+                 mem_item_bytes=CACHE_MEM_ITEM_BYTES, disk_bytes=CACHE_DISK_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.mem_bytes = mem_bytes
+        self.mem_item_bytes = mem_item_bytes
+        self.disk_bytes = disk_bytes
+        self._lock = threading.Lock()
+        self._mem = OrderedDict()   # key -> (expires, status, content_type, data)
+        self._mem_size = 0
+        self._disk = OrderedDict()  # key -> (expires, status, content_type, size)
+        self._disk_size = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_disk_index()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + '.bin', base + '.json'
+
+    def _load_disk_index(self):
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if name.endswith('.part'):
+                # Leftover from an interrupted write
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                continue
+            if not name.endswith('.json'):
+                continue
+            key = name[:-5]
+            bin_path, meta_path = self._paths(key)
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                st = os.stat(bin_path)
+            except (OSError, ValueError):
+                self._remove_files(key)
+                continue
+            if meta.get('expires', 0) <= now:
+                self._remove_files(key)
+                continue
+            entries.append((st.st_mtime, key, meta, st.st_size))
+        for _, key, meta, size in sorted(entries):
+            self._disk[key] = (meta['expires'], meta.get('status', 200), meta.get('content_type', 'application/octet-stream'), size)
+            self._disk_size += size
+        self._evict_disk()
+
+    def _remove_files(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, key):
+        """Return (status, content_type, size, data_or_file) for a live entry, or None.
+
+        Disk hits come back as an open file the caller must close.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                expires, status, content_type, data = entry
+                if expires > now:
+                    self._mem.move_to_end(key)
+                    return status, content_type, len(data), data
+                del self._mem[key]
+                self._mem_size -= len(data)
+            entry = self._disk.get(key)
+            if entry is None:
+                return None
+            expires, status, content_type, size = entry
+            if expires > now:
+                try:
+                    f = open(self._paths(key)[0], 'rb')
+                except OSError:
+                    f = None
+                if f is not None:
+                    self._disk.move_to_end(key)
+                    return status, content_type, size, f
+            del self._disk[key]
+            self._disk_size -= size
+        self._remove_files(key)
+        return None
+
+    def writer(self, key, status, content_type):
+        return _CacheWriter(self, key, status, content_type)
+
+    def _commit_mem(self, key, status, content_type, data):
+        with self._lock:
+            old = self._mem.pop(key, None)
+            if old is not None:
+                self._mem_size -= len(old[3])
+            self._mem[key] = (time.time() + self.ttl, status, content_type, data)
+            self._mem_size += len(data)
+            while self._mem_size > self.mem_bytes and self._mem:
+                _, (_, _, _, evicted) = self._mem.popitem(last=False)
+                self._mem_size -= len(evicted)
+
+    def _commit_disk(self, key, status, content_type, tmp_path, size):
+        bin_path, meta_path = self._paths(key)
+        expires = time.time() + self.ttl
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'expires': expires, 'status': status, 'content_type': content_type}, f)
+        os.replace(tmp_path, bin_path)
+        with self._lock:
+            old = self._disk.pop(key, None)
+            if old is not None:
+                self._disk_size -= old[3]
+            self._disk[key] = (expires, status, content_type, size)
+            self._disk_size += size
+            evicted = self._evict_disk_locked()
+        for old_key in evicted:
+            self._remove_files(old_key)
+
+    def _evict_disk(self):
+        with self._lock:
+            evicted = self._evict_disk_locked()
+        for old_key in evicted:
+            self._remove_files(old_key)
+
+    def _evict_disk_locked(self):
+        evicted = []
+        while self._disk_size > self.disk_bytes and self._disk:
+            old_key, (_, _, _, size) = self._disk.popitem(last=False)
+            self._disk_size -= size
+            evicted.append(old_key)
+        return evicted
+
+
+class _CacheWriter:
+    """Collects a relayed body in memory, spilling to a temp file in the cache dir once it gets large."""
+
+    def __init__(self, cache, key, status, content_type):
+        self._cache = cache
+        self._key = key
+        self._status = status
+        self._content_type = content_type
+        self._chunks = []
+        self._size = 0
+        self._file = None
+
+    def write(self, chunk):
+        if self._file is None and self._size + len(chunk) > self._cache.mem_item_bytes:
+            self._file = tempfile.NamedTemporaryFile(dir=self._cache.directory, suffix='.part', delete=False)
+            for pending in self._chunks:
+                self._file.write(pending)
+            self._chunks = []
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._chunks.append(chunk)
+        self._size += len(chunk)
+
+    def commit(self):
+        if self._file is None:
+            self._cache._commit_mem(self._key, self._status, self._content_type, b''.join(self._chunks))
+            return
+        self._file.close()
+        try:
+            self._cache._commit_disk(self._key, self._status, self._content_type, self._file.name, self._size)
+        except OSError:
+            self.abort()
+
+    def wants_remainder(self):
+        return False
+
+    def abort(self):
+        self._chunks = []
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.remove(self._file.name)
+            except OSError:
+                pass
+
+
+RESPONSE_CACHE = ResponseCache() if CACHE_ENABLED else None
+
+
+class _Flight:
+    """One in-progress upstream call whose response is broadcast to identical concurrent requests.
+
+    Chunks are kept only while an attached reader still needs them. Up to
+    `window` bytes of the head stay buffered so followers that join late can
+    still start from the first byte; past that, chunks every reader has taken
+    are dropped and the flight takes no new followers. A reader that falls a
+    whole window behind stalls the leader for up to LAG_TIMEOUT seconds and
+    is then cut off (its client gets a truncated body).
+    """
+
+    LAG_TIMEOUT = 30.0
+
+    def __init__(self, window=COALESCE_WINDOW_BYTES):
+        self._cond = threading.Condition()
+        self._window = window
+        self._chunks = deque()
+        self._base = 0  # index of _chunks[0] within the whole body
+        self._buffered = 0
+        self._readers = {}  # _FlightReader -> index of the next chunk it reads
+        self._state = 'pending'  # pending -> streaming -> done | aborted
+        self.status = None
+        self.headers = {}
+
+    @property
+    def followers(self):
+        with self._cond:
+            return len(self._readers)
+
+    def attach(self, on_close=None):
+        """A reader positioned at the first chunk, or None once the head has been dropped."""
+        with self._cond:
+            if self._base:
+                return None
+            reader = _FlightReader(self, on_close)
+            self._readers[reader] = 0
+            return reader
+
+    def detach(self, reader):
+        with self._cond:
+            if self._readers.pop(reader, None) is not None:
+                self._trim_locked()
+                self._cond.notify_all()
+
+    def start(self, status, headers):
+        with self._cond:
+            self.status = status
+            self.headers = headers
+            self._state = 'streaming'
+            self._cond.notify_all()
+
+    def write(self, chunk):
+        with self._cond:
+            self._chunks.append(chunk)
+            self._buffered += len(chunk)
+            self._cond.notify_all()
+            deadline = None
+            while True:
+                self._trim_locked()
+                if self._buffered <= self._window:
+                    return
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.LAG_TIMEOUT
+                if now >= deadline:
+                    # Still holding the head after the grace period: stop waiting for these readers
+                    for reader in [r for r, index in self._readers.items() if index <= self._base]:
+                        del self._readers[reader]
+                    self._cond.notify_all()
+                    continue
+                self._cond.wait(deadline - now)
+
+    def _trim_locked(self):
+        if self._buffered <= self._window:
+            return
+        low = min(self._readers.values(), default=self._base + len(self._chunks))
+        while self._chunks and self._base < low:
+            self._buffered -= len(self._chunks.popleft())
+            self._base += 1
+
+    def commit(self):
+        with self._cond:
+            self._state = 'done'
+            self._cond.notify_all()
+
+    def abort(self):
+        with self._cond:
+            if self._state != 'done':
+                self._state = 'aborted'
+                self._cond.notify_all()
+
+    def publish(self, status, headers, body):
+        self.start(status, headers)
+        self.write(body)
+        self.commit()
+
+    def wants_remainder(self):
+        # Keep reading upstream for followers even if the leader's own client disconnects
+        return self.followers > 0
+
+    def wait_started(self) -> bool:
+        """Block until the leader has a response; False if it gave up before getting one."""
+        with self._cond:
+            while self._state == 'pending':
+                self._cond.wait()
+            return self._state != 'aborted' or self.status is not None
+
+    def read(self, reader):
+        with self._cond:
+            while True:
+                index = self._readers.get(reader)
+                if index is None:
+                    raise ConnectionResetError('coalesced follower fell too far behind the upstream body')
+                if index < self._base + len(self._chunks) or self._state != 'streaming':
+                    break
+                self._cond.wait()
+            if index < self._base + len(self._chunks):
+                self._readers[reader] = index + 1
+                chunk = self._chunks[index - self._base]
+                if self._buffered > self._window:
+                    self._trim_locked()
+                    self._cond.notify_all()
+                return chunk
+            if self._state == 'done':
+                return b''
+        raise ConnectionResetError('coalesced upstream call aborted mid-body')
+
+
+class _FlightReader:
+    """Response-like view of a flight so followers can go through the normal relay path."""
+
+    def __init__(self, flight, on_close=None):
+        self._flight = flight
+        self._on_close = on_close
+
+    @property
+    def headers(self):
+        return self._flight.headers
+
+    def wait_started(self) -> bool:
+        return self._flight.wait_started()
+
+    def getcode(self):
+        return self._flight.status
+
+    def read(self, amt=None):
+        return self._flight.read(self)
+
+    def close(self):
+        self._flight.detach(self)
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            on_close()
+
+
+class _CachedResponse:
+    """Response-like view of a ResponseCache hit so it can be replayed through the relay path."""
+
+    def __init__(self, hit):
+        self.status, content_type, size, self._body = hit
+        self.headers = {'Content-Type': content_type, 'Content-Length': str(size)}
+
+    def getcode(self):
+        return self.status
+
+    def read(self, amt=None):
+        body = self._body
+        if isinstance(body, bytes):
+            self._body = b''
+            return body
+        return body.read(STREAM_CHUNK_SIZE if amt is None else amt)
+
+    def close(self):
+        if not isinstance(self._body, bytes):
+            self._body.close()
+
+
+class SingleFlight:
+    """Registry of in-flight upstream calls keyed by request_key()."""
+
+    def __init__(self, max_followers=COALESCE_MAX_FOLLOWERS, window=COALESCE_WINDOW_BYTES):
+        self.max_followers = max_followers
+        self.window = window
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._followers = 0
+        self.leaders = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def join(self, key):
+        """Return (flight, is_leader); the leader must call finish() when done.
+
+        A follower gets a _FlightReader attached to the leader's flight (close
+        it when done), or None when max_followers are already waiting across
+        all flights. A flight that has dropped its head takes no followers;
+        the caller then leads a fresh flight under the same key.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                if self.max_followers and self._followers >= self.max_followers:
+                    self.rejected += 1
+                    return None, False
+                reader = flight.attach(self._follower_done)
+                if reader is not None:
+                    self._followers += 1
+                    self.coalesced += 1
+                    return reader, False
+            flight = _Flight(self.window)
+            self._flights[key] = flight
+            self.leaders += 1
+            return flight, True
+
+    def _follower_done(self):
+        with self._lock:
+            self._followers -= 1
+
+    def finish(self, key, flight):
+        flight.abort()
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+
+COALESCER = SingleFlight() if COALESCE_ENABLED else None
+
+
+def _shared_headers(headers):
+    names = ('Content-Type', 'Content-Length', 'Location') + RELAY_HEADERS
+    return {name: headers.get(name) for name in names if headers.get(name) is not None}
+
+
+def _cache_control(value):
+    """Parse a Cache-Control header into {directive: value or True}."""
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip().strip('"') if arg else True
+    return directives
+
+
+def _http_date(value):
+    """Seconds since the epoch for an HTTP date header, or None if missing or malformed."""
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def _etag_matches(if_none_match, etag):
+    """Weak comparison of an If-None-Match list against one entity tag (RFC 9110 13.1.2)."""
+    if not etag:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith('W/') else candidate) == opaque:
+            return True
+    return False
+
+
+def not_modified(request_headers, etag, last_modified):
+    """True when the client's conditional headers say its copy is still current.
+
+    If-None-Match takes precedence; If-Modified-Since is only consulted when
+    the client sent no entity tags.
+    """
+    if_none_match = request_headers.get('If-None-Match')
+    if if_none_match:
+        return _etag_matches(if_none_match, etag)
+    since = _http_date(request_headers.get('If-Modified-Since'))
+    modified = _http_date(last_modified)
+    return since is not None and modified is not None and modified <= since
+
+
+class ValidatorCache:
+    """LRU of upstream GET validators (ETag / Last-Modified) and how long they stay fresh.
+
+    Only metadata is kept, never bodies: while an entry is fresh, a client
+    revalidating with matching validators gets a 304 without an upstream
+    round trip. Stale or unknown entries go upstream with the client's
+    conditional headers, so the upstream can still answer 304 itself.
+
+    Entries are per URL and upstream credentials, and remember the request
+    headers named in the response's Vary: a request whose values differ
+    (another variant) goes upstream. `Vary: *` responses are not kept, and
+    `If-None-Match: *` is always left to the upstream.
+    """
+
+    def __init__(self, max_entries=VALIDATOR_MAX, default_ttl=VALIDATOR_TTL):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (url, auth) -> (fresh_until, headers, variant)
+        self.hits = 0
+
+    def _lifetime(self, headers):
+        cc = _cache_control(headers.get('Cache-Control'))
+        if 'no-store' in cc or 'no-cache' in cc:
+            return None
+        for directive in ('s-maxage', 'max-age'):
+            if directive in cc:
+                try:
+                    age = float(headers.get('Age') or 0)
+                    return float(cc[directive]) - age
+                except ValueError:
+                    return None
+        expires = _http_date(headers.get('Expires'))
+        if expires is not None:
+            return expires - (_http_date(headers.get('Date')) or time.time())
+        return self.default_ttl
+
+    @staticmethod
+    def _variant(vary, request_headers):
+        """The request's values for the headers a response varies on; None for `Vary: *`."""
+        names = sorted({name.strip().lower() for name in (vary or '').split(',') if name.strip()})
+        if '*' in names:
+            return None
+        return tuple((name, request_headers.get(name) or '') for name in names)
+
+    def record(self, url, status, headers, request_headers, auth=''):
+        """Remember (or forget) the validators from a 200 or 304 upstream response to a GET."""
+        if status not in (200, 304):
+            return
+        key = (url, auth)
+        with self._lock:
+            previous = self._entries.get(key)
+        kept = {}
+        if status == 304 and previous is not None and previous[2] == self._variant(previous[1].get('Vary'), request_headers):
+            kept = dict(previous[1])
+        # Content-* describe the body the client holds, which decides whether the relay encoded it
+        for name in ('ETag', 'Last-Modified', 'Cache-Control', 'Expires', 'Vary') + (('Content-Type', 'Content-Length', 'Content-Encoding') if status == 200 else ()):
+            if headers.get(name) is not None:
+                kept[name] = headers.get(name)
+        variant = self._variant(kept.get('Vary'), request_headers)
+        # A 304 may omit Cache-Control; fall back to what the full response said
+        lifetime = self._lifetime(dict(kept, Age=headers.get('Age'), Date=headers.get('Date')))
+        with self._lock:
+            if variant is None or lifetime is None or lifetime <= 0 or not (kept.get('ETag') or kept.get('Last-Modified')):
+                self._entries.pop(key, None)
+                return
+            self._entries[key] = (time.monotonic() + lifetime, kept, variant)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, url, request_headers, auth='', represent=None):
+        """Headers for a local 304 if the client's validators match a fresh entry for its variant, else None.
+
+        represent(headers) maps the upstream's validators to the ones this
+        client was sent (see ProxyHandler._client_validators); matching and
+        the returned headers both use that form.
+        """
+        if_none_match = (request_headers.get('If-None-Match') or '').strip()
+        if if_none_match == '*' or not (if_none_match or request_headers.get('If-Modified-Since')):
+            # '*' asks whether any representation exists, which only the upstream can say
+            return None
+        key = (url, auth)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            headers, variant = entry[1], entry[2]
+        if variant != self._variant(headers.get('Vary'), request_headers):
+            return None
+        if represent is not None:
+            headers = represent(headers)
+        if not not_modified(request_headers, headers.get('ETag'), headers.get('Last-Modified')):
+            return None
+        with self._lock:
+            self.hits += 1
+        return headers
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits}
+
+
+VALIDATORS = ValidatorCache() if VALIDATORS_ENABLED else None
+
+
+def choose_encoding(accept_encoding):
+    """Pick 'br' or 'gzip' from an Accept-Encoding header, or None for identity."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(','):
+        token, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[token.strip().lower()] = q
+    star = weights.get('*', 0.0)
+    offered = (('br', 'gzip') if brotli is not None else ('gzip',))
+    best = max(offered, key=lambda name: weights.get(name, star))
+    return best if weights.get(best, star) > 0 else None
+
+
+def _weak_etag(etag):
+    # Encoded bytes differ from the upstream's, so its strong tag only holds weakly
+    return etag if etag.startswith('W/') else 'W/' + etag
+
+
+def _vary_accept_encoding(vary):
+    if not vary:
+        return 'Accept-Encoding'
+    return vary if 'accept-encoding' in vary.lower() else vary + ', Accept-Encoding'
+
+
+def compressible(content_type):
+    media = (content_type or '').split(';', 1)[0].strip().lower()
+    return bool(media) and any(media.startswith(t) if t.endswith('/') else media == t for t in COMPRESS_TYPES)
+
+
+class _Encoder:
+    """Streaming gzip/brotli encoder; each chunk is flushed so relayed streams stay incremental."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._br = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._br = None
+            self._z = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def encode(self, chunk):
+        self.bytes_in += len(chunk)
+        if self._br is not None:
+            out = self._br.process(chunk) + self._br.flush()
+        else:
+            out = self._z.compress(chunk) + self._z.flush(zlib.Z_SYNC_FLUSH)
+        self.bytes_out += len(out)
+        return out
+
+    def finish(self):
+        out = self._br.finish() if self._br is not None else self._z.flush(zlib.Z_FINISH)
+        self.bytes_out += len(out)
+        return out
+
+
+class GLBError(ValueError):
+    """The body is not a GLB this proxy can re-pack; the message says why and it is relayed unchanged."""
+
+
+_GLB_JSON_CHUNK = 0x4E4F534A
+_GLB_BIN_CHUNK = 0x004E4942
+_GL_BYTE, _GL_UNSIGNED_BYTE, _GL_SHORT, _GL_UNSIGNED_SHORT, _GL_UNSIGNED_INT, _GL_FLOAT = 5120, 5121, 5122, 5123, 5125, 5126
+_GL_ARRAY_BUFFER, _GL_ELEMENT_ARRAY_BUFFER = 34962, 34963
+_GLTF_COMPONENTS = {'SCALAR': 1, 'VEC2': 2, 'VEC3': 3, 'VEC4': 4, 'MAT2': 4, 'MAT3': 9, 'MAT4': 16}
+_GL_TYPECODES = {_GL_BYTE: 'b', _GL_UNSIGNED_BYTE: 'B', _GL_SHORT: 'h', _GL_UNSIGNED_SHORT: 'H', _GL_UNSIGNED_INT: 'I', _GL_FLOAT: 'f'}
+_GLB_ALREADY_PACKED = ('KHR_draco_mesh_compression', 'EXT_meshopt_compression', 'KHR_mesh_quantization')
+
+
+def parse_glb(data):
+    """Split a GLB container into its JSON document and BIN chunk."""
+    if len(data) < 20 or data[:4] != b'glTF':
+        raise GLBError('not a GLB container')
+    version, total = struct.unpack_from('<II', data, 4)
+    if version != 2 or total > len(data):
+        raise GLBError('unsupported GLB version or truncated body')
+    offset = 12
+    doc = None
+    binary = b''
+    while offset + 8 <= total:
+        length, kind = struct.unpack_from('<II', data, offset)
+        chunk = data[offset + 8:offset + 8 + length]
+        if kind == _GLB_JSON_CHUNK and doc is None:
+            try:
+                doc = json.loads(bytes(chunk))
+            except ValueError:
+                raise GLBError('malformed JSON chunk')
+        elif kind == _GLB_BIN_CHUNK and not binary:
+            binary = bytes(chunk)
+        offset += 8 + length
+    if doc is None:
+        raise GLBError('missing JSON chunk')
+    return doc, binary
+
+
+def build_glb(doc, binary):
+    """Serialize a glTF document and BIN chunk as a GLB container (chunks padded to 4 bytes)."""
+    text = json.dumps(doc, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    text += b' ' * (-len(text) % 4)
+    binary = bytes(binary) + b'\0' * (-len(binary) % 4)
+    total = 12 + 8 + len(text) + (8 + len(binary) if binary else 0)
+    parts = [struct.pack('<4sII', b'glTF', 2, total), struct.pack('<II', len(text), _GLB_JSON_CHUNK), text]
+    if binary:
+        parts += [struct.pack('<II', len(binary), _GLB_BIN_CHUNK), binary]
+    return b''.join(parts)
+
+
+def _read_accessor(doc, binary, accessor):
+    """Flat array of an accessor's components, de-interleaved."""
+    view = doc['bufferViews'][accessor['bufferView']]
+    code = _GL_TYPECODES[accessor['componentType']]
+    ncomp = _GLTF_COMPONENTS[accessor['type']]
+    elem = ncomp * array(code).itemsize
+    count = accessor['count']
+    start = view.get('byteOffset', 0) + accessor.get('byteOffset', 0)
+    stride = view.get('byteStride') or elem
+    mv = memoryview(binary)
+    if stride == elem:
+        raw = mv[start:start + count * elem]
+    else:
+        raw = b''.join(mv[start + i * stride:start + i * stride + elem] for i in range(count))
+    if len(raw) != count * elem:
+        raise GLBError('accessor reaches past the end of the BIN chunk')
+    values = array(code)
+    values.frombytes(raw)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _normalized(values, ncomp, padded, typecode, scale, lo, hi, offset=None, inv=1.0):
+    """Quantize float components to integers, optionally padding each element to `padded` components."""
+    out = array(typecode, bytes(array(typecode).itemsize * padded * (len(values) // ncomp)))
+    for k in range(ncomp):
+        origin = offset[k] if offset is not None else 0.0
+        out[k::padded] = array(typecode, [min(hi, max(lo, round((v - origin) * inv * scale))) for v in values[k::ncomp]])
+    return out
+
+
+def quantize_glb(data):
+    """Re-pack a GLB with quantized vertex attributes and 16-bit indices where they fit.
+
+    Positions become normalized int16 on one uniform grid around the scene's
+    bounding box; each mesh node gets a child node carrying the inverse
+    scale/offset. Normals and tangents become normalized int8, texture
+    coordinates inside [0, 1] normalized uint16. Raises GLBError when the
+    file is already compressed or uses features this pass leaves alone
+    (skins, morph targets, external buffers).
+    """
+    doc, binary = parse_glb(data)
+    used = set(doc.get('extensionsUsed') or ())
+    if used.intersection(_GLB_ALREADY_PACKED):
+        raise GLBError('geometry is already compressed')
+    buffers = doc.get('buffers') or []
+    if len(buffers) != 1 or 'uri' in buffers[0] or not binary:
+        raise GLBError('geometry lives outside the GLB BIN chunk')
+    if doc.get('skins'):
+        raise GLBError('skinned meshes are left as-is')
+    accessors = doc.get('accessors') or []
+    meshes = doc.get('meshes') or []
+    # Accessors that animations read must keep their float layout
+    protected = set()
+    for animation in doc.get('animations') or ():
+        for sampler in animation.get('samplers') or ():
+            protected.update((sampler.get('input'), sampler.get('output')))
+    plans = {}
+    conflicts = set()
+
+    def plan(index, kind):
+        acc = accessors[index]
+        if index in protected or 'sparse' in acc or 'bufferView' not in acc:
+            conflicts.add(index)
+        elif plans.setdefault(index, kind) != kind:
+            conflicts.add(index)
+
+    positions = set()
+    for mesh in meshes:
+        for prim in mesh.get('primitives') or ():
+            if prim.get('targets'):
+                raise GLBError('morph targets are left as-is')
+            for semantic, index in (prim.get('attributes') or {}).items():
+                acc = accessors[index]
+                if acc.get('componentType') != _GL_FLOAT:
+                    continue
+                if semantic == 'POSITION' and acc.get('type') == 'VEC3':
+                    positions.add(index)
+                    plan(index, 'position')
+                elif semantic == 'NORMAL' and acc.get('type') == 'VEC3':
+                    plan(index, 'normal')
+                elif semantic == 'TANGENT' and acc.get('type') == 'VEC4':
+                    plan(index, 'tangent')
+                elif semantic.startswith('TEXCOORD_') and acc.get('type') == 'VEC2':
+                    plan(index, 'texcoord')
+            index = prim.get('indices')
+            if index is not None and accessors[index].get('componentType') == _GL_UNSIGNED_INT:
+                plan(index, 'index')
+    for index in conflicts:
+        plans.pop(index, None)
+    # One grid for all meshes, or none: a mesh node's dequantization transform applies to every primitive
+    quantize_positions = bool(positions) and all(index in plans for index in positions)
+    if not quantize_positions:
+        for index in positions:
+            plans.pop(index, None)
+
+    values = {index: _read_accessor(doc, binary, accessors[index]) for index in plans}
+    if quantize_positions:
+        populated = [values[i] for i in positions if len(values[i])] or [array('f', [0.0] * 3)]
+        lo = [min(min(v[k::3]) for v in populated) for k in range(3)]
+        hi = [max(max(v[k::3]) for v in populated) for k in range(3)]
+        center = [(a + b) / 2.0 for a, b in zip(lo, hi)]
+        half = max(b - a for a, b in zip(lo, hi)) / 2.0 or 1.0
+    encoded = {}
+    for index, kind in plans.items():
+        acc = accessors[index]
+        vals = values[index]
+        if kind == 'position':
+            out = _normalized(vals, 3, 4, 'h', 32767, -32767, 32767, center, 1.0 / half)
+            encoded[index] = (out, _GL_SHORT, True, 8, [[min(out[k::4]) for k in range(3)], [max(out[k::4]) for k in range(3)]])
+        elif kind == 'normal':
+            encoded[index] = (_normalized(vals, 3, 4, 'b', 127, -127, 127), _GL_BYTE, True, 4, None)
+        elif kind == 'tangent':
+            encoded[index] = (_normalized(vals, 4, 4, 'b', 127, -127, 127), _GL_BYTE, True, 4, None)
+        elif kind == 'texcoord':
+            if vals and (min(vals) < 0.0 or max(vals) > 1.0):
+                continue  # tiling UVs would need KHR_texture_transform; keep them as floats
+            encoded[index] = (_normalized(vals, 2, 2, 'H', 65535, 0, 65535), _GL_UNSIGNED_SHORT, True, None, None)
+        elif kind == 'index':
+            if vals and max(vals) >= 65535:  # 0xFFFF is the primitive-restart value
+                continue
+            encoded[index] = (array('H', vals), _GL_UNSIGNED_SHORT, False, None, None)
+    if not encoded:
+        raise GLBError('nothing to quantize')
+
+    # Copy every buffer view something still points at, then append the quantized ones
+    views = doc.get('bufferViews') or []
+    referenced = set()
+    for index, acc in enumerate(accessors):
+        if index not in encoded and 'bufferView' in acc:
+            referenced.add(acc['bufferView'])
+        sparse = acc.get('sparse') or {}
+        for part in ('indices', 'values'):
+            if 'bufferView' in (sparse.get(part) or {}):
+                referenced.add(sparse[part]['bufferView'])
+    for image in doc.get('images') or ():
+        if 'bufferView' in image:
+            referenced.add(image['bufferView'])
+    out = bytearray()
+    new_views = []
+    remap = {}
+    for old, view in enumerate(views):
+        if old not in referenced:
+            continue
+        out += b'\0' * (-len(out) % 4)
+        start = view.get('byteOffset', 0)
+        view = dict(view, byteOffset=len(out))
+        out += binary[start:start + view['byteLength']]
+        remap[old] = len(new_views)
+        new_views.append(view)
+    for acc in accessors:
+        if 'bufferView' in acc and acc['bufferView'] in remap:
+            acc['bufferView'] = remap[acc['bufferView']]
+        for part in ('indices', 'values'):
+            section = (acc.get('sparse') or {}).get(part) or {}
+            if section.get('bufferView') in remap:
+                section['bufferView'] = remap[section['bufferView']]
+    for image in doc.get('images') or ():
+        if image.get('bufferView') in remap:
+            image['bufferView'] = remap[image['bufferView']]
+    for index, (packed, component_type, normalized, stride, bounds) in sorted(encoded.items()):
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        raw = packed.tobytes()
+        out += b'\0' * (-len(out) % 4)
+        view = {'buffer': 0, 'byteOffset': len(out), 'byteLength': len(raw)}
+        if stride:
+            view['byteStride'] = stride
+        view['target'] = _GL_ELEMENT_ARRAY_BUFFER if plans[index] == 'index' else _GL_ARRAY_BUFFER
+        out += raw
+        acc = accessors[index]
+        acc.pop('byteOffset', None)
+        acc.pop('min', None)
+        acc.pop('max', None)
+        acc['bufferView'] = len(new_views)
+        acc['componentType'] = component_type
+        if normalized:
+            acc['normalized'] = True
+        if bounds is not None:
+            acc['min'], acc['max'] = bounds
+        new_views.append(view)
+    doc['bufferViews'] = new_views
+    buffers[0]['byteLength'] = len(out)
+
+    if quantize_positions:
+        nodes = doc.setdefault('nodes', [])
+        for node in list(nodes):
+            if 'mesh' in node:
+                nodes.append({'mesh': node.pop('mesh'), 'translation': center, 'scale': [half, half, half]})
+                node.setdefault('children', []).append(len(nodes) - 1)
+    # Core glTF already allows normalized integer UVs; quantized positions, normals and tangents need the extension
+    if any(plans[index] in ('position', 'normal', 'tangent') for index in encoded):
+        for key in ('extensionsUsed', 'extensionsRequired'):
+            names = doc.setdefault(key, [])
+            if 'KHR_mesh_quantization' not in names:
+                names.append('KHR_mesh_quantization')
+    return build_glb(doc, out)
+
+
+class GLBOptimizer:
+    """quantize_glb() behind an LRU keyed by the SHA-256 of the original body.
+
+    Outcomes that don't shrink the file are remembered too, so a model that
+    can't be improved is parsed only once per cache lifetime.
+    """
+
+    def __init__(self, max_bytes=GLB_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # sha256 -> (optimized bytes or None, reason)
+        self._size = 0
+
+    def optimize(self, data):
+        """Return (body, reason): the optimized bytes with reason None, or the original and why not."""
+        key = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            started = time.monotonic()
+            try:
+                optimized, reason = quantize_glb(data), None
+                if len(optimized) >= len(data):
+                    optimized, reason = None, 'quantized file is not smaller'
+            except GLBError as e:
+                optimized, reason = None, str(e)
+            except (KeyError, IndexError, TypeError, ValueError, struct.error) as e:
+                optimized, reason = None, f'malformed glTF ({type(e).__name__})'
+            METRICS.observe('dev_proxy_glb_optimize_seconds', {}, time.monotonic() - started)
+            entry = (optimized, reason)
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = entry
+                    self._size += len(optimized or b'')
+                    while self._size > self.max_bytes and len(self._entries) > 1:
+                        _, (old, _) = self._entries.popitem(last=False)
+                        self._size -= len(old or b'')
+        optimized, reason = entry
+        METRICS.inc('dev_proxy_glb_responses_total', {'result': 'optimized' if optimized is not None else 'skipped'})
+        if optimized is None:
+            return data, reason
+        METRICS.inc('dev_proxy_glb_saved_bytes_total', {}, len(data) - len(optimized))
+        return optimized, None
+
+
+GLB_OPTIMIZER = GLBOptimizer() if GLB_OPTIMIZE else None
+
+
+def is_glb(content_type):
+    return (content_type or '').split(';', 1)[0].strip().lower() == 'model/gltf-binary'
+
+
+class Route:
+    """A compiled client-path -> upstream mapping with its own timeout and header policy.
+
+    Targets are absolute URLs resolved once at import time, so a request
+    only needs a dict lookup (or a short prefix scan) plus a string concat.
+    """
+
+    __slots__ = ('name', 'path', 'prefix', 'target', 'post_target', 'timeout',
+                 'forward_headers', 'inject_auth', '_joiner', '_post_joiner')
+
+    def __init__(self, name, path, target, prefix=False, post_target=None, timeout=None,
+                 forward_headers=DEFAULT_FORWARD_HEADERS, inject_auth=True):
+        self.name = name
+        self.path = path
+        self.prefix = prefix
+        self.target = target
+        self.post_target = post_target or None
+        self.timeout = timeout
+        self.forward_headers = tuple(forward_headers)
+        self.inject_auth = inject_auth
+        self._joiner = '&' if '?' in target else '?'
+        self._post_joiner = '&' if '?' in (post_target or '') else '?'
+
+    def url(self, rest: str, query: str, method: str = 'GET') -> str:
+        if method == 'POST' and self.post_target:
+            base, joiner = self.post_target, self._post_joiner
+        else:
+            base, joiner = self.target, self._joiner
+        url = base + rest
+        if query:
+            url += joiner + query
+        return url
+
+
+def _base_dir(base: str) -> str:
+    # What urljoin(base, relative) resolves against: everything up to the last '/'
+    return base if base.endswith('/') else base.rsplit('/', 1)[0] + '/'
+
+
+def _load_route_specs(specs):
+    """Overlay route specs from DEV_PROXY_ROUTES_FILE / DEV_PROXY_ROUTES (JSON list or {"routes": [...]})."""
+    sources = []
+    if ROUTES_FILE:
+        try:
+            with open(ROUTES_FILE, 'r', encoding='utf-8') as f:
+                sources.append((ROUTES_FILE, json.load(f)))
+        except (OSError, ValueError) as e:
+            print(f"[dev-proxy] Ignoring route file {ROUTES_FILE}: {e}")
+    if ROUTES_JSON:
+        try:
+            sources.append(('DEV_PROXY_ROUTES', json.loads(ROUTES_JSON)))
+        except ValueError as e:
+            print(f"[dev-proxy] Ignoring DEV_PROXY_ROUTES: {e}")
+    for origin, doc in sources:
+        entries = doc.get('routes', []) if isinstance(doc, dict) else doc
+        for entry in entries:
+            if isinstance(entry, dict) and not entry.get('target') and entry.get('targets'):
+                entry = dict(entry, target=entry['targets'][0])
+            if not isinstance(entry, dict) or not entry.get('path') or not entry.get('target'):
+                print(f"[dev-proxy] Ignoring route without path/target in {origin}: {entry!r}")
+                continue
+            specs[(entry['path'].rstrip('/'), entry.get('match', 'exact'))] = entry
+    return specs
+
+
+def _compile_routes():
+    # Mirror Vercel rewrites: map clean URLs to /api/* function names; base already ends with '/api/'
+    specs = {}
+    for path, target in (
+        ('/generate', 'generate'),
+        ('/generate_image', 'generate_image'),
+        ('/login', 'login'),
+        ('/request-email-code', 'request_email_code'),
+        ('/login-email-code', 'login_email_code'),
+        ('/request-sms-code', 'request_sms_code'),
+        ('/login-sms-code', 'login_sms_code'),
+        ('/oauth/apple/start', 'oauth_apple_start'),
+        ('/print-checkout', 'print_checkout'),
+    ):
+        specs[(path, 'exact')] = {'path': path, 'target': target}
+    # Special-case Google OAuth start: forward directly to backend start URL
+    # to avoid upstream 404 when the Vercel function isn't available.
+    # We preserve the original query string (e.g., redirect_uri).
+    specs[('/oauth/google/start', 'exact')] = {'path': '/oauth/google/start', 'name': 'oauth_google_start', 'target': BACKEND_OAUTH_GOOGLE_START_URL}
+    _load_route_specs(specs)
+    exact = {}
+    prefixes = []
+
+    def absolute(target, base, match):
+        if urlparse(target).scheme not in ('http', 'https'):
+            target = urljoin(base, target.lstrip('/'))
+        return target.rstrip('/') if match == 'prefix' else target
+
+    # Extra bases have to line up with TARGET_BASE for the path that follows them
+    BALANCER.add_group([TARGET_BASE] + [b if b.endswith('/') or not TARGET_BASE.endswith('/') else b + '/' for b in UPSTREAMS])
+    for (path, match), spec in specs.items():
+        base = spec.get('base') or TARGET_BASE
+        target = absolute(spec['target'], base, match)
+        if spec.get('targets'):
+            BALANCER.add_group([absolute(t, base, match) for t in spec['targets']])
+        post_target = spec.get('post_target')
+        if spec.get('post_targets'):
+            post_targets = [absolute(t, base, match) for t in spec['post_targets']]
+            BALANCER.add_group(post_targets)
+            post_target = post_target or post_targets[0]
+        # Allow full URL override specifically for /generate
+        if path == '/generate' and match == 'exact' and not post_target:
+            post_target = TARGET_GENERATE_URL
+        timeout = spec.get('timeout')
+        route = Route(
+            name=spec.get('name') or spec['target'].strip('/').rsplit('/', 1)[-1] or path.strip('/'),
+            path=path,
+            target=target,
+            prefix=(match == 'prefix'),
+            post_target=post_target,
+            timeout=float(timeout) if timeout is not None else None,
+            forward_headers=spec.get('forward_headers', DEFAULT_FORWARD_HEADERS),
+            inject_auth=bool(spec.get('inject_auth', True)),
+        )
+        if route.prefix:
+            prefixes.append(route)
+        else:
+            exact[path] = route
+    prefixes.sort(key=lambda r: len(r.path), reverse=True)
+    return exact, tuple(prefixes)
+
+
+_EXACT_ROUTES, _PREFIX_ROUTES = _compile_routes()
+BALANCER.start_probing()
+# Anything unmatched is forwarded as-is relative to TARGET_BASE
+_PASSTHROUGH_ROUTE = Route('passthrough', '', _base_dir(TARGET_BASE), prefix=True)
+_LOCAL_ROUTES = {'': 'health', '/health': 'health', '/status': 'status', '/metrics': 'metrics'}
+
+
+def resolve_route(path: str, method: str = 'GET'):
+    """Return (route, absolute upstream URL) for a client request path."""
+    raw, _, query = path.partition('?')
+    raw = raw.rstrip('/')
+    route = _EXACT_ROUTES.get(raw)
+    if route is not None:
+        return route, route.url('', query, method)
+    for route in _PREFIX_ROUTES:
+        # Prefixes match whole path segments; the remainder keeps its leading '/'
+        if raw.startswith(route.path) and raw[len(route.path):len(route.path) + 1] in ('', '/'):
+            return route, route.url(raw[len(route.path):], query, method)
+    return _PASSTHROUGH_ROUTE, _PASSTHROUGH_ROUTE.url(raw.lstrip('/'), query, method)
+
+
+def build_target_url(path: str, method: str = 'GET') -> str:
+    return resolve_route(path, method)[1]
+
+
+def route_label(path: str, route=None) -> str:
+    """Metrics label for a client path: the route name, i.e. the upstream function (e.g. 'generate')."""
+    raw = path.split('?', 1)[0].rstrip('/')
+    if raw in _LOCAL_ROUTES:
+        return _LOCAL_ROUTES[raw]
+    if TASKS_ENABLED and (raw == '/tasks' or raw.startswith('/tasks/')):
+        return 'tasks'
+    if route is None:
+        route = resolve_route(path)[0]
+    if route is not _PASSTHROUGH_ROUTE:
+        return route.name
+    label = raw.lstrip('/')
+    if label not in _ROUTE_LABELS:
+        # Bound label cardinality so arbitrary client paths can't grow /metrics without limit
+        if len(_ROUTE_LABELS) >= _MAX_ROUTE_LABELS:
+            return 'other'
+        _ROUTE_LABELS.add(label)
+    return label
+
+
+def _google_authorize_url(path: str) -> str:
+    """Build a direct Google authorize URL from the client's /oauth/google/start query."""
+    qs = parse_qs(urlparse(path).query)
+    redirect_uri = (qs.get('redirect_uri') or [''])[0] or f'http://localhost:{PORT}/'
+    state = (qs.get('state') or [''])[0]
+    nonce = (qs.get('nonce') or [''])[0]
+    params = {
+        'client_id': GOOGLE_CLIENT_ID,
+        'redirect_uri': redirect_uri,
+        'response_type': GOOGLE_RESPONSE_TYPE,
+        'scope': GOOGLE_SCOPE,
+    }
+    if state:
+        params['state'] = state
+    if nonce and ('id_token' in (GOOGLE_RESPONSE_TYPE or '')):
+        params['nonce'] = nonce
+    return GOOGLE_AUTH_ENDPOINT + '?' + urlencode(params)
+
+
+class Task:
+    """A queued /generate call and, once finished, its result."""
+
+    __slots__ = ('id', 'key', 'status', 'version', 'created', 'started', 'finished', 'expires',
+                 'result', 'content_type', 'http_status', 'error')
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = 'queued'
+        self.version = 0
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.expires = None
+        self.result = None
+        self.content_type = None
+        self.http_status = None
+        self.error = None
+
+
+_UNSET = object()  # describe(): eta not computed yet (None is a real answer)
+
+
+class TaskStore:
+    """Worker pool plus bounded, expiring store of task results.
+
+    Identical submissions (same request_key) while a task is still queued
+    or running return that task instead of starting another upstream call.
+    """
+
+    def __init__(self, workers=TASK_WORKERS, ttl=TASK_TTL, max_tasks=TASK_MAX, max_bytes=TASK_STORE_BYTES):
+        self.workers = workers
+        self.ttl = ttl
+        self.max_tasks = max_tasks
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dev-proxy-task')
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._tasks = OrderedDict()
+        self._active = {}
+        self._bytes = 0
+        self._avg_duration = None
 
+    def submit(self, key, fn, *args):
+        """Queue fn(task, *args) unless an identical task is active; returns (task, created)."""
+        with self._lock:
+            self._evict_locked()
+            task_id = self._active.get(key)
+            if task_id is not None and task_id in self._tasks:
+                return self._tasks[task_id], False
+            task = Task(key)
+            self._tasks[task.id] = task
+            self._active[key] = task.id
+        self._executor.submit(self._run, task, fn, args)
+        self._notify()
+        return task, True
 
-def _rewrite_path_for_upstream(path: str) -> str:
-    """Mirror Vercel rewrites: map clean URLs to /api/* function paths."""
-    try:
-        # Split path and query
-        parsed = urlparse(path)
-        raw_path = parsed.path.rstrip('/')
-        raw_query = parsed.query or ''
-        # Known rewrites
-        # Map to function file names; base already ends with '/api/'
-        rewrites = {
-            '/generate': 'generate',
-            '/login': 'login',
-            '/request-email-code': 'request_email_code',
-            '/login-email-code': 'login_email_code',
-            '/request-sms-code': 'request_sms_code',
-            '/login-sms-code': 'login_sms_code',
-            # Special-case Google OAuth start: forward directly to backend start URL
-            # to avoid upstream 404 when the Vercel function isn't available.
-            # We preserve the original query string (e.g., redirect_uri).
-            '/oauth/google/start': '__DIRECT_BACKEND_GOOGLE__',
-            '/oauth/apple/start': 'oauth_apple_start',
-            '/print-checkout': 'print_checkout',
+    def is_active(self, key):
+        """True while a task for this request_key is queued or running."""
+        with self._lock:
+            return self._active.get(key) in self._tasks
+
+    def add_listener(self, callback):
+        """Call callback() after every task transition (any task's ETA may have moved)."""
+        self._listeners.append(callback)
+
+    def _notify(self):
+        for callback in self._listeners:
+            callback()
+
+    def _run(self, task, fn, args):
+        with self._lock:
+            task.status = 'processing'
+            task.started = time.time()
+            task.version += 1
+        self._notify()
+        try:
+            fn(task, *args)
+        except Exception as e:
+            self.finish(task, 'failed', error=f'Proxy internal error: {type(e).__name__} - {e}', http_status=500)
+
+    def finish(self, task, status, result=None, content_type=None, http_status=None, error=None):
+        with self._lock:
+            if task.finished is not None:
+                return
+            task.status = status
+            task.finished = time.time()
+            task.expires = task.finished + self.ttl
+            task.result = result
+            task.content_type = content_type
+            task.http_status = http_status
+            task.error = error
+            task.version += 1
+            if result:
+                self._bytes += len(result)
+            if self._active.get(task.key) == task.id:
+                del self._active[task.key]
+            if status == 'succeeded' and task.started is not None:
+                duration = task.finished - task.started
+                self._avg_duration = duration if self._avg_duration is None else 0.7 * self._avg_duration + 0.3 * duration
+            self._evict_locked()
+        self._notify()
+
+    def get(self, task_id):
+        with self._lock:
+            self._evict_locked()
+            return self._tasks.get(task_id)
+
+    def _evict_locked(self):
+        now = time.time()
+        for task_id in [t.id for t in self._tasks.values() if t.expires is not None and t.expires <= now]:
+            self._drop_locked(task_id)
+        # Over budget: drop the oldest finished tasks first; queued/running ones are never evicted
+        if len(self._tasks) > self.max_tasks or self._bytes > self.max_bytes:
+            for task in list(self._tasks.values()):
+                if len(self._tasks) <= self.max_tasks and self._bytes <= self.max_bytes:
+                    break
+                if task.finished is not None:
+                    self._drop_locked(task.id)
+
+    def _drop_locked(self, task_id):
+        task = self._tasks.pop(task_id, None)
+        if task is not None and task.result:
+            self._bytes -= len(task.result)
+
+    def eta_seconds(self, task):
+        """Rough time to completion from the running average of recent task durations."""
+        with self._lock:
+            return self._eta_locked(task, *self._queue_state_locked())
+
+    def snapshot(self, task_ids):
+        """{task_id: (task, eta_seconds)} for the given ids, taken in one pass under the lock.
+
+        This is the event hub's per-tick view: unlike get() it does not evict
+        (expired tasks are simply left out), and the queue is scanned once
+        rather than once per task.
+        """
+        now = time.time()
+        with self._lock:
+            state = self._queue_state_locked()
+            view = {}
+            for task_id in task_ids:
+                task = self._tasks.get(task_id)
+                if task is not None and (task.expires is None or task.expires > now):
+                    view[task_id] = (task, self._eta_locked(task, *state))
+            return view
+
+    def _queue_state_locked(self):
+        avg = self._avg_duration if self._avg_duration is not None else TASK_ETA_DEFAULT
+        queued = sorted(t.created for t in self._tasks.values() if t.status == 'queued')
+        running = sum(1 for t in self._tasks.values() if t.status == 'processing')
+        return avg, queued, running
+
+    def _eta_locked(self, task, avg, queued, running):
+        if task.status == 'processing':
+            return max(1, int(avg - (time.time() - task.started)))
+        if task.status != 'queued':
+            return None
+        ahead = bisect_left(queued, task.created)
+        waves = (ahead + running) // self.workers + 1
+        return int(avg * waves)
+
+    def describe(self, task, base_url, eta=_UNSET):
+        """Status document in the shape js/main.js polls for (pass eta when it is already known)."""
+        doc = {
+            'task_id': task.id,
+            'status': task.status,
+            'version': task.version,
+            'eta_seconds': self.eta_seconds(task) if eta is _UNSET else eta,
+            'status_url': f'{base_url}/tasks/{task.id}',
+            'events_url': f'{base_url}/tasks/{task.id}/events',
+            'created_at': task.created,
         }
-        target_path = rewrites.get(raw_path, raw_path)
-        # If special-case marker, build absolute URL to backend
-        if target_path == '__DIRECT_BACKEND_GOOGLE__':
-            if raw_query:
-                return BACKEND_OAUTH_GOOGLE_START_URL + ('&' if '?' in BACKEND_OAUTH_GOOGLE_START_URL else '?') + raw_query
-            return BACKEND_OAUTH_GOOGLE_START_URL
-        # Rebuild URL with rewritten path
-        new_parsed = parsed._replace(path=target_path)
-        return urlunparse(new_parsed)
-    except Exception:
-        return path
+        if task.status == 'succeeded':
+            doc['result_url'] = f'{base_url}/tasks/{task.id}/result'
+            doc['content_type'] = task.content_type
+            doc['bytes'] = len(task.result or b'')
+        elif task.status == 'failed':
+            doc['error'] = task.error
+            doc['http_status'] = task.http_status
+        return doc
+
+
+TASK_STORE = TaskStore() if TASKS_ENABLED else None
+
+
+class TaskEventHub:
+    """Pushes task status documents to Server-Sent Events subscribers from one background thread.
+
+    After the SSE headers are written the subscriber socket is detached
+    from the worker pool, so an idle subscriber costs a socket rather than
+    a thread. A document is re-sent only when it changed: on every task
+    transition and on a periodic tick that refreshes processing ETAs.
+    Subscribers are closed after a terminal (succeeded/failed) event.
+
+    Long-polls (GET /tasks/<id>?wait=) are parked here the same way: the
+    socket waits in the selector until the task moves past the client's
+    version or the wait runs out, then gets a single response.
+    """
+
+    HEARTBEAT = 15.0
+
+    def __init__(self, store, tick=TASK_EVENTS_TICK):
+        self._store = store
+        self._tick = tick
+        self._lock = threading.Lock()
+        self._subs = {}  # socket -> [task_id, base_url, last_payload]
+        self._polls = {}  # socket -> (task_id, since, deadline, respond)
+        self._dirty = False
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        store.add_listener(self.poke)
+        threading.Thread(target=self._loop, name='dev-proxy-task-events', daemon=True).start()
+
+    def subscribe(self, sock, task_id, base_url):
+        sock.setblocking(False)
+        with self._lock:
+            self._subs[sock] = [task_id, base_url, None]
+            self._selector.register(sock, selectors.EVENT_READ)
+        self.poke()
+
+    def park(self, sock, task_id, since, deadline, respond):
+        """Hold a long-poll socket until its task passes version since or deadline (monotonic) is reached.
+
+        respond(task, gone) runs on the hub thread and returns the raw
+        response bytes; task is None once the task has expired, and gone
+        is True when the client hung up first (nothing is sent then).
+        """
+        sock.setblocking(False)
+        with self._lock:
+            self._polls[sock] = (task_id, since, deadline, respond)
+            self._selector.register(sock, selectors.EVENT_READ)
+        self.poke()
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subs)
+
+    def long_poll_count(self):
+        with self._lock:
+            return len(self._polls)
+
+    def poke(self):
+        self._dirty = True
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
 
-def build_target_url(path: str) -> str:
-    # Apply rewrite mapping first
-    rewritten = _rewrite_path_for_upstream(path)
-    # If rewritten is already an absolute URL, return as-is
+    def _drop(self, sock):
+        with self._lock:
+            if self._subs.pop(sock, None) is None:
+                return
+            self._unregister_locked(sock)
+        self._close(sock)
+
+    def _answer(self, sock, task, gone=False):
+        with self._lock:
+            entry = self._polls.pop(sock, None)
+            if entry is None:
+                return
+            self._unregister_locked(sock)
+        try:
+            data = entry[3](task, gone)
+        except Exception:
+            data = None
+        if data and not gone:
+            self._send(sock, data)
+        self._close(sock)
+
+    def _unregister_locked(self, sock):
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    @staticmethod
+    def _close(sock):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+    def _send(self, sock, data) -> bool:
+        try:
+            # Events are small; a client whose buffer is this full is too slow to keep
+            return sock.send(data) == len(data)
+        except (BlockingIOError, OSError):
+            return False
+
+    def _loop(self):
+        last_beat = last_tick = time.monotonic()
+        while True:
+            timeout = min(self._tick, self.HEARTBEAT)
+            with self._lock:
+                if self._polls:
+                    timeout = max(0.0, min(timeout, min(p[2] for p in self._polls.values()) - time.monotonic()))
+            for key, _ in self._selector.select(timeout=timeout):
+                if key.fileobj is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                elif key.fileobj in self._polls:
+                    self._answer(key.fileobj, None, gone=True)
+                else:
+                    # Subscribers never send anything; readable means closed (or misbehaving)
+                    self._drop(key.fileobj)
+            now = time.monotonic()
+            publish = self._dirty or now - last_tick >= self._tick
+            with self._lock:
+                task_ids = {p[0] for p in self._polls.values()}
+                if publish:
+                    task_ids.update(state[0] for state in self._subs.values())
+            # One view of the watched tasks per wake-up, shared by every socket on them
+            view = self._store.snapshot(task_ids) if task_ids else {}
+            if publish:
+                self._dirty = False
+                last_tick = now
+                self._publish(view)
+            self._check_polls(now, view)
+            if now - last_beat >= self.HEARTBEAT:
+                last_beat = now
+                with self._lock:
+                    socks = list(self._subs)
+                for sock in socks:
+                    if not self._send(sock, b': keep-alive\n\n'):
+                        self._drop(sock)
+
+    def _check_polls(self, now, view):
+        with self._lock:
+            polls = list(self._polls.items())
+        for sock, (task_id, since, deadline, _) in polls:
+            task = view.get(task_id, (None, None))[0]
+            if task is None or task.version > since or task.finished is not None or now >= deadline:
+                self._answer(sock, task)
+
+    def _publish(self, view):
+        with self._lock:
+            subs = [(sock, state) for sock, state in self._subs.items()]
+        by_doc = {}
+        for sock, state in subs:
+            by_doc.setdefault((state[0], state[1]), []).append((sock, state))
+        for (task_id, base_url), group in by_doc.items():
+            task, eta = view.get(task_id, (None, None))
+            if task is None:
+                for sock, _ in group:
+                    self._send(sock, b'event: error\ndata: {"error": "Unknown or expired task"}\n\n')
+                    self._drop(sock)
+                continue
+            doc = self._store.describe(task, base_url, eta)
+            payload = ('id: %d\nevent: status\ndata: %s\n\n' % (task.version, json.dumps(doc, ensure_ascii=False))).encode('utf-8')
+            for sock, state in group:
+                if payload != state[2]:
+                    if not self._send(sock, payload):
+                        self._drop(sock)
+                        continue
+                    state[2] = payload
+                if task.finished is not None:
+                    self._drop(sock)
+
+TASK_EVENTS = TaskEventHub(TASK_STORE) if TASK_STORE is not None else None
+
+
+def _run_generate_task(task, url, body, headers, timeout, route, key):
+    """TaskStore job: make the blocking /generate call and keep its result."""
+    if RESPONSE_CACHE is not None:
+        hit = RESPONSE_CACHE.get(key)
+        if hit is not None:
+            status, content_type, _, data = hit
+            if not isinstance(data, bytes):
+                with data:
+                    data = data.read()
+            TASK_STORE.finish(task, 'succeeded', data, content_type, status)
+            return
+    # Task workers wait for an upstream slot rather than failing with 503
+    _acquire_upstream_slot(blocking=True)
     try:
-        rp = urlparse(rewritten)
-        if rp.scheme in ('http', 'https'):
-            return rewritten
-    except Exception:
-        pass
-    # Ensure path without leading slash duplicates
-    clean = rewritten.lstrip('/')
-    # Join to target base
-    return urljoin(TARGET_BASE, clean)
+        with _upstream_request('POST', url, body=body, headers=headers, timeout=timeout, route=route) as resp:
+            data = resp.read()
+            content_type = resp.headers.get('Content-Type', 'application/octet-stream')
+            status = resp.getcode()
+        if RESPONSE_CACHE is not None and 200 <= status < 300:
+            writer = RESPONSE_CACHE.writer(key, status, content_type)
+            writer.write(data)
+            writer.commit()
+        TASK_STORE.finish(task, 'succeeded', data, content_type, status)
+    except HTTPError as e:
+        err_text = e.read().decode('utf-8', errors='ignore')
+        TASK_STORE.finish(task, 'failed', error=f'Upstream {e.code} {e.reason} at {e.filename or url} - ' + err_text, http_status=e.code)
+    except URLError as e:
+        TASK_STORE.finish(task, 'failed', error=f'Bad Gateway - {e.reason}', http_status=502)
+    finally:
+        _release_upstream_slot()
+
+
+class ProxyHTTPServer(HTTPServer):
+    """HTTPServer that lets a handler keep its socket open after returning (SSE hand-off)."""
+
+    def __init__(self, server_address, handler_class):
+        super().__init__(server_address, handler_class)
+        self._detached = set()
+        self._detached_lock = threading.Lock()
+
+    def detach(self, request):
+        with self._detached_lock:
+            self._detached.add(request)
+
+    def shutdown_request(self, request):
+        with self._detached_lock:
+            if request in self._detached:
+                self._detached.discard(request)
+                return
+        super().shutdown_request(request)
+
+
+class PooledHTTPServer(ProxyHTTPServer):
+    """HTTPServer that hands each accepted connection to a fixed-size worker pool."""
+
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, workers=WORKERS):
+        super().__init__(server_address, handler_class)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dev-proxy')
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False)
+
+
+class _CountingWriter:
+    """Wraps the handler's wfile to count response body bytes sent to the client.
+
+    Status line, headers and chunked framing go through write_framing so
+    they stay out of the count.
+    """
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.count = 0
+
+    def write(self, data):
+        n = self._raw.write(data)
+        self.count += len(data)
+        return n
+
+    def write_framing(self, data):
+        return self._raw.write(data)
+
+    def flush(self):
+        self._raw.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
 
 
 class ProxyHandler(BaseHTTPRequestHandler):
+    _route = 'other'
+    _status = None
+    _bytes_in = 0
+    _request_id = None
+    _traced = False
+    _long_poll = None
+    _rate_identity = None
+    _holds_slot = False
+
+    def setup(self):
+        super().setup()
+        self.wfile = _CountingWriter(self.wfile)
+
+    def finish(self):
+        super().finish()
+        if self._long_poll is not None:
+            # Parked only now that the handler's own file objects are closed; the hub answers through a buffer
+            task_id, since, deadline = self._long_poll
+            self.wfile = _CountingWriter(io.BytesIO())
+            self.server.detach(self.request)
+            TASK_EVENTS.park(self.request, task_id, since, deadline, self._answer_long_poll)
+
+    def _answer_long_poll(self, task, gone):
+        """Render a parked long-poll's reply on the event hub thread and close out the request."""
+        try:
+            if gone:
+                return None
+            if task is None:
+                self._send_json(404, {'error': 'Unknown or expired task'})
+            else:
+                self._send_json(200, TASK_STORE.describe(task, self._public_base_url()))
+            return self.wfile.getvalue()
+        finally:
+            self._end_request()
+
+    def flush_headers(self):
+        if hasattr(self, '_headers_buffer'):
+            self.wfile.write_framing(b''.join(self._headers_buffer))
+            self._headers_buffer = []
+
+    def send_response(self, code, message=None):
+        self._status = code
+        super().send_response(code, message)
+        if self._request_id:
+            self.send_header('X-Request-ID', self._request_id)
+
+    def _begin_request(self):
+        self._started = time.monotonic()
+        self._wall_started = time.time()
+        request_id = self.headers.get('X-Request-ID', '')
+        self._request_id = request_id if _REQUEST_ID_RE.match(request_id) else uuid.uuid4().hex
+        self._traced = TRACER is not None and (self.headers.get('X-Trace-Sampled') == '1' or trace_sampled(self._request_id))
+        self._upstream_route, self._target_url = resolve_route(self.path, self.command)
+        self._route = route_label(self.path, self._upstream_route)
+        self._status = None
+        self._bytes_in = 0
+        self.wfile.count = 0
+        METRICS.gauge_add('dev_proxy_inflight_requests', {}, 1)
+
+    def _end_request(self):
+        METRICS.gauge_add('dev_proxy_inflight_requests', {}, -1)
+        labels = {'route': self._route, 'method': self.command}
+        METRICS.inc('dev_proxy_requests_total', dict(labels, status=str(self._status or 0)))
+        METRICS.observe('dev_proxy_request_duration_seconds', labels, time.monotonic() - self._started)
+        METRICS.observe('dev_proxy_request_bytes', {'route': self._route}, self._bytes_in, Metrics.SIZE_BUCKETS)
+        METRICS.observe('dev_proxy_response_bytes', {'route': self._route}, self.wfile.count, Metrics.SIZE_BUCKETS)
+        self._trace_span('request', self._wall_started, time.time(), method=self.command, path=self.path.split('?')[0],
+                         route=self._route, status=self._status or 0, bytes_in=self._bytes_in, bytes_out=self.wfile.count)
+
+    def _trace_span(self, name, start, end, **attrs):
+        if self._traced:
+            TRACER.emit(self._request_id, name, start, end, **attrs)
+
+    def _forward_headers(self, base, route=None):
+        """Apply the route's header policy: pass through allowed client headers, then inject env auth."""
+        route = route or self._upstream_route
+        fwd_headers = dict(base)
+        # Correlation id (and the sampling decision) travel upstream so every hop can log against them
+        fwd_headers['X-Request-ID'] = self._request_id
+        if self._traced:
+            fwd_headers['X-Trace-Sampled'] = '1'
+        # Request bodies are relayed byte-for-byte, so their encoding has to travel with them
+        encoding = self.headers.get('Content-Encoding')
+        if encoding:
+            fwd_headers['Content-Encoding'] = encoding
+        for key in route.forward_headers:
+            val = self.headers.get(key)
+            if val:
+                fwd_headers[key] = val
+        if route.inject_auth:
+            # Inject from environment if not provided by client
+            if AUTHORIZATION and 'Authorization' not in fwd_headers:
+                fwd_headers['Authorization'] = AUTHORIZATION
+            if X_API_KEY and 'x-api-key' not in fwd_headers:
+                fwd_headers['x-api-key'] = X_API_KEY
+            if X_AUTH_TOKEN and 'x-auth-token' not in fwd_headers:
+                fwd_headers['x-auth-token'] = X_AUTH_TOKEN
+        return fwd_headers
+
+    def _upstream_auth(self, route=None):
+        """Auth headers _forward_headers would send upstream, as [(name, value, injected_by_proxy)]."""
+        route = route or self._upstream_route
+        auth = []
+        for name, env_value in (('Authorization', AUTHORIZATION), ('x-api-key', X_API_KEY), ('x-auth-token', X_AUTH_TOKEN)):
+            value = self.headers.get(name) if name in route.forward_headers else None
+            if value:
+                auth.append((name, value, False))
+            elif route.inject_auth and env_value:
+                auth.append((name, env_value, True))
+        return auth
+
+    def _auth_scope(self, route=None):
+        """Credentials this request authenticates upstream with, for keying shared caches and flights."""
+        return '\n'.join(f'{name}={value}' for name, value, _ in self._upstream_auth(route))
+
+    def _log_upstream(self, served_url):
+        try:
+            print(f"[dev-proxy] {self.command} {self.path} -> {served_url}")
+        except Exception:
+            pass
+
+    def _redirect_to_google(self):
+        # Issue 302 redirect to Google directly
+        self.send_response(302)
+        self._set_cors()
+        self.send_header('Location', _google_authorize_url(self.path))
+        self.end_headers()
+
     def _set_cors(self):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Accept, Authorization, x-api-key, x-auth-token, x-vercel-protection-bypass')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Accept, Authorization, x-api-key, x-auth-token, x-vercel-protection-bypass, If-None-Match, If-Modified-Since, X-Request-ID, X-Trace-Sampled')
+        self.send_header('Access-Control-Expose-Headers', 'ETag, Last-Modified, Retry-After, X-Request-ID, X-Proxy-Cache, X-GLB-Original-Bytes, X-GLB-Optimized-Bytes, X-GLB-Skipped')
+
+    def _acquire_upstream_slot(self) -> bool:
+        self._holds_slot = _acquire_upstream_slot()
+        return self._holds_slot
+
+    def _release_upstream_slot(self):
+        # Idempotent: the relay frees the slot as soon as the upstream body is in, the handler's finally is the backstop
+        if self._holds_slot:
+            self._holds_slot = False
+            _release_upstream_slot()
+
+    def _read_upstream(self, resp):
+        """One relay-sized read; frees this request's upstream slot once the upstream has nothing more to send.
+
+        That happens before the last bytes are written to the client, so a
+        client that fires its next request as soon as this one completes
+        finds the slot free again.
+        """
+        chunk = resp.read(STREAM_CHUNK_SIZE)
+        if self._holds_slot and (not chunk or getattr(resp, 'complete', False)):
+            self._release_upstream_slot()
+        return chunk
+
+    def _send_metrics(self):
+        pool = UPSTREAM_POOL.stats()
+        sampled = [
+            ('dev_proxy_pool_hits_total', 'counter', pool['hits']),
+            ('dev_proxy_pool_misses_total', 'counter', pool['misses']),
+            ('dev_proxy_pool_idle_connections', 'gauge', pool['idle']),
+        ]
+        upstreams = BALANCER.up_series()
+        if upstreams:
+            # Derived from backend state at scrape time, so probe and breaker transitions can't drift it
+            sampled.append(('dev_proxy_upstream_up', 'gauge', upstreams))
+        if COALESCER is not None:
+            sampled.append(('dev_proxy_coalesced_requests_total', 'counter', COALESCER.coalesced))
+            sampled.append(('dev_proxy_coalesce_rejected_total', 'counter', COALESCER.rejected))
+        if TASK_EVENTS is not None:
+            sampled.append(('dev_proxy_task_event_subscribers', 'gauge', TASK_EVENTS.subscriber_count()))
+            sampled.append(('dev_proxy_task_long_polls', 'gauge', TASK_EVENTS.long_poll_count()))
+        payload = METRICS.render(sampled).encode('utf-8')
+        self.send_response(200)
+        self._set_cors()
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _discard_request_body(self):
+        # Drain the body so closing the socket doesn't reset the client before it reads our reply
+        body, _ = self._request_body_stream()
+        if not isinstance(body, bytes):
+            for _ in body:
+                pass
+
+    def _request_body_stream(self):
+        """Return (body, length) for the client upload without buffering it; length is None for chunked uploads."""
+        if 'chunked' in (self.headers.get('Transfer-Encoding') or '').lower():
+            return self._iter_chunked_body(), None
+        try:
+            length = int(self.headers.get('Content-Length', '0'))
+        except ValueError:
+            length = 0
+        if length <= 0:
+            return b'', 0
+        return self._iter_body(length), length
+
+    def _iter_body(self, remaining):
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, STREAM_CHUNK_SIZE))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            self._bytes_in += len(chunk)
+            yield chunk
+
+    def _iter_chunked_body(self):
+        while True:
+            size_line = self.rfile.readline(65537)
+            if not size_line:
+                return
+            size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+            if size == 0:
+                # Skip optional trailers up to the terminating blank line
+                while self.rfile.readline(65537) not in (b'\r\n', b'\n', b''):
+                    pass
+                return
+            yield from self._iter_body(size)
+            self.rfile.readline(65537)
+
+    def _write_body_chunk(self, chunk, chunked) -> bool:
+        try:
+            if chunked:
+                self.wfile.write_framing(b'%x\r\n' % len(chunk))
+                self.wfile.write(chunk)
+                self.wfile.write_framing(b'\r\n')
+            else:
+                self.wfile.write(chunk)
+            return True
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+            return False
+
+    def _response_encoder(self, status, content_type, content_encoding, length):
+        """An _Encoder when the client accepts gzip/br and the body is worth compressing, else None."""
+        encoding = self._response_encoding(status, content_type, content_encoding, length)
+        return _Encoder(encoding) if encoding else None
+
+    def _response_encoding(self, status, content_type, content_encoding, length):
+        if not COMPRESS_ENABLED or not 200 <= status < 300 or status in (204, 206):
+            return None
+        if content_encoding and content_encoding.strip().lower() != 'identity':
+            return None
+        if not compressible(content_type):
+            return None
+        if length is not None:
+            try:
+                if int(length) < COMPRESS_MIN_BYTES:
+                    return None
+            except ValueError:
+                pass
+        return choose_encoding(self.headers.get('Accept-Encoding'))
+
+    def _client_validators(self, headers):
+        """Validators as this client saw them: weak ETag and Vary: Accept-Encoding when the relay would encode."""
+        if not self._response_encoding(200, headers.get('Content-Type'), headers.get('Content-Encoding'), headers.get('Content-Length')):
+            return headers
+        headers = dict(headers)
+        if headers.get('ETag'):
+            headers['ETag'] = _weak_etag(headers['ETag'])
+        headers['Vary'] = _vary_accept_encoding(headers.get('Vary'))
+        return headers
+
+    def _relay_response(self, resp, default_content_type, extra_headers=(), sinks=()):
+        """Stream an upstream response to the client in fixed-size reads; returns the body bytes sent.
+
+        The upstream Content-Length is forwarded when known. Otherwise HTTP/1.1
+        clients get chunked transfer-encoding and HTTP/1.0 clients a
+        close-delimited body. Caching headers and validators are relayed, and
+        compressible identity bodies are gzip/br-encoded for clients that ask;
+        sinks still see the upstream bytes. Sinks (cache writer, single-flight)
+        see every chunk and are committed once the whole upstream body has been
+        read. If the client disconnects, reading continues only while a sink
+        still wants the rest of the body.
+        """
+        status = resp.getcode()
+        headers = resp.headers
+        if GLB_OPTIMIZER is not None and status == 200 and is_glb(headers.get('Content-Type')):
+            optimized = self._optimize_glb_response(resp, sinks)
+            if optimized is not None:
+                resp, glb_headers = optimized
+                headers = resp.headers
+                extra_headers = tuple(glb_headers) + tuple(extra_headers)
+                sinks = ()
+        content_type = headers.get('Content-Type', default_content_type)
+        length = headers.get('Content-Length')
+        # 304 and 204 carry no body, so they get no framing either
+        bodyless = status in (204, 304)
+        encoder = None if bodyless else self._response_encoder(status, content_type, headers.get('Content-Encoding'), length)
+        if encoder is not None:
+            length = None
+        chunked = not bodyless and length is None and self.request_version == 'HTTP/1.1'
+        if chunked:
+            # Chunked framing needs an HTTP/1.1 status line; the connection still closes afterwards
+            self.protocol_version = 'HTTP/1.1'
+        self.send_response(status)
+        self._set_cors()
+        # Propagate redirect headers if present
+        loc = headers.get('Location')
+        if loc:
+            self.send_header('Location', loc)
+        if not bodyless or headers.get('Content-Type'):
+            self.send_header('Content-Type', content_type)
+        for name in RELAY_HEADERS:
+            value = headers.get(name)
+            if value is None or (encoder is not None and name == 'Vary'):
+                continue
+            if encoder is not None and name == 'ETag':
+                value = _weak_etag(value)
+            self.send_header(name, value)
+        if encoder is not None:
+            self.send_header('Content-Encoding', encoder.encoding)
+            self.send_header('Vary', _vary_accept_encoding(headers.get('Vary')))
+        if length is not None and not bodyless:
+            self.send_header('Content-Length', length)
+        elif chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.send_header('Connection', 'close')
+        for name, value in extra_headers:
+            self.send_header(name, value)
+        self.end_headers()
+        relay_started = time.time()
+        sent = 0
+        client_gone = False
+        try:
+            while True:
+                chunk = self._read_upstream(resp)
+                if not chunk:
+                    break
+                for sink in sinks:
+                    sink.write(chunk)
+                if client_gone or bodyless:
+                    continue
+                data = encoder.encode(chunk) if encoder is not None else chunk
+                if not data:
+                    continue
+                if self._write_body_chunk(data, chunked):
+                    sent += len(data)
+                    continue
+                client_gone = True
+                if not any(sink.wants_remainder() for sink in sinks):
+                    # Client closed connection; stop reading so the half-read upstream connection is discarded
+                    for sink in sinks:
+                        sink.abort()
+                    resp.close()
+                    self._trace_span('relay', relay_started, time.time(), status=status, bytes=sent, client_gone=True)
+                    return sent
+            if encoder is not None and not client_gone:
+                tail = encoder.finish()
+                if tail and self._write_body_chunk(tail, chunked):
+                    sent += len(tail)
+                METRICS.inc('dev_proxy_compressed_responses_total', {'route': self._route, 'encoding': encoder.encoding})
+                METRICS.inc('dev_proxy_compression_saved_bytes_total', {'route': self._route}, max(0, encoder.bytes_in - encoder.bytes_out))
+            if chunked and not client_gone:
+                try:
+                    self.wfile.write_framing(b'0\r\n\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+        except BaseException:
+            for sink in sinks:
+                sink.abort()
+            raise
+        for sink in sinks:
+            sink.commit()
+        # Ends at the last byte handed to the client socket
+        self._trace_span('relay', relay_started, time.time(), status=status, bytes=sent,
+                         encoding=encoder.encoding if encoder is not None else None, client_gone=client_gone)
+        return sent
+
+    def _optimize_glb_response(self, resp, sinks):
+        """Buffer a GLB body and re-pack it; returns (response, extra headers) or None to stream it as-is.
+
+        Sinks get the upstream bytes and are committed here, so caches and
+        coalesced followers keep the original model.
+        """
+        encoding = resp.headers.get('Content-Encoding')
+        if encoding and encoding.strip().lower() != 'identity':
+            return None
+        try:
+            if int(resp.headers.get('Content-Length') or 0) > GLB_MAX_BYTES:
+                return None
+        except ValueError:
+            return None
+        chunks = []
+        try:
+            while True:
+                chunk = self._read_upstream(resp)
+                if not chunk:
+                    break
+                for sink in sinks:
+                    sink.write(chunk)
+                chunks.append(chunk)
+        except BaseException:
+            for sink in sinks:
+                sink.abort()
+            raise
+        for sink in sinks:
+            sink.commit()
+        data = b''.join(chunks)
+        started = time.time()
+        body, reason = GLB_OPTIMIZER.optimize(data)
+        self._trace_span('glb_optimize', started, time.time(), original_bytes=len(data), optimized_bytes=len(body), skipped=reason)
+        buffered = _CachedResponse((resp.getcode(), resp.headers.get('Content-Type'), len(body), body))
+        for name in RELAY_HEADERS:
+            value = resp.headers.get(name)
+            if value is not None:
+                if name == 'ETag' and reason is None and not value.startswith('W/'):
+                    value = 'W/' + value
+                buffered.headers[name] = value
+        try:
+            if reason is None:
+                print(f"[dev-proxy] {self.command} {self.path} -> GLB optimized {len(data)} -> {len(body)} bytes")
+            else:
+                print(f"[dev-proxy] {self.command} {self.path} -> GLB relayed unchanged ({reason})")
+        except Exception:
+            pass
+        return buffered, self._glb_size_headers(len(data), len(body), reason)
+
+    @staticmethod
+    def _glb_size_headers(original, optimized, reason):
+        headers = [('X-GLB-Original-Bytes', str(original)), ('X-GLB-Optimized-Bytes', str(optimized))]
+        if reason is not None:
+            headers.append(('X-GLB-Skipped', reason))
+        return headers
+
+    def _send_cached(self, hit):
+        response = _CachedResponse(hit)
+        try:
+            self._relay_response(response, 'application/octet-stream', (('X-Proxy-Cache', 'HIT'),))
+        finally:
+            response.close()
+
+    def _send_not_modified(self, validators, source='local'):
+        self.send_response(304)
+        self._set_cors()
+        for name in ('ETag', 'Last-Modified', 'Cache-Control', 'Expires', 'Vary'):
+            if validators.get(name):
+                self.send_header(name, validators[name])
+        self.send_header('Date', formatdate(usegmt=True))
+        self.end_headers()
+        METRICS.inc('dev_proxy_not_modified_total', {'route': self._route, 'source': source})
+
+    def _send_json(self, status, obj, extra_headers=()):
+        payload = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        if status == 200:
+            # Status documents are polled; an unchanged one is answered with 304 instead of the same bytes again
+            etag = '"%s"' % hashlib.sha1(payload).hexdigest()[:20]
+            if not_modified(self.headers, etag, None):
+                self._send_not_modified({'ETag': etag, 'Cache-Control': 'no-cache'})
+                return
+            extra_headers = (('ETag', etag),) + tuple(extra_headers)
+        self.send_response(status)
+        self._set_cors()
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Cache-Control', 'no-cache' if status == 200 else 'no-store')
+        for name, value in extra_headers:
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _public_base_url(self):
+        # Absolute URLs so the page can follow them even when it isn't served from this proxy
+        return 'http://' + (self.headers.get('Host') or f'localhost:{PORT}')
+
+    def _submit_task(self):
+        stream, _ = self._request_body_stream()
+        body = stream if isinstance(stream, bytes) else b''.join(stream)
+        route, url = resolve_route('/generate', 'POST')
+        accept = self.headers.get('Accept', 'application/octet-stream')
+        # The client's Accept is for the task JSON; the generation itself should come back as GLB
+        if 'json' in accept:
+            accept = 'application/octet-stream'
+        headers = self._forward_headers({
+            'Content-Type': self.headers.get('Content-Type', 'application/json'),
+            'Accept': accept,
+            'Content-Length': str(len(body)),
+        }, route)
+        key = request_key(url, body, accept, self._auth_scope(route))
+        # Joining an identical active task costs the upstream nothing, so only a new task is charged
+        if not TASK_STORE.is_active(key) and not self._admit_client(body_read=True):
+            return
+        task, created = TASK_STORE.submit(key, _run_generate_task, url, body, headers, route.timeout, route.name, key)
+        try:
+            print(f"[dev-proxy] POST {self.path} -> task {task.id} ({'queued' if created else 'joined existing'})")
+        except Exception:
+            pass
+        doc = TASK_STORE.describe(task, self._public_base_url())
+        self._send_json(202, doc, (('Location', doc['status_url']),))
+
+    def _stream_task_events(self, task):
+        self.send_response(200)
+        self._set_cors()
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.end_headers()
+        try:
+            self.wfile.write(b'retry: 3000\n\n')
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        # Hand the socket to the event hub; this worker thread is free again once we return
+        self.close_connection = True
+        self.server.detach(self.request)
+        TASK_EVENTS.subscribe(self.request, task.id, self._public_base_url())
+
+    def _serve_task(self, path_only):
+        parts = path_only.rstrip('/').split('/')
+        # ['', 'tasks', '<id>'] or ['', 'tasks', '<id>', 'result' | 'events']
+        task = TASK_STORE.get(parts[2]) if len(parts) in (3, 4) else None
+        if task is None or (len(parts) == 4 and parts[3] not in ('result', 'events')):
+            self._send_json(404, {'error': 'Unknown or expired task'})
+            return
+        if len(parts) == 3:
+            qs = parse_qs(urlparse(self.path).query)
+            try:
+                wait = min(float((qs.get('wait') or ['0'])[0]), TASK_LONGPOLL_MAX)
+                since = int((qs.get('since') or [task.version])[0])
+            except ValueError:
+                wait, since = 0.0, task.version
+            if wait > 0 and task.version <= since and task.finished is None and hasattr(self.server, 'detach'):
+                # Long-poll: answer as soon as the task moves past the client's version (default: the current one).
+                # The socket is parked in the event hub once this handler finishes, so the wait holds no worker thread.
+                self.close_connection = True
+                self._long_poll = (task.id, since, time.monotonic() + wait)
+                return
+            self._send_json(200, TASK_STORE.describe(task, self._public_base_url()))
+            return
+        if parts[3] == 'events':
+            if hasattr(self.server, 'detach'):
+                self._stream_task_events(task)
+            else:
+                self._send_json(404, {'error': 'Event stream not available'})
+            return
+        if task.status != 'succeeded':
+            self._send_json(409, TASK_STORE.describe(task, self._public_base_url()))
+            return
+        # A finished task's result never changes, so its id is a strong validator
+        etag = '"task-%s"' % task.id
+        if not_modified(self.headers, etag, None):
+            self._send_not_modified({'ETag': etag, 'Cache-Control': 'private, max-age=%d' % TASK_TTL})
+            return
+        body = task.result
+        extra_headers = ()
+        if GLB_OPTIMIZER is not None and (task.http_status or 200) == 200 and is_glb(task.content_type):
+            body, reason = GLB_OPTIMIZER.optimize(task.result)
+            extra_headers = self._glb_size_headers(len(task.result), len(body), reason)
+        self.send_response(task.http_status or 200)
+        self._set_cors()
+        self.send_header('Content-Type', task.content_type or 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'private, max-age=%d' % TASK_TTL)
+        for name, value in extra_headers:
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _send_busy(self, message=None):
+        self.send_response(503)
+        self._set_cors()
+        self.send_header('Retry-After', RETRY_AFTER)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.end_headers()
+        try:
+            self.wfile.write((message or f'Proxy busy - {MAX_INFLIGHT} upstream calls in flight, retry later').encode('utf-8'))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
 
     def do_GET(self):
+        self._begin_request()
+        try:
+            self._handle_get()
+        finally:
+            if self._long_poll is None:
+                self._end_request()
+
+    def _handle_get(self):
         # Health check endpoint for webview/preview pings
         path_only = self.path.split('?')[0]
+        if path_only == '/metrics':
+            self._send_metrics()
+            return
+        if TASK_STORE is not None and path_only.startswith('/tasks/'):
+            self._serve_task(path_only)
+            return
         if path_only in ('/', '/health', '/status'):
             self.send_response(200)
             self._set_cors()
             self.send_header('Content-Type', 'application/json')
             self.end_headers()
-            payload = json.dumps({'ok': True, 'proxy': 'dev', 'port': PORT}).encode('utf-8')
+            payload = json.dumps({'ok': True, 'proxy': 'dev', 'port': PORT, 'pool': UPSTREAM_POOL.stats(), 'upstreams': BALANCER.stats(),
+                                  'validators': VALIDATORS.stats() if VALIDATORS is not None else None,
+                                  'rate_limits': RATE_LIMITER.stats() if RATE_LIMITER is not None else None}).encode('utf-8')
             self.wfile.write(payload)
             return
+        if VALIDATORS is not None:
+            validators = VALIDATORS.lookup(self._target_url, self.headers, self._auth_scope(), self._client_validators)
+            if validators is not None:
+                self._send_not_modified(validators)
+                return
+        if not self._acquire_upstream_slot():
+            self._send_busy()
+            return
+        try:
+            self._proxy_get()
+        finally:
+            self._release_upstream_slot()
+
+    def _proxy_get(self):
         # Forward GETs to upstream (for OAuth starts and other GET APIs)
         try:
-            target_url = build_target_url(self.path)
-            try:
-                print(f"[dev-proxy] GET {self.path} -> {target_url}")
-            except Exception:
-                pass
-            fwd_headers = {
+            target_url = self._target_url
+            fwd_headers = self._forward_headers({
                 'Accept': self.headers.get('Accept', 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'),
-            }
-            for key in ['Authorization', 'x-api-key', 'x-auth-token', 'x-vercel-protection-bypass']:
-                val = self.headers.get(key)
-                if val:
-                    fwd_headers[key] = val
-            # Inject from environment if not provided by client
-            if AUTHORIZATION and 'Authorization' not in fwd_headers:
-                fwd_headers['Authorization'] = AUTHORIZATION
-            if X_API_KEY and 'x-api-key' not in fwd_headers:
-                fwd_headers['x-api-key'] = X_API_KEY
-            if X_AUTH_TOKEN and 'x-auth-token' not in fwd_headers:
-                fwd_headers['x-auth-token'] = X_AUTH_TOKEN
-            req = Request(target_url, headers=fwd_headers, method='GET')
-            ctx = None
-            try:
-                if INSECURE:
-                    ctx = ssl._create_unverified_context()
-            except Exception:
-                ctx = None
-            try:
-                timeout_sec = float(os.environ.get('DEV_PROXY_UPSTREAM_TIMEOUT', '60') or '60')
-            except Exception:
-                timeout_sec = 60.0
+            })
+            # GETs are never cached or coalesced here, so the upstream may encode for this client and answer
+            # its revalidations directly; POST routes stay identity so stored bodies suit every client.
+            for name in ('Accept-Encoding', 'If-None-Match', 'If-Modified-Since'):
+                value = self.headers.get(name)
+                if value:
+                    fwd_headers[name] = value
+            self._trace_span('receive', self._wall_started, time.time())
             try:
-                if ctx is not None:
-                    resp_ctx = urlopen(req, context=ctx, timeout=timeout_sec)
-                else:
-                    resp_ctx = urlopen(req, timeout=timeout_sec)
-                with resp_ctx as resp:
-                    status = resp.getcode()
-                    data = resp.read()
-                    ct = resp.headers.get('Content-Type', 'text/html; charset=utf-8')
-                    self.send_response(status)
-                    self._set_cors()
-                    # Propagate redirect headers if present
-                    loc = resp.headers.get('Location')
-                    if loc:
-                        self.send_header('Location', loc)
-                    self.send_header('Content-Type', ct)
-                    self.end_headers()
-                    try:
-                        self.wfile.write(data)
-                    except (BrokenPipeError, ConnectionResetError):
-                        pass
+                with _upstream_request('GET', target_url, headers=fwd_headers, timeout=self._upstream_route.timeout, route=self._route) as resp:
+                    self._log_upstream(resp.geturl())
+                    if VALIDATORS is not None:
+                        VALIDATORS.record(target_url, resp.getcode(), resp.headers, self.headers, self._auth_scope())
+                    if resp.getcode() == 304:
+                        METRICS.inc('dev_proxy_not_modified_total', {'route': self._route, 'source': 'upstream'})
+                    self._relay_response(resp, 'text/html; charset=utf-8')
             except HTTPError as e:
+                self._log_upstream(e.filename or target_url)
                 err_text = e.read().decode('utf-8', errors='ignore')
                 # Fallback: if Google OAuth start 404s and we have a client id, redirect directly to Google
-                try:
-                    if self.path.startswith('/oauth/google/start') and GOOGLE_CLIENT_ID and e.code == 404:
-                        try:
-                            sp = urlparse(self.path)
-                            q = dict((k, v[0] if isinstance(v, list) else v) for k, v in ({}).items())
-                            try:
-                                from urllib.parse import parse_qs
-                                q = {k: (v[0] if isinstance(v, list) and v else '') for k, v in parse_qs(sp.query).items()}
-                            except Exception:
-                                q = {}
-                            redirect_uri = q.get('redirect_uri') or f'http://localhost:{PORT}/'
-                            state = q.get('state') or ''
-                            nonce = q.get('nonce') or ''
-                            google_ep = 'https://accounts.google.com/o/oauth2/v2/auth'
-                            from urllib.parse import urlencode
-                            params = {
-                                'client_id': GOOGLE_CLIENT_ID,
-                                'redirect_uri': redirect_uri,
-                                'response_type': GOOGLE_RESPONSE_TYPE,
-                                'scope': GOOGLE_SCOPE,
-                            }
-                            if state:
-                                params['state'] = state
-                            if nonce and ('id_token' in (GOOGLE_RESPONSE_TYPE or '')):
-                                params['nonce'] = nonce
-                            location = google_ep + '?' + urlencode(params)
-                            # Issue 302 redirect to Google directly
-                            self.send_response(302)
-                            self._set_cors()
-                            self.send_header('Location', location)
-                            self.end_headers()
-                            return
-                        except Exception:
-                            pass
-                except Exception:
-                    pass
+                if self.path.startswith('/oauth/google/start') and GOOGLE_CLIENT_ID and e.code == 404:
+                    self._redirect_to_google()
+                    return
                 # Otherwise, relay upstream error
                 self.send_response(e.code)
                 self._set_cors()
@@ -193,38 +3215,14 @@ class ProxyHandler(BaseHTTPRequestHandler):
                 self.send_header('Content-Type', 'text/plain; charset=utf-8')
                 self.end_headers()
                 try:
-                    self.wfile.write((f'Upstream {e.code} {e.reason} at {target_url} - ' + err_text).encode('utf-8'))
+                    self.wfile.write((f'Upstream {e.code} {e.reason} at {e.filename or target_url} - ' + err_text).encode('utf-8'))
                 except (BrokenPipeError, ConnectionResetError):
                     pass
             except URLError as e:
                 # If upstream is unreachable and this is Google start with client id, redirect directly
-                try:
-                    if self.path.startswith('/oauth/google/start') and GOOGLE_CLIENT_ID:
-                        sp = urlparse(self.path)
-                        from urllib.parse import parse_qs, urlencode
-                        qs = parse_qs(sp.query)
-                        redirect_uri = (qs.get('redirect_uri') or [''])[0] or f'http://localhost:{PORT}/'
-                        state = (qs.get('state') or [''])[0]
-                        nonce = (qs.get('nonce') or [''])[0]
-                        google_ep = 'https://accounts.google.com/o/oauth2/v2/auth'
-                        params = {
-                            'client_id': GOOGLE_CLIENT_ID,
-                            'redirect_uri': redirect_uri,
-                            'response_type': GOOGLE_RESPONSE_TYPE,
-                            'scope': GOOGLE_SCOPE,
-                        }
-                        if state:
-                            params['state'] = state
-                        if nonce and ('id_token' in (GOOGLE_RESPONSE_TYPE or '')):
-                            params['nonce'] = nonce
-                        location = google_ep + '?' + urlencode(params)
-                        self.send_response(302)
-                        self._set_cors()
-                        self.send_header('Location', location)
-                        self.end_headers()
-                        return
-                except Exception:
-                    pass
+                if self.path.startswith('/oauth/google/start') and GOOGLE_CLIENT_ID:
+                    self._redirect_to_google()
+                    return
                 # Default 502 relay
                 self.send_response(502)
                 self._set_cors()
@@ -250,95 +3248,210 @@ class ProxyHandler(BaseHTTPRequestHandler):
         self._set_cors()
         self.end_headers()
 
-    def do_POST(self):
-        # Forward POST body and headers to remote target
+    def _follow_flight(self, reader, cacheable) -> bool:
+        """Relay the leader's response for an identical in-flight POST; False if the leader gave up."""
         try:
+            if not reader.wait_started():
+                return False
             try:
-                length = int(self.headers.get('Content-Length', '0'))
-            except ValueError:
-                length = 0
-            body = self.rfile.read(length) if length > 0 else b''
-
-            # Allow full URL override specifically for /generate
-            if TARGET_GENERATE_URL and self.path.rstrip('/') == '/generate':
-                target_url = TARGET_GENERATE_URL
-            else:
-                target_url = build_target_url(self.path)
-            try:
-                print(f"[dev-proxy] POST {self.path} -> {target_url}")
+                print(f"[dev-proxy] POST {self.path} -> coalesced with in-flight request")
             except Exception:
                 pass
+            extra_headers = [('X-Proxy-Coalesced', '1')]
+            if cacheable:
+                extra_headers.append(('X-Proxy-Cache', 'MISS'))
+            try:
+                self._relay_response(reader, 'application/octet-stream', extra_headers)
+            except ConnectionResetError:
+                # Leader lost the upstream (or we fell a whole window behind); the truncated response is all we can give
+                self.close_connection = True
+            return True
+        finally:
+            reader.close()
+
+    def do_POST(self):
+        self._begin_request()
+        self._rate_identity = None
+        try:
+            self._handle_post()
+        finally:
+            if self._rate_identity is not None:
+                RATE_LIMITER.release(self._rate_identity)
+            self._end_request()
+
+    def _client_identity(self):
+        """Rate-limit key: the caller's own credential (hashed, never stored) when that is what authenticates upstream.
+
+        If the proxy injects any env credential, the caller may be running on
+        the proxy's account and a made-up key would buy a fresh bucket per
+        request, so such requests are keyed on the peer address instead.
+        """
+        auth = self._upstream_auth()
+        if auth and not any(injected for _, _, injected in auth):
+            credential = '\n'.join(value for _, value, _ in auth)
+            return 'key:' + hashlib.sha256(credential.encode('utf-8', 'surrogateescape')).hexdigest()[:24]
+        return 'addr:' + self.client_address[0]
+
+    def _admit_client(self, body_read=False) -> bool:
+        """Apply per-client limits to a request that is about to go upstream; answers 429 itself when it isn't admitted.
+
+        Only called once cache hits and coalesced followers are ruled out, so
+        those never use up quota. The concurrency slot is released in do_POST.
+        """
+        route = self.path.split('?')[0].rstrip('/')
+        if RATE_LIMITER is None or not RATE_LIMITER.applies(route):
+            return True
+        identity = self._client_identity()
+        admitted, retry_after, reason = RATE_LIMITER.acquire(identity, route)
+        if admitted:
+            self._rate_identity = identity
+            return True
+        METRICS.inc('dev_proxy_rate_limited_total', {'route': self._route, 'reason': reason})
+        try:
+            print(f"[dev-proxy] POST {self.path} -> 429 ({reason} limit for {identity.split(':', 1)[0]} client)")
+        except Exception:
+            pass
+        if not body_read:
+            self._discard_request_body()
+        self._send_rate_limited(retry_after, reason)
+        return False
+
+    def _send_rate_limited(self, retry_after, reason):
+        if reason == 'concurrency':
+            message = f'Too many concurrent requests from this client (limit {RATE_LIMITER.max_inflight}), retry later'
+        else:
+            message = 'Rate limit exceeded for this route, retry later'
+        payload = message.encode('utf-8')
+        self.send_response(429)
+        self._set_cors()
+        self.send_header('Retry-After', str(max(1, math.ceil(retry_after))))
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _handle_post(self):
+        if TASK_STORE is not None and self.path.split('?')[0].rstrip('/') == '/tasks':
+            self._submit_task()
+            return
+        target_url = self._target_url
+        route = self.path.split('?')[0].rstrip('/')
+        cacheable = RESPONSE_CACHE is not None and route in CACHE_ROUTES
+        coalesce = COALESCER is not None and route in COALESCE_ROUTES
+        body = None
+        key = None
+        if cacheable or coalesce:
+            # Cache and single-flight keys need the whole body, so these routes buffer it instead of streaming
+            stream, _ = self._request_body_stream()
+            body = stream if isinstance(stream, bytes) else b''.join(stream)
+            key = request_key(target_url, body, self.headers.get('Accept', ''), self._auth_scope())
+        if cacheable:
+            hit = RESPONSE_CACHE.get(key)
+            if hit is not None:
+                try:
+                    print(f"[dev-proxy] POST {self.path} -> cache HIT")
+                except Exception:
+                    pass
+                self._send_cached(hit)
+                return
+        flight = None
+        if coalesce:
+            flight, leader = COALESCER.join(key)
+            if not leader:
+                if flight is None:
+                    self._send_busy(f'Proxy busy - {COALESCER.max_followers} coalesced requests already waiting, retry later')
+                    return
+                if self._follow_flight(flight, cacheable):
+                    return
+                # The leader never got a response (e.g. proxy busy); make our own call
+                flight = None
+        if not self._admit_client(body_read=body is not None):
+            if flight is not None:
+                COALESCER.finish(key, flight)
+            return
+        if not self._acquire_upstream_slot():
+            if flight is not None:
+                COALESCER.finish(key, flight)
+            if body is None:
+                self._discard_request_body()
+            self._send_busy()
+            return
+        try:
+            self._proxy_post(target_url, body, key if cacheable else None, flight)
+        finally:
+            self._release_upstream_slot()
+            if flight is not None:
+                COALESCER.finish(key, flight)
+
+    def _proxy_post(self, target_url, body=None, cache_key=None, flight=None):
+        # Forward POST body and headers to remote target
+        try:
+            if body is None:
+                # Stream the upload straight through instead of buffering it in memory
+                body, length = self._request_body_stream()
+            else:
+                length = len(body)
 
             # Forward selected headers
-            fwd_headers = {
+            fwd_headers = self._forward_headers({
                 'Content-Type': self.headers.get('Content-Type', 'application/json'),
                 'Accept': self.headers.get('Accept', 'application/octet-stream'),
-            }
-            # Optional auth headers
-            for key in ['Authorization', 'x-api-key', 'x-auth-token', 'x-vercel-protection-bypass']:
-                val = self.headers.get(key)
-                if val:
-                    fwd_headers[key] = val
-            # Inject from environment if not provided by client
-            if AUTHORIZATION and 'Authorization' not in fwd_headers:
-                fwd_headers['Authorization'] = AUTHORIZATION
-            if X_API_KEY and 'x-api-key' not in fwd_headers:
-                fwd_headers['x-api-key'] = X_API_KEY
-            if X_AUTH_TOKEN and 'x-auth-token' not in fwd_headers:
-                fwd_headers['x-auth-token'] = X_AUTH_TOKEN
+            })
+            # Chunked uploads (length None) go upstream chunked as well
+            if length is not None:
+                fwd_headers['Content-Length'] = str(length)
 
-            req = Request(target_url, data=body, headers=fwd_headers, method='POST')
-            # Optional: disable TLS verification for local testing only
-            ctx = None
+            # Buffered routes have the whole upload by now; streamed ones overlap it with upstream_upload
+            self._trace_span('receive', self._wall_started, time.time(), buffered=isinstance(body, bytes))
             try:
-                if INSECURE:
-                    ctx = ssl._create_unverified_context()
-            except Exception:
-                ctx = None
-            try:
-                # Add a reasonable timeout to avoid hanging connections
-                try:
-                    timeout_sec = float(os.environ.get('DEV_PROXY_UPSTREAM_TIMEOUT', '60') or '60')
-                except Exception:
-                    timeout_sec = 60.0
-                if ctx is not None:
-                    resp_ctx = urlopen(req, context=ctx, timeout=timeout_sec)
-                else:
-                    resp_ctx = urlopen(req, timeout=timeout_sec)
-                with resp_ctx as resp:
-                    status = resp.getcode()
-                    data = resp.read()
+                with _upstream_request('POST', target_url, body=body, headers=fwd_headers, timeout=self._upstream_route.timeout, route=self._route) as resp:
+                    self._log_upstream(resp.geturl())
+                    extra_headers = ()
+                    sinks = []
+                    if cache_key is not None:
+                        extra_headers = (('X-Proxy-Cache', 'MISS'),)
+                        if 200 <= resp.getcode() < 300:
+                            sinks.append(RESPONSE_CACHE.writer(cache_key, resp.getcode(), resp.headers.get('Content-Type', 'application/octet-stream')))
+                    if flight is not None:
+                        flight.start(resp.getcode(), _shared_headers(resp.headers))
+                        sinks.append(flight)
                     # Pipe through content-type for GLB
-                    ct = resp.headers.get('Content-Type', 'application/octet-stream')
-                    self.send_response(status)
-                    self._set_cors()
-                    self.send_header('Content-Type', ct)
-                    self.end_headers()
-                    try:
-                        self.wfile.write(data)
-                    except (BrokenPipeError, ConnectionResetError):
-                        # Client closed connection; ignore gracefully
-                        pass
+                    self._relay_response(resp, 'application/octet-stream', extra_headers, sinks)
             except HTTPError as e:
                 # Relay upstream error text
+                self._log_upstream(e.filename or target_url)
                 err_text = e.read().decode('utf-8', errors='ignore')
+                payload = (f'Upstream {e.code} {e.reason} at {e.filename or target_url} - ' + err_text).encode('utf-8')
+                if flight is not None:
+                    flight.publish(e.code, {'Content-Type': 'text/plain; charset=utf-8'}, payload)
                 self.send_response(e.code)
                 self._set_cors()
                 self.send_header('Content-Type', 'text/plain; charset=utf-8')
                 self.end_headers()
                 try:
-                    self.wfile.write((f'Upstream {e.code} {e.reason} at {target_url} - ' + err_text).encode('utf-8'))
+                    self.wfile.write(payload)
                 except (BrokenPipeError, ConnectionResetError):
                     pass
             except URLError as e:
+                payload = (f'Bad Gateway - {e.reason}').encode('utf-8')
+                if flight is not None:
+                    flight.publish(502, {'Content-Type': 'text/plain; charset=utf-8'}, payload)
                 self.send_response(502)
                 self._set_cors()
                 self.send_header('Content-Type', 'text/plain; charset=utf-8')
                 self.end_headers()
                 try:
-                    self.wfile.write((f'Bad Gateway - {e.reason}').encode('utf-8'))
+                    self.wfile.write(payload)
                 except (BrokenPipeError, ConnectionResetError):
                     pass
+            finally:
+                # Consume whatever upstream didn't so closing the socket doesn't reset the client
+                if not isinstance(body, bytes):
+                    for _ in body:
+                        pass
         except Exception as e:
             # Catch-all to avoid empty responses on unexpected errors
             self.send_response(500)
@@ -359,7 +3472,18 @@ def run():
         print("[dev-proxy] TLS verification: DISABLED (local testing only)")
     else:
         print("[dev-proxy] TLS verification: ENABLED")
-    HTTPServer(addr, ProxyHandler).serve_forever()
+    if SERVE_MODE == 'single':
+        print("[dev-proxy] Serving mode: single-threaded")
+        server = ProxyHTTPServer(addr, ProxyHandler)
+    else:
+        print(f"[dev-proxy] Serving mode: threaded ({WORKERS} workers, max in-flight upstream: {MAX_INFLIGHT or 'unlimited'})")
+        server = PooledHTTPServer(addr, ProxyHandler, workers=WORKERS)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
 
 
 if __name__ == '__main__':
@@ -1027,15 +1027,85 @@ async function generate3DModel() {
           const data = await res.json().catch(() => ({}));
           const taskId = data.task_id || data.id || data.job_id || data.jobId;
           if (!taskId) throw new Error('No task id returned from backend');
-          // Start polling
+          // Start polling (or subscribe to pushed status events when the backend offers them)
           let pollIntervalMs = 5000;
           let timer = null;
+          let deadlineTimer = null;
+          let eventSource = null;
+          let settled = false;
+          let terminalSeen = false;
           let overallStart = Date.now();
           previewLoadingText && (previewLoadingText.textContent = 'Queued...');
           return await new Promise((resolve, reject) => {
+            const finish = (fn, value) => {
+              if (settled) return;
+              settled = true;
+              if (timer) clearInterval(timer);
+              if (deadlineTimer) clearTimeout(deadlineTimer);
+              if (eventSource) eventSource.close();
+              fn(value);
+            };
+            const done = (value) => finish(resolve, value);
+            const fail = (err) => finish(reject, err);
+            // Apply one status document; returns true once the task reached a terminal state
+            const handleStatus = async (json) => {
+              // Backend status conventions: status/state: queued|processing|succeeded|completed|failed
+              const st = json.status || json.state || json.phase;
+              const eta = json.eta_seconds || json.eta || null;
+              if (previewLoadingText) {
+                if (st === 'queued') previewLoadingText.textContent = 'Queued...';
+                else if (st === 'processing' || st === 'running') previewLoadingText.textContent = 'Processing...';
+                else if (eta && isFinite(eta)) previewLoadingText.textContent = `Processing... (≈ ${eta}s)`;
+              }
+              if (st === 'succeeded' || st === 'completed') {
+                terminalSeen = true;
+                if (eventSource) eventSource.close();
+                // Resolve result
+                const url = json.result_url || json.glb_url || json.url;
+                const base64 = (json.result && (json.result.glb_base64 || json.result.glb_data_url)) || json.glb_base64 || json.glb_data_url;
+                if (url) {
+                  const bstart = Date.now();
+                  const bres = await fetch(url, { cache: 'no-store', mode: 'cors' });
+                  const bd = Date.now() - bstart;
+                  window.POLLY_DEBUG_LAST.attempts.push({ url, status: bres.status, statusText: bres.statusText, durationMs: bd });
+                  if (!bres.ok) {
+                    const t = await bres.text().catch(() => '');
+                    fail(new Error(`Result fetch failed: HTTP ${bres.status} ${bres.statusText}${t ? ' - ' + t : ''}`));
+                    return true;
+                  }
+                  const blob = await bres.blob();
+                  done(blob);
+                } else if (base64) {
+                  try {
+                    const raw = base64.includes(',') ? base64.split(',')[1] : base64;
+                    const bytes = atob(raw);
+                    const arr = new Uint8Array(bytes.length);
+                    for (let i = 0; i < bytes.length; i++) arr[i] = bytes.charCodeAt(i);
+                    const blob = new Blob([arr], { type: 'model/gltf-binary' });
+                    done(blob);
+                  } catch (e) {
+                    fail(new Error('Invalid base64 result from backend'));
+                  }
+                } else if (json.result && json.result.bytes) {
+                  const blob = new Blob([json.result.bytes], { type: 'model/gltf-binary' });
+                  done(blob);
+                } else {
+                  fail(new Error('No result in completed task'));
+                }
+                return true;
+              }
+              if (st === 'failed' || st === 'error') {
+                terminalSeen = true;
+                const msg = json.error || json.message || 'Task failed';
+                fail(new Error(msg));
+                return true;
+              }
+              return false;
+            };
             const pollOnce = async () => {
+              if (settled || terminalSeen) return;
               if (Date.now() - overallStart > timeoutMs) {
-                return reject(new Error('Task polling timeout'));
+                return fail(new Error('Task polling timeout'));
               }
               const su = statusUrlFromId(taskId);
               const startPoll = Date.now();
@@ -1047,60 +1117,39 @@ async function generate3DModel() {
                 const text = await pollRes.text();
                 let json = {};
                 try { json = JSON.parse(text); } catch (_) {}
-                // Backend status conventions: status/state: queued|processing|succeeded|completed|failed
-                const st = json.status || json.state || json.phase;
-                const eta = json.eta_seconds || json.eta || null;
-                if (previewLoadingText) {
-                  if (st === 'queued') previewLoadingText.textContent = 'Queued...';
-                  else if (st === 'processing' || st === 'running') previewLoadingText.textContent = 'Processing...';
-                  else if (eta && isFinite(eta)) previewLoadingText.textContent = `Processing... (≈ ${eta}s)`;
-                }
-                if (st === 'succeeded' || st === 'completed') {
-                  // Resolve result
-                  const url = json.result_url || json.glb_url || json.url;
-                  const base64 = (json.result && (json.result.glb_base64 || json.result.glb_data_url)) || json.glb_base64 || json.glb_data_url;
-                  if (url) {
-                    const bstart = Date.now();
-                    const bres = await fetch(url, { cache: 'no-store', mode: 'cors' });
-                    const bd = Date.now() - bstart;
-                    window.POLLY_DEBUG_LAST.attempts.push({ url, status: bres.status, statusText: bres.statusText, durationMs: bd });
-                    if (!bres.ok) {
-                      const t = await bres.text().catch(() => '');
-                      return reject(new Error(`Result fetch failed: HTTP ${bres.status} ${bres.statusText}${t ? ' - ' + t : ''}`));
-                    }
-                    const blob = await bres.blob();
-                    return resolve(blob);
-                  } else if (base64) {
-                    try {
-                      const raw = base64.includes(',') ? base64.split(',')[1] : base64;
-                      const bytes = atob(raw);
-                      const arr = new Uint8Array(bytes.length);
-                      for (let i = 0; i < bytes.length; i++) arr[i] = bytes.charCodeAt(i);
-                      const blob = new Blob([arr], { type: 'model/gltf-binary' });
-                      return resolve(blob);
-                    } catch (e) {
-                      return reject(new Error('Invalid base64 result from backend'));
-                    }
-                  } else if (json.result && json.result.bytes) {
-                    const blob = new Blob([json.result.bytes], { type: 'model/gltf-binary' });
-                    return resolve(blob);
-                  } else {
-                    return reject(new Error('No result in completed task'));
-                  }
-                }
-                if (st === 'failed' || st === 'error') {
-                  const msg = json.error || json.message || 'Task failed';
-                  return reject(new Error(msg));
-                }
+                if (await handleStatus(json)) return;
                 // Continue polling
                 if (!timer) {
                   timer = setInterval(pollOnce, pollIntervalMs);
                 }
               } catch (e) {
-                return reject(e);
+                return fail(e);
               }
             };
-            pollOnce();
+            if (data.events_url && typeof window.EventSource === 'function') {
+              // Server-Sent Events: status changes arrive as they happen instead of on the next 5 s poll
+              deadlineTimer = setTimeout(() => fail(new Error('Task polling timeout')), timeoutMs);
+              try {
+                eventSource = new EventSource(data.events_url);
+                eventSource.addEventListener('status', (ev) => {
+                  let json = {};
+                  try { json = JSON.parse(ev.data); } catch (_) {}
+                  handleStatus(json).catch(fail);
+                });
+                eventSource.onerror = () => {
+                  // Stream dropped before a terminal event: fall back to polling
+                  if (settled || terminalSeen || !eventSource) return;
+                  eventSource.close();
+                  eventSource = null;
+                  pollOnce();
+                };
+              } catch (_) {
+                eventSource = null;
+                pollOnce();
+              }
+            } else {
+              pollOnce();
+            }
           });
         })
         .then(async (blob) => {
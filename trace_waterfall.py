@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Merge span logs from dev_proxy.py and api/test_banana_comic.py into per-request waterfalls.
+
+Both sides write one JSON object per span (trace_id, side, span, start, end,
+ms plus attributes) when tracing is on:
+
+    DEV_PROXY_TRACE=1 DEV_PROXY_TRACE_SAMPLE=1 python dev_proxy.py
+    COMIC_TRACE_SAMPLE=1 python api/test_banana_comic.py --batch entries.jsonl
+
+    python trace_waterfall.py dev_proxy_trace.jsonl generated_comics/trace_spans.jsonl
+    python trace_waterfall.py *.jsonl --slowest 5
+    python trace_waterfall.py *.jsonl --trace 3f2a9c --json
+
+Spans are grouped by trace_id and drawn on one time axis per request, so
+client upload, proxy receive, upstream wait and client decode/save line up.
+Timestamps are wall-clock seconds; logs from different hosts are only as
+aligned as their clocks.
+"""
+import sys
+import json
+import argparse
+
+
+# Order for spans that start at the same instant: outer spans first, then request flow
+SPAN_ORDER = ['request', 'compress', 'rate_limit', 'connect', 'receive', 'upstream_connect', 'upload', 'upstream_upload',
+              'upstream_first_byte', 'first_byte', 'glb_optimize', 'relay', 'download', 'decode', 'save', 'attempt']
+SIDE_ORDER = {'client': 0, 'proxy': 1}
+SKIP_ATTRS = {'trace_id', 'side', 'span', 'start', 'end', 'ms'}
+
+
+def load_spans(paths):
+    """Read every span line from the given files; malformed lines are counted and skipped."""
+    traces = {}
+    bad = 0
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    span = json.loads(line)
+                    float(span['start'])
+                    float(span['end'])
+                    trace_id = str(span['trace_id'])
+                except (ValueError, KeyError, TypeError):
+                    bad += 1
+                    continue
+                traces.setdefault(trace_id, []).append(span)
+    return traces, bad
+
+
+def _sort_key(span):
+    name = span.get('span', '')
+    rank = SPAN_ORDER.index(name) if name in SPAN_ORDER else len(SPAN_ORDER)
+    return span['start'], SIDE_ORDER.get(span.get('side'), 2), rank
+
+
+def waterfall(trace_id, spans):
+    """Spans of one request ordered on a shared axis; offsets and durations in milliseconds."""
+    spans = sorted(spans, key=_sort_key)
+    origin = min(s['start'] for s in spans)
+    total = max(s['end'] for s in spans) - origin
+    rows = []
+    for s in spans:
+        rows.append({
+            'side': s.get('side', '?'),
+            'span': s.get('span', '?'),
+            'offset_ms': round((s['start'] - origin) * 1000, 3),
+            'ms': round((s['end'] - s['start']) * 1000, 3),
+            'attrs': {k: v for k, v in s.items() if k not in SKIP_ATTRS and v is not None},
+        })
+    return {'trace_id': trace_id, 'started': origin, 'total_ms': round(total * 1000, 3),
+            'sides': sorted({r['side'] for r in rows}), 'spans': rows}
+
+
+def _format_attrs(attrs):
+    return ' '.join(f'{k}={v}' for k, v in sorted(attrs.items()))
+
+
+def render(fall, width):
+    """Text waterfall: one bar per span, scaled to the request's total duration."""
+    total = fall['total_ms'] or 1e-9
+    lines = [f"trace {fall['trace_id']}  total {fall['total_ms']:.1f} ms  ({', '.join(fall['sides'])})"]
+    for row in fall['spans']:
+        start = int(row['offset_ms'] / total * width)
+        length = max(1, int(round(row['ms'] / total * width)))
+        bar = ' ' * min(start, width - 1) + '█' * min(length, width - min(start, width - 1))
+        lines.append(f"  {row['side']:<6} {row['span']:<20} {row['offset_ms']:>9.1f} {row['ms']:>9.1f} ms  "
+                     f"|{bar:<{width}}|  {_format_attrs(row['attrs'])}".rstrip())
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge dev proxy and comic client span logs into per-request waterfalls.')
+    parser.add_argument('files', nargs='+', help='JSONL span logs (any mix of proxy and client files)')
+    parser.add_argument('--trace', help='only show traces whose id starts with this prefix')
+    parser.add_argument('--slowest', type=int, help='show the N slowest requests instead of the most recent')
+    parser.add_argument('--limit', type=int, default=20, help='maximum number of requests to show (default 20)')
+    parser.add_argument('--width', type=int, default=50, help='bar width in characters')
+    parser.add_argument('--json', action='store_true', help='print the merged waterfalls as JSON')
+    args = parser.parse_args()
+
+    traces, bad = load_spans(args.files)
+    if args.trace:
+        traces = {k: v for k, v in traces.items() if k.startswith(args.trace)}
+    falls = [waterfall(trace_id, spans) for trace_id, spans in traces.items()]
+    if args.slowest:
+        falls.sort(key=lambda f: f['total_ms'], reverse=True)
+        falls = falls[:args.slowest]
+    else:
+        falls.sort(key=lambda f: f['started'])
+        falls = falls[-args.limit:]
+    if bad:
+        print(f'[trace] skipped {bad} malformed line(s)', file=sys.stderr)
+    if args.json:
+        print(json.dumps(falls, indent=2, ensure_ascii=False))
+        return
+    if not falls:
+        print('[trace] no matching spans', file=sys.stderr)
+        return
+    print('\n\n'.join(render(fall, max(10, args.width)) for fall in falls))
+
+
+if __name__ == '__main__':
+    main()